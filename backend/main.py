@@ -1,9 +1,12 @@
-from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, UploadFile, File, Request, Response, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Date, text
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, literal, union_all, create_engine, Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Date, Double, Index, text, and_, or_, func, insert, select, update, case
 from sqlalchemy.orm import DeclarativeBase, sessionmaker, Session, relationship
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.sql.selectable import Select, CompoundSelect
 from datetime import datetime, timedelta, date
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -12,8 +15,25 @@ from pydantic import BaseModel, EmailStr
 import os
 from dotenv import load_dotenv
 import json
+import re
+import sys
+import unicodedata
 import asyncio
+import heapq
+import math
+import threading
+import time
+import base64
+import binascii
+import hashlib
+import secrets
 from pathlib import Path
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, defaultdict, namedtuple
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -31,6 +51,53 @@ except Exception as e:
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Cache do usuário autenticado (por jti do token): evita o SELECT em cada requisição
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+# bcrypt fora do event loop: threads dedicadas e fila limitada (além dela, 503)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+# Home timeline: acima deste número de seguidores o autor não faz fan-out para
+# seguidores, os posts dele são mesclados na leitura
+FANOUT_MAX_FOLLOWERS = int(os.getenv("FANOUT_MAX_FOLLOWERS", "5000"))
+TIMELINE_BACKFILL_POSTS = int(os.getenv("TIMELINE_BACKFILL_POSTS", "20"))
+# Posts recentes dos autores "pull" mantidos em memória para a mesclagem na leitura
+PULL_CACHE_AUTHORS = int(os.getenv("PULL_CACHE_AUTHORS", "1000"))
+PULL_CACHE_POSTS = int(os.getenv("PULL_CACHE_POSTS", "200"))
+
+# Feed ranqueado: a cada RANK_DECAY_SECONDS de idade um post precisa de 10x mais
+# engajamento para manter a posição
+RANK_DECAY_SECONDS = float(os.getenv("RANK_DECAY_SECONDS", "45000"))
+RANK_AFFINITY_WEIGHT = float(os.getenv("RANK_AFFINITY_WEIGHT", "1.0"))
+RANK_AFFINITY_DAYS = int(os.getenv("RANK_AFFINITY_DAYS", "90"))
+RANK_INTERVAL_SECONDS = float(os.getenv("RANK_INTERVAL_SECONDS", "5"))
+RANK_BATCH_SIZE = int(os.getenv("RANK_BATCH_SIZE", "500"))
+# Paginação do feed ranqueado: a primeira página congela a ordem dos N primeiros posts
+RANKED_WINDOW_POSTS = int(os.getenv("RANKED_WINDOW_POSTS", "300"))
+RANKED_WINDOW_TTL_SECONDS = int(os.getenv("RANKED_WINDOW_TTL_SECONDS", "900"))
+RANKED_WINDOW_CACHE = int(os.getenv("RANKED_WINDOW_CACHE", "10000"))
+
+# Cache do grafo social: quantos usuários manter em memória (LRU)
+SOCIAL_GRAPH_CACHE_USERS = int(os.getenv("SOCIAL_GRAPH_CACHE_USERS", "20000"))
+
+# Sugestões de amizade ("pessoas que você talvez conheça")
+SUGGESTIONS_CACHE_USERS = int(os.getenv("SUGGESTIONS_CACHE_USERS", "5000"))
+SUGGESTIONS_TTL_SECONDS = int(os.getenv("SUGGESTIONS_TTL_SECONDS", "900"))
+
+# Busca de usuários: índice em memória (padrão) ou FULLTEXT do MySQL
+USER_SEARCH_FULLTEXT = os.getenv("USER_SEARCH_FULLTEXT", "false").lower() in ("1", "true", "yes")
+USER_SEARCH_CANDIDATES = int(os.getenv("USER_SEARCH_CANDIDATES", "2000"))
+# innodb_ft_min_token_size do servidor: termos mais curtos o FULLTEXT ignora, vão por LIKE
+USER_SEARCH_FULLTEXT_MIN_TOKEN = int(os.getenv("USER_SEARCH_FULLTEXT_MIN_TOKEN", "3"))
+# Autocomplete (@menções, marcação em stories): teto de memória do array de prefixos
+AUTOCOMPLETE_MAX_MB = float(os.getenv("AUTOCOMPLETE_MAX_MB", "64"))
+AUTOCOMPLETE_CANDIDATES = int(os.getenv("AUTOCOMPLETE_CANDIDATES", "500"))
+
+# Contadores de user_stats: intervalo da reconciliação em background (0 desliga)
+USER_STATS_RECONCILE_SECONDS = int(os.getenv("USER_STATS_RECONCILE_SECONDS", "21600"))
+# GET /metrics só responde com este token (Authorization: Bearer ...); sem ele fica desligado
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 # Database Configuration
 def get_database_url():
@@ -54,21 +121,96 @@ def get_database_url():
     return f"mysql+pymysql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
 
 SQLALCHEMY_DATABASE_URL = get_database_url()
-
-# Create engine with MySQL optimizations
+# Réplica de leitura (opcional): GETs leem dela, exceto logo após uma escrita do mesmo usuário
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+
+# Create engine with MySQL optimizations (SQLite is accepted for tests and benchmarks)
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    engine_options = {"connect_args": {"check_same_thread": False}}
+else:
+    engine_options = {
+        "pool_pre_ping": True,  # Verify connections before use
+        "pool_recycle": 300,  # Recycle connections every 5 minutes
+        "pool_size": 10,  # Connection pool size
+        "max_overflow": 20,  # Maximum overflow connections
+        "connect_args": {
+            "charset": "utf8mb4",
+            "use_unicode": True,
+        },
+    }
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     echo=False,  # Set to True for SQL debugging
-    pool_pre_ping=True,  # Verify connections before use
-    pool_recycle=300,  # Recycle connections every 5 minutes
-    pool_size=10,  # Connection pool size
-    max_overflow=20,  # Maximum overflow connections
-    connect_args={
-        "charset": "utf8mb4",
-        "use_unicode": True,
-    }
+    **engine_options
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+replica_engine = create_engine(DATABASE_REPLICA_URL, echo=False, **engine_options) if DATABASE_REPLICA_URL else None
+
+class AppSession(Session):
+    """Session class of both factories, so the after-commit hooks also run under AsyncSession.
+
+    When info["replica_bind"] is set (GET requests, see get_db) plain SELECTs go
+    to the replica until the session writes anything; from then on every
+    statement uses the primary, so the request reads its own writes.
+    Inside primary_reads() SELECTs also use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica_bind")
+        if replica is not None and not self.info.get("wrote"):
+            if isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None:
+                if not self.info.get("primary_reads"):
+                    return replica
+            else:
+                # flush, DML, SELECT ... FOR UPDATE, text(): primário daqui em diante
+                self.info["wrote"] = True
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+@contextmanager
+def primary_reads(db: Session):
+    """Read from the primary inside the block, whatever the session's routing.
+
+    For loads that fill process-wide caches: the _writes guards only see writes
+    made by this process, not replication lag, so a lagging replica read would
+    stay cached until something evicts it.
+    """
+    db.info["primary_reads"] = db.info.get("primary_reads", 0) + 1
+    try:
+        yield db
+    finally:
+        db.info["primary_reads"] -= 1
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AppSession)
+
+# Async engine: same database through an async driver (aiomysql em produção, aiosqlite em testes)
+def get_async_database_url(url: str, override: str = "ASYNC_DATABASE_URL") -> str:
+    explicit = os.getenv(override)
+    if explicit:
+        return explicit
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    return url.replace("mysql+pymysql://", "mysql+aiomysql://", 1)
+
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    async_engine_options = {}
+else:
+    async_engine_options = {
+        "pool_pre_ping": True,
+        "pool_recycle": 300,
+        "pool_size": 10,
+        "max_overflow": 20,
+        "connect_args": {"charset": "utf8mb4"},
+    }
+try:
+    async_engine = create_async_engine(get_async_database_url(SQLALCHEMY_DATABASE_URL), echo=False, **async_engine_options)
+    async_replica_engine = create_async_engine(get_async_database_url(DATABASE_REPLICA_URL, "ASYNC_DATABASE_REPLICA_URL"), echo=False, **async_engine_options) \
+        if DATABASE_REPLICA_URL else None
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False, sync_session_class=AppSession)
+except ImportError as e:
+    print(f"⚠️ Driver assíncrono indisponível ({e}): get_async_db vai rodar a sessão síncrona em threads")
+    async_engine = None
+    async_replica_engine = None
+    AsyncSessionLocal = None
 
 class Base(DeclarativeBase):
     pass
@@ -152,6 +294,14 @@ class Post(Base):
     
     author = relationship("User", backref="posts")
 
+    __table_args__ = (
+        # Paginação por cursor: cada página é um range scan em (created_at, id)
+        Index("ix_posts_author_type_created", "author_id", "post_type", "created_at", "id"),
+        Index("ix_posts_created_id", "created_at", "id"),
+        # Filtro de visibilidade: privacy = 'public' / 'friends' por autor
+        Index("ix_posts_privacy_author_created", "privacy", "author_id", "created_at"),
+    )
+
 class Story(Base):
     __tablename__ = "stories"
     
@@ -171,6 +321,10 @@ class Story(Base):
     
     author = relationship("User", backref="stories")
 
+    __table_args__ = (
+        Index("ix_stories_expires_at", "expires_at"),
+    )
+
 class StoryView(Base):
     __tablename__ = "story_views"
     
@@ -211,6 +365,42 @@ class Friendship(Base):
     requester = relationship("User", foreign_keys=[requester_id])
     addressee = relationship("User", foreign_keys=[addressee_id])
 
+    __table_args__ = (
+        Index("ix_friendships_requester_status", "requester_id", "status", "addressee_id"),
+        Index("ix_friendships_addressee_status", "addressee_id", "status", "requester_id"),
+        Index("ix_friendships_pair", "requester_id", "addressee_id"),
+    )
+
+class FriendEdge(Base):
+    """Accepted friendships mirrored in both directions: (a, b) and (b, a).
+
+    Membership is a primary key point lookup and a friend list is one index range.
+    Kept in sync by accept/remove/block.
+    """
+    __tablename__ = "friend_edges"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    friend_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    friendship_id = Column(Integer, ForeignKey("friendships.id"), nullable=False)
+    since = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Lista de amigos paginada por (since, friend_id)
+        Index("ix_friend_edges_user_since", "user_id", "since", "friend_id"),
+    )
+
+class UserStats(Base):
+    """Denormalized per-user counters, read with one primary key lookup"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    friends_count = Column(Integer, nullable=False, default=0, server_default="0")
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
+    posts_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # a timeline já foi semeada uma vez; vazia depois disso é porque não há o que mostrar
+    timeline_seeded = Column(Boolean, nullable=False, default=False, server_default="0")
+
 class Reaction(Base):
     __tablename__ = "reactions"
     
@@ -224,6 +414,19 @@ class Reaction(Base):
     user = relationship("User", backref="reactions")
     post = relationship("Post", backref="reactions")
 
+    __table_args__ = (
+        Index("ix_reactions_post_type_created", "post_id", "reaction_type", "created_at", "id"),
+        Index("uq_reactions_user_post", "user_id", "post_id", unique=True),
+    )
+
+class PostReactionCount(Base):
+    """Incremental per-post reaction histogram kept by the reaction write paths"""
+    __tablename__ = "post_reaction_counts"
+
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    reaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class Comment(Base):
     __tablename__ = "comments"
     
@@ -238,6 +441,12 @@ class Comment(Base):
     post = relationship("Post", backref="comments")
     parent = relationship("Comment", remote_side=[id], backref="replies")
 
+    __table_args__ = (
+        Index("ix_comments_post_created", "post_id", "created_at", "id"),
+        Index("ix_comments_post_parent_created", "post_id", "parent_id", "created_at", "id"),
+        Index("ix_comments_parent_created", "parent_id", "created_at", "id"),
+    )
+
 class Share(Base):
     __tablename__ = "shares"
     
@@ -291,6 +500,11 @@ class Block(Base):
     blocker = relationship("User", foreign_keys=[blocker_id], backref="blocking")
     blocked = relationship("User", foreign_keys=[blocked_id], backref="blocked_by")
 
+    __table_args__ = (
+        Index("ix_blocks_blocker_blocked", "blocker_id", "blocked_id"),
+        Index("ix_blocks_blocked_blocker", "blocked_id", "blocker_id"),
+    )
+
 class Follow(Base):
     __tablename__ = "follows"
 
@@ -302,6 +516,38 @@ class Follow(Base):
     follower = relationship("User", foreign_keys=[follower_id], backref="following")
     followed = relationship("User", foreign_keys=[followed_id], backref="followers")
 
+    __table_args__ = (
+        Index("ix_follows_follower_followed", "follower_id", "followed_id"),
+        Index("ix_follows_followed_follower", "followed_id", "follower_id"),
+    )
+
+class TimelineEntry(Base):
+    """Materialized home timeline: one row per (reader, post) delivered on write"""
+    __tablename__ = "home_timeline"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    post_id = Column(Integer, ForeignKey("posts.id"), primary_key=True)
+    author_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)  # created_at do post, chave de ordenação
+    score = Column(Double, nullable=False, default=0, server_default="0")  # feed ranqueado: hot score + affinity
+    affinity = Column(Double, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index("ix_home_timeline_user_created", "user_id", "created_at", "post_id"),
+        Index("ix_home_timeline_user_score", "user_id", "score", "post_id"),
+        Index("ix_home_timeline_user_author", "user_id", "author_id"),
+        Index("ix_home_timeline_post", "post_id"),
+    )
+
+class UserAffinity(Base):
+    """How much a user interacts with an author, used by the ranked feed"""
+    __tablename__ = "user_affinity"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    author_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    score = Column(Double, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class StoryTag(Base):
     __tablename__ = "story_tags"
 
@@ -396,6 +642,7 @@ class CommentResponse(BaseModel):
     created_at: datetime
     reactions_count: int = 0
     replies: List['CommentResponse'] = []
+    replies_next_cursor: Optional[str] = None  # continua em /comments/{id}/replies?after=
     
     class Config:
         from_attributes = True
@@ -410,6 +657,10 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
+class TokenVerification(BaseModel):
+    valid: bool
+    user: UserResponse
+
 class LoginRequest(BaseModel):
     email: str
     password: str
@@ -420,7 +671,7 @@ class PostCreate(BaseModel):
     media_type: Optional[str] = None
     media_url: Optional[str] = None
     media_metadata: Optional[str] = None
-    privacy: str = "public"  # public, friends, private
+    privacy: Optional[str] = None  # public, friends, private (default: user's post_visibility)
     is_profile_update: Optional[bool] = False
     is_cover_update: Optional[bool] = False
 
@@ -437,10 +688,17 @@ class PostResponse(BaseModel):
     shares_count: int
     is_profile_update: Optional[bool] = False
     is_cover_update: Optional[bool] = False
+    reaction_summary: Optional[Dict[str, Any]] = None  # incluído com include_reactions=true
     
     class Config:
         from_attributes = True
 
+class ReactionSummaryRequest(BaseModel):
+    post_ids: List[int]
+
+class RelationshipBatchRequest(BaseModel):
+    user_ids: List[int]
+
 class StoryCreate(BaseModel):
     content: Optional[str] = None
     media_type: Optional[str] = None
@@ -592,6 +850,43 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordHasher:
+    """Dedicated pool for bcrypt calls with admission control.
+
+    bcrypt releases the GIL, so a few threads use the cores without touching
+    the event loop or the default threadpool. Once `workers + max_queue` calls
+    are in flight new ones are refused with 503 instead of piling up.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                metrics.incr("password_hash.rejected")
+                raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+            self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            metrics.observe_ms("password_hash", (time.perf_counter() - started) * 1000)
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -599,19 +894,380 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    to_encode.setdefault("jti", secrets.token_hex(8))
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Keyset (cursor) pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(sort_key: Union[datetime, float], item_id: int) -> str:
+    """Encode the (created_at or score, id) sort key of a row as an opaque cursor"""
+    key = sort_key.isoformat() if isinstance(sort_key, datetime) else sort_key
+    raw = json.dumps([key, item_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Decode a cursor produced by encode_cursor back into (sort_key, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_key, item_id = json.loads(raw)
+        if isinstance(sort_key, str):
+            return datetime.fromisoformat(sort_key), int(item_id)
+        return float(sort_key), int(item_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_condition(created_col, id_col, cursor: str, newer: bool):
+    """Build the range condition for rows strictly after/before a cursor.
+
+    Written in expanded AND/OR form instead of a row constructor so MySQL
+    can turn it into an index range scan.
+    """
+    created_at, item_id = decode_cursor(cursor)
+    if newer:
+        return and_(created_col >= created_at, or_(created_col > created_at, and_(created_col == created_at, id_col > item_id)))
+    return and_(created_col <= created_at, or_(created_col < created_at, and_(created_col == created_at, id_col < item_id)))
+
+def keyset_paginate(query, created_col, id_col, before: Optional[str] = None, after: Optional[str] = None,
+                    limit: int = DEFAULT_PAGE_SIZE, descending: bool = True):
+    """Return one page of `query` ordered by (created_at, id).
+
+    `before` selects rows with a smaller sort key than the cursor and `after`
+    rows with a larger one; the page always comes back in list order
+    (newest first when `descending`). Returns (rows, next_cursor, prev_cursor):
+    next_cursor continues the list, prev_cursor goes back towards its start.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    scan_descending = descending
+    if before:
+        query = query.filter(keyset_condition(created_col, id_col, before, newer=False))
+        scan_descending = True
+    elif after:
+        query = query.filter(keyset_condition(created_col, id_col, after, newer=True))
+        scan_descending = False
+
+    if scan_descending:
+        query = query.order_by(created_col.desc(), id_col.desc())
+    else:
+        query = query.order_by(created_col.asc(), id_col.asc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    reversed_scan = scan_descending != descending
+    if reversed_scan:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    first, last = rows[0], rows[-1]
+    next_cursor = encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key)) if (has_more or reversed_scan) else None
+    prev_cursor = encode_cursor(getattr(first, created_col.key), getattr(first, id_col.key))
+    return rows, next_cursor, prev_cursor
+
+def set_cursor_headers(response: Response, next_cursor: Optional[str], prev_cursor: Optional[str]):
+    """Expose pagination cursors without changing the list response body"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
+
+# Metrics: in-process counters and gauges, exposed by GET /metrics
+class Metrics:
+    LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Counter = Counter()
+        self.gauges: Dict[str, float] = {}
+        self.latencies: Dict[str, List[int]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe_ms(self, name: str, elapsed_ms: float):
+        """Count a latency in the first bucket that holds it (the last slot is +Inf)"""
+        with self._lock:
+            buckets = self.latencies.setdefault(name, [0] * (len(self.LATENCY_BUCKETS_MS) + 1))
+            buckets[bisect_left(self.LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            latencies = {
+                name: dict(zip([f"le_{bound}ms" for bound in self.LATENCY_BUCKETS_MS] + ["inf"], buckets))
+                for name, buckets in self.latencies.items()
+            }
+            return {"counters": dict(self.counters), "gauges": dict(self.gauges), "latencies": latencies}
+
+metrics = Metrics()
+
+# Conditional GET: in-process version stamps per resource, bumped after commit
+BOOT_ID = secrets.token_hex(4)  # muda a cada restart, invalidando ETags antigos
+
+class ResourceVersions:
+    """Version counter per resource key, e.g. ("posts",) or ("profile", user_id)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[tuple, int] = {}
+
+    def get(self, key: tuple) -> int:
+        return self._versions.get(key, 0)
+
+    def bump(self, keys):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+resource_versions = ResourceVersions()
+
+def resource_keys(obj) -> List[tuple]:
+    """Resource versions affected by a change to an ORM object"""
+    if isinstance(obj, Post):
+        return [("posts",), ("post", obj.id), ("profile", obj.author_id)]
+    if isinstance(obj, (Reaction, Comment, Share, PostReactionCount)):
+        return [("posts",), ("post", obj.post_id)]
+    if isinstance(obj, TimelineEntry):
+        return [("posts",)]
+    if isinstance(obj, (Story, StoryView)):
+        return [("stories",)]
+    if isinstance(obj, Notification):
+        return [("notifications", obj.recipient_id)]
+    if isinstance(obj, User):
+        # cards de autor aparecem no feed e nos stories
+        return [("profile", obj.id), ("users",)]
+    if isinstance(obj, FriendEdge):
+        return [("posts",), ("profile", obj.user_id), ("profile", obj.friend_id)]
+    if isinstance(obj, Friendship):
+        return [("posts",), ("profile", obj.requester_id), ("profile", obj.addressee_id)]
+    if isinstance(obj, Block):
+        return [("posts",), ("profile", obj.blocker_id), ("profile", obj.blocked_id)]
+    if isinstance(obj, Follow):
+        return [("posts",), ("profile", obj.follower_id), ("profile", obj.followed_id)]
+    return []
+
+def mark_changed(db: Session, *keys: tuple):
+    """Record resource changes made with bulk statements the ORM events can't see"""
+    db.info.setdefault("changed_resources", set()).update(keys)
+
+@event.listens_for(AppSession, "after_flush")
+def collect_changed_resources(session, flush_context):
+    changed = session.info.setdefault("changed_resources", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.update(resource_keys(obj))
+
+@event.listens_for(AppSession, "after_commit")
+def bump_changed_resources(session):
+    changed = session.info.pop("changed_resources", None)
+    if changed:
+        resource_versions.bump(changed)
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_changed_resources(session):
+    session.info.pop("changed_resources", None)
+
+def resource_etag(viewer_id: int, request: Request, keys: List[tuple], extra: Any = None) -> str:
+    """Weak ETag from the boot id, the viewer, the query string and resource versions"""
+    parts = [BOOT_ID, viewer_id, str(request.url.query), extra] + [(key, resource_versions.get(key)) for key in keys]
+    return 'W/"' + hashlib.sha1(repr(parts).encode()).hexdigest()[:20] + '"'
+
+def not_modified(request: Request, response: Response, etag: str, db: Union[Session, AsyncSession]) -> Optional[Response]:
+    """Return a 304 response when the client already has this version, else tag the response.
+
+    A body read from the replica may be older than the in-process version, so
+    those responses go out untagged (the 304 itself reads nothing and stays valid).
+    """
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+    if getattr(db, "sync_session", db).info.get("replica_bind") is None:
+        response.headers["ETag"] = etag
+    return None
+
 # Database dependency
-def get_db():
+READ_METHODS = ("GET", "HEAD")
+
+class RecentWriters:
+    """Token subjects that wrote in the last REPLICA_PIN_SECONDS: their reads stay on the primary"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._deadlines: Dict[str, float] = {}
+
+    def pin(self, subject: str):
+        now = time.monotonic()
+        with self._lock:
+            self._deadlines[subject] = now + self.window_seconds
+            if len(self._deadlines) > 10000:
+                self._deadlines = {key: deadline for key, deadline in self._deadlines.items() if deadline > now}
+
+    def is_pinned(self, subject: Optional[str]) -> bool:
+        if subject is None:
+            return False
+        deadline = self._deadlines.get(subject)
+        return deadline is not None and deadline > time.monotonic()
+
+recent_writers = RecentWriters(REPLICA_PIN_SECONDS)
+
+def token_subject(request: Request) -> Optional[str]:
+    """Subject of the bearer token, without failing the request when it is missing or invalid"""
+    authorization = request.headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    try:
+        return jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        return None
+
+def reads_from_replica(request: Request) -> bool:
+    if replica_engine is None or request.method not in READ_METHODS:
+        return False
+    if recent_writers.is_pinned(token_subject(request)):
+        metrics.incr("db.replica.pinned_requests")
+        return False
+    metrics.incr("db.replica.requests")
+    return True
+
+def get_db(request: Request):
     db = SessionLocal()
+    if reads_from_replica(request):
+        db.info["replica_bind"] = replica_engine
     try:
         yield db
     finally:
         db.close()
 
+class ThreadedSession:
+    """AsyncSession stand-in when no async driver is installed: run_sync in a worker thread"""
+
+    def __init__(self):
+        self.sync_session = SessionLocal(expire_on_commit=False)
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        self.sync_session.close()
+
+def open_async_session():
+    return AsyncSessionLocal() if AsyncSessionLocal is not None else ThreadedSession()
+
+async def get_async_db(request: Request):
+    """Async session for async def handlers.
+
+    Handlers pass their query code to `await db.run_sync(fn)`, which calls
+    fn(sync_session) without blocking the event loop, so the sync helpers
+    (timelines, caches, counters) are reused as they are.
+    """
+    db = open_async_session()
+    if reads_from_replica(request):
+        db.sync_session.info["replica_bind"] = async_replica_engine.sync_engine if AsyncSessionLocal is not None else replica_engine
+    try:
+        yield db
+    finally:
+        await db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """Run fn(session, ...) in a short-lived async session (WebSocket, dependencies)"""
+    db = open_async_session()
+    try:
+        return await db.run_sync(fn, *args, **kwargs)
+    finally:
+        await db.close()
+
 # Get current user
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class Principal:
+    """Read-only snapshot of the authenticated user's columns (password hash left out).
+
+    Safe to share between requests: no session, no lazy loads. Handlers that
+    modify the user depend on get_current_user_row instead.
+    """
+    __slots__ = tuple(column.key for column in User.__table__.columns if column.key != "password_hash")
+
+    def __init__(self, user: User):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(user, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Principal is read-only; depend on get_current_user_row to modify the user")
+
+class PrincipalCache:
+    """Short-TTL LRU of principals keyed by token jti, dropped after commit when the user row changes"""
+
+    def __init__(self, capacity: int, ttl_seconds: float):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._keys_by_user: Dict[int, set] = defaultdict(set)
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, principal: Principal, writes_before: int):
+        with self._lock:
+            # o usuário mudou enquanto era carregado: não guardar o snapshot velho
+            if self.writes != writes_before:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(key)
+            self._keys_by_user[principal.id].add(key)
+            while len(self._entries) > self.capacity:
+                old_key, (_, old) = self._entries.popitem(last=False)
+                self._keys_by_user[old.id].discard(old_key)
+                if not self._keys_by_user[old.id]:
+                    del self._keys_by_user[old.id]
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self.writes += 1
+            for user_id in user_ids:
+                for key in self._keys_by_user.pop(user_id, ()):
+                    self._entries.pop(key, None)
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+
+@event.listens_for(AppSession, "after_flush")
+def collect_changed_principals(session, flush_context):
+    changed = session.info.setdefault("changed_principals", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+@event.listens_for(AppSession, "after_commit")
+def invalidate_changed_principals(session):
+    changed = session.info.pop("changed_principals", None)
+    if changed:
+        principal_cache.invalidate(changed)
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_changed_principals(session):
+    session.info.pop("changed_principals", None)
+
+def decode_access_token(token: str) -> tuple:
+    """(email, cache key) from a valid token; raises 401 otherwise"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -624,12 +1280,80 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
+    # tokens emitidos antes do jti: o próprio token serve de chave
+    return email, payload.get("jti") or token
+
+def load_principal(db: Session, token: str) -> Principal:
+    email, key = decode_access_token(token)
+    principal = principal_cache.get(key)
+    if principal is not None and principal.email == email:
+        return principal
+
+    writes_before = principal_cache.writes
     user = db.query(User).filter(User.email == email).first()
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    principal = Principal(user)
+    principal_cache.put(key, principal, writes_before)
+    return principal
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Authenticated user as a cached Principal; a cache hit runs no query"""
+    _, key = decode_access_token(token)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        return principal
+    return await run_db(load_principal, token)
+
+async def get_current_user_row(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> User:
+    """Authenticated user as an ORM row in the request session, for handlers that modify it"""
+    email, _ = decode_access_token(token)
+    user = db.query(User).filter(User.email == email).first()
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+# JSON serialization: orjson quando instalado, json padrão como fallback
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_bytes(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dumps_text(content: Any) -> str:
+    return dumps_bytes(content).decode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (datetimes are encoded natively)"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+def fast_response(content: Any, response: Optional[Response] = None) -> FastJSONResponse:
+    """Send already-built dicts as is, skipping response_model validation.
+
+    Headers set on the injected `response` (cursors, ETag) are carried over.
+    """
+    return FastJSONResponse(content, headers=dict(response.headers) if response is not None else None)
+
 # WebSocket Manager
 class ConnectionManager:
     def __init__(self):
@@ -657,7 +1381,7 @@ class ConnectionManager:
                     self.active_connections[user_id].remove(connection)
 
     async def send_notification(self, user_id: int, notification: dict):
-        message = json.dumps({
+        message = dumps_text({
             "type": "notification",
             **notification
         })
@@ -665,7 +1389,7 @@ class ConnectionManager:
 
     async def send_message(self, user_id: int, message_data: dict):
         """Enviar mensagem em tempo real"""
-        message = json.dumps({
+        message = dumps_text({
             "type": "message",
             **message_data
         })
@@ -673,7 +1397,7 @@ class ConnectionManager:
 
     async def send_typing_indicator(self, user_id: int, typing_data: dict):
         """Enviar indicador de digitação"""
-        message = json.dumps({
+        message = dumps_text({
             "type": "typing",
             **typing_data
         })
@@ -681,7 +1405,7 @@ class ConnectionManager:
 
     async def send_message_read(self, user_id: int, read_data: dict):
         """Notificar que mensagem foi lida"""
-        message = json.dumps({
+        message = dumps_text({
             "type": "message_read",
             **read_data
         })
@@ -689,24 +1413,14 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
-def verify_websocket_token(token: str):
+def verify_websocket_token_in(db: Session, token: str) -> Optional[Principal]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-        
-        db = SessionLocal()
-        try:
-            user = db.query(User).filter(User.email == email).first()
-            return user
-        finally:
-            db.close()
-    except JWTError:
+        return load_principal(db, token)
+    except HTTPException:
         return None
 
 # FastAPI app
-app = FastAPI(title="Backend API", version="1.0.0")
+app = FastAPI(title="Backend API", version="1.0.0", default_response_class=FastJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -715,8 +1429,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Total-Count", "ETag"],
 )
 
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    """After a write, send the same user's GETs to the primary for REPLICA_PIN_SECONDS"""
+    if replica_engine is None or request.method in READ_METHODS:
+        return await call_next(request)
+    subject = token_subject(request)
+    if subject:
+        recent_writers.pin(subject)
+    response = await call_next(request)
+    if subject:
+        # a janela conta a partir do fim da escrita
+        recent_writers.pin(subject)
+    return response
+
 # Create uploads directories if they don't exist
 os.makedirs("uploads/stories", exist_ok=True)
 os.makedirs("uploads/posts", exist_ok=True)
@@ -728,47 +1457,56 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Auth routes
 @app.post("/auth/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    # bcrypt no pool de hash, consultas via run_sync: nada disso roda no event loop
     try:
         # Verifica se o usuário já existe
-        db_user = db.query(User).filter(User.email == user.email).first()
-        if db_user:
+        exists = await db.run_sync(lambda session: session.query(User.id).filter(User.email == user.email).first())
+        if exists:
             raise HTTPException(status_code=400, detail="Email already registered")
         
         # Cria novo usuário
-        hashed_password = hash_password(user.password)
+        hashed_password = await hash_password_async(user.password)
         
         # Converte birth_date string para objeto date
         birth_date_obj = user.get_birth_date_as_date() if user.birth_date else None
         
-        db_user = User(
-            first_name=user.first_name,
-            last_name=user.last_name,
-            email=user.email,
-            password_hash=hashed_password,
-            gender=user.gender,
-            birth_date=birth_date_obj,
-            phone=user.phone,
-            is_active=True,
-            created_at=datetime.utcnow(),
-            last_seen=datetime.utcnow()
-        )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        def insert_user(session: Session) -> User:
+            db_user = User(
+                first_name=user.first_name,
+                last_name=user.last_name,
+                email=user.email,
+                password_hash=hashed_password,
+                gender=user.gender,
+                birth_date=birth_date_obj,
+                phone=user.phone,
+                is_active=True,
+                created_at=datetime.utcnow(),
+                last_seen=datetime.utcnow()
+            )
+            session.add(db_user)
+            try:
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            session.refresh(db_user)
+            return db_user
         
-        return db_user
+        return await db.run_sync(insert_user)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Erro no registro: {e}")
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
 @app.post("/auth/login", response_model=Token)
-def login(login_data: LoginRequest, db: Session = Depends(get_db)):
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
     try:
-        user = db.query(User).filter(User.email == login_data.email).first()
+        user = await db.run_sync(lambda session: session.query(User.id, User.email, User.password_hash, User.is_active)
+                                 .filter(User.email == login_data.email).first())
         
-        if not user or not verify_password(login_data.password, user.password_hash):
+        if not user or not await verify_password_async(login_data.password, user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password",
@@ -791,7 +1529,7 @@ def login(login_data: LoginRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Erro interno do servidor: {str(e)}")
 
 @app.get("/auth/me", response_model=UserResponse)
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 @app.get("/auth/check-email")
@@ -800,7 +1538,7 @@ def check_email_exists(email: str, db: Session = Depends(get_db)):
     return {"exists": user is not None}
 
 @app.get("/auth/check-username")
-def check_username_exists(username: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def check_username_exists(username: str, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     user = db.query(User).filter(
         User.username == username,
         User.id != current_user.id  # Exclude current user
@@ -813,13 +1551,1204 @@ def check_username_exists_public(username: str, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.username == username).first()
     return {"exists": user is not None}
 
-@app.get("/auth/verify-token")
-async def verify_token(current_user: User = Depends(get_current_user)):
+@app.get("/auth/verify-token", response_model=TokenVerification)
+async def verify_token(current_user: Principal = Depends(get_current_user)):
     return {"valid": True, "user": current_user}
 
+# User cards (batched author hydration)
+def user_card(user) -> Dict[str, Any]:
+    """Compact public representation of a user embedded in list responses"""
+    return {
+        "id": user.id,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "username": user.username,
+        "avatar": user.avatar
+    }
+
+def load_user_cards(db: Session, user_ids) -> Dict[int, Dict[str, Any]]:
+    """Fetch the cards of every user a response needs with a single IN query"""
+    ids = {user_id for user_id in user_ids if user_id is not None}
+    if not ids:
+        return {}
+    rows = db.query(User.id, User.first_name, User.last_name, User.username, User.avatar).filter(User.id.in_(ids)).all()
+    return {row.id: user_card(row) for row in rows}
+
+def card_for(cards: Dict[int, Dict[str, Any]], user_id: int) -> Dict[str, Any]:
+    return cards.get(user_id) or {"id": user_id, "first_name": "", "last_name": "", "username": None, "avatar": None}
+
+def count_story_views(db: Session, story_ids: List[int]) -> Dict[int, int]:
+    """Views per story for a whole list in one grouped query"""
+    if not story_ids:
+        return {}
+    rows = db.query(StoryView.story_id, func.count(StoryView.id)).filter(StoryView.story_id.in_(story_ids)) \
+        .group_by(StoryView.story_id).all()
+    return {story_id: count for story_id, count in rows}
+
+# Colunas lidas pelas listas de posts: linhas leves em vez de entidades ORM
+POST_COLUMNS = (
+    Post.id, Post.author_id, Post.content, Post.post_type, Post.media_type, Post.media_url, Post.created_at,
+    Post.reactions_count, Post.comments_count, Post.shares_count, Post.is_profile_update, Post.is_cover_update,
+)
+
+def post_to_response(post, cards: Dict[int, Dict[str, Any]], reaction_summary: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """PostResponse-shaped dict from a Post or a POST_COLUMNS row"""
+    return {
+        "id": post.id,
+        "author": card_for(cards, post.author_id),
+        "content": post.content,
+        "post_type": post.post_type,
+        "media_type": post.media_type,
+        "media_url": post.media_url,
+        "created_at": post.created_at,
+        "reactions_count": post.reactions_count or 0,
+        "comments_count": post.comments_count or 0,
+        "shares_count": post.shares_count or 0,
+        "is_profile_update": post.is_profile_update,
+        "is_cover_update": post.is_cover_update,
+        "reaction_summary": reaction_summary,
+    }
+
+def posts_to_response(db: Session, posts: List[Any], viewer_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Build a post list; when viewer_id is given each post embeds its reaction summary"""
+    cards = load_user_cards(db, (post.author_id for post in posts))
+    summaries = reaction_summaries(db, [post.id for post in posts], viewer_id) if viewer_id else {}
+    return [post_to_response(post, cards, summaries.get(post.id)) for post in posts]
+
+# Threaded comments
+DEFAULT_REPLIES_PER_COMMENT = 3
+COMMENT_COLUMNS = (Comment.id, Comment.content, Comment.author_id, Comment.parent_id, Comment.created_at)
+
+def comment_to_response(comment, cards: Dict[int, Dict[str, Any]], replies: Optional[List[Dict[str, Any]]] = None,
+                        replies_next_cursor: Optional[str] = None) -> Dict[str, Any]:
+    """CommentResponse-shaped dict from a COMMENT_COLUMNS row"""
+    return {
+        "id": comment.id,
+        "content": comment.content,
+        "author": card_for(cards, comment.author_id),
+        "created_at": comment.created_at,
+        "reactions_count": 0,  # TODO: Add comment reactions
+        "replies": replies or [],
+        "replies_next_cursor": replies_next_cursor,
+    }
+
+def first_replies(db: Session, parent_ids: List[int], per_parent: int) -> Dict[int, List[Any]]:
+    """Up to per_parent + 1 oldest replies of each comment in one windowed query"""
+    if not parent_ids or per_parent <= 0:
+        return {}
+    position = func.row_number().over(
+        partition_by=Comment.parent_id,
+        order_by=(Comment.created_at.asc(), Comment.id.asc())
+    ).label("position")
+    ranked = select(*COMMENT_COLUMNS, position).where(Comment.parent_id.in_(parent_ids)).subquery()
+    rows = db.query(ranked).filter(ranked.c.position <= per_parent + 1) \
+        .order_by(ranked.c.parent_id, ranked.c.position).all()
+    replies: Dict[int, List[Any]] = {}
+    for row in rows:
+        replies.setdefault(row.parent_id, []).append(row)
+    return replies
+
+def load_comment_thread(db: Session, post_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                        limit: int = DEFAULT_PAGE_SIZE, replies_limit: int = DEFAULT_REPLIES_PER_COMMENT):
+    """A page of top-level comments (oldest first) with the first replies of each.
+
+    Three queries whatever the page size: top-level page, windowed replies, author cards.
+    Returns (comments, next_cursor, prev_cursor).
+    """
+    replies_limit = max(0, min(replies_limit, MAX_PAGE_SIZE))
+    query = db.query(*COMMENT_COLUMNS).filter(Comment.post_id == post_id, Comment.parent_id.is_(None))
+    comments, next_cursor, prev_cursor = keyset_paginate(query, Comment.created_at, Comment.id, before, after, limit, descending=False)
+    replies = first_replies(db, [comment.id for comment in comments], replies_limit)
+    cards = load_user_cards(db, [comment.author_id for comment in comments] +
+                            [reply.author_id for rows in replies.values() for reply in rows])
+
+    result = []
+    for comment in comments:
+        rows = replies.get(comment.id, [])
+        shown = rows[:replies_limit]
+        more = encode_cursor(shown[-1].created_at, shown[-1].id) if len(rows) > replies_limit else None
+        result.append(comment_to_response(comment, cards, [comment_to_response(reply, cards) for reply in shown], more))
+    return result, next_cursor, prev_cursor
+
+# Reaction summaries
+MAX_REACTION_SUMMARY_POSTS = 100
+
+def reaction_summaries(db: Session, post_ids: List[int], viewer_id: int) -> Dict[int, Dict[str, Any]]:
+    """Per-type histogram and the viewer's own reaction for many posts.
+
+    Costs one read of post_reaction_counts plus one lookup of the viewer's
+    reactions, whatever the number of posts.
+    """
+    summaries = {post_id: {"reactions": {}, "user_reaction": None, "total": 0} for post_id in post_ids}
+    if not summaries:
+        return summaries
+
+    counts = db.query(PostReactionCount.post_id, PostReactionCount.reaction_type, PostReactionCount.count) \
+        .filter(PostReactionCount.post_id.in_(summaries.keys()), PostReactionCount.count > 0).all()
+    for post_id, reaction_type, count in counts:
+        summaries[post_id]["reactions"][reaction_type] = count
+        summaries[post_id]["total"] += count
+
+    own = db.query(Reaction.post_id, Reaction.reaction_type) \
+        .filter(Reaction.user_id == viewer_id, Reaction.post_id.in_(summaries.keys())).all()
+    for post_id, reaction_type in own:
+        summaries[post_id]["user_reaction"] = reaction_type
+
+    return summaries
+
+# Dialect-specific statements (MySQL em produção, SQLite em scripts locais)
+def insert_ignore(model):
+    """INSERT that skips rows violating a unique key (MySQL/SQLite)"""
+    return insert(model).prefix_with("OR IGNORE" if engine.dialect.name == "sqlite" else "IGNORE")
+
+def upsert(model, values: Dict[str, Any], on_conflict: Dict[str, Any], conflict_columns: Optional[List[str]] = None):
+    """Single-statement INSERT ... ON DUPLICATE KEY UPDATE (ON CONFLICT DO UPDATE on SQLite)
+
+    conflict_columns só é usado no SQLite; por padrão é a chave primária.
+    """
+    if engine.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        conflict_columns = conflict_columns or [column.name for column in model.__table__.primary_key.columns]
+        return sqlite_insert(model).values(**values).on_conflict_do_update(index_elements=conflict_columns, set_=on_conflict)
+    from sqlalchemy.dialects.mysql import insert as mysql_insert
+    return mysql_insert(model).values(**values).on_duplicate_key_update(**on_conflict)
+
+# Denormalized post counters (reactions_count, comments_count, shares_count)
+def bump_post_counter(db: Session, post_id: int, column, delta: int):
+    """Adjust a post counter inside the caller's transaction, never going below zero"""
+    new_value = func.coalesce(column, 0) + delta
+    db.query(Post).filter(Post.id == post_id).update(
+        {column: case((new_value < 0, 0), else_=new_value)},
+        synchronize_session=False
+    )
+    mark_changed(db, ("posts",), ("post", post_id))
+    ranking_change(db, "post", post_id)
+
+def adjust_reaction_histogram(db: Session, post_id: int, reaction_type: str, delta: int):
+    """Move a post_reaction_counts bucket by delta inside the caller's transaction"""
+    if delta > 0:
+        db.execute(upsert(
+            PostReactionCount,
+            {"post_id": post_id, "reaction_type": reaction_type, "count": delta},
+            {"count": PostReactionCount.count + delta}
+        ))
+    elif delta < 0:
+        new_value = PostReactionCount.count + delta
+        db.query(PostReactionCount).filter(
+            PostReactionCount.post_id == post_id,
+            PostReactionCount.reaction_type == reaction_type
+        ).update({PostReactionCount.count: case((new_value < 0, 0), else_=new_value)}, synchronize_session=False)
+
+def move_reaction(db: Session, post_id: int, old_type: Optional[str], new_type: Optional[str]):
+    """Keep reactions_count and the histogram in sync with one reaction change"""
+    if old_type == new_type:
+        return
+    if old_type:
+        adjust_reaction_histogram(db, post_id, old_type, -1)
+    if new_type:
+        adjust_reaction_histogram(db, post_id, new_type, 1)
+    if old_type is None or new_type is None:
+        bump_post_counter(db, post_id, Post.reactions_count, 1 if new_type else -1)
+
+REACTION_WRITE_ATTEMPTS = 3
+
+def set_reaction(db: Session, user_id: int, post_id: int, reaction_type: Optional[str], toggle: bool = False):
+    """Set, toggle or (reaction_type=None) remove a user's reaction on a post.
+
+    Returns (previous_type, current_type); counters are updated in the same transaction.
+
+    A first reaction is one INSERT IGNORE on the (user_id, post_id) unique key, and
+    its rowcount says whether the row was new. Only when it already existed is the
+    old type read, with FOR UPDATE on that existing row: a record lock, never the gap
+    lock a locking read of a missing row takes on MySQL (two concurrent first
+    reactions deadlocked on it). On SQLite the INSERT already holds the write lock.
+    """
+    match = (Reaction.user_id == user_id, Reaction.post_id == post_id)
+    now = datetime.utcnow()
+    if reaction_type is None and db.query(Reaction.id).filter(*match).first() is None:
+        return None, None
+
+    for _ in range(REACTION_WRITE_ATTEMPTS):
+        if reaction_type is not None:
+            inserted = db.execute(insert_ignore(Reaction).values(
+                user_id=user_id, post_id=post_id, reaction_type=reaction_type, created_at=now, updated_at=now
+            )).rowcount
+            if inserted:
+                previous, current = None, reaction_type
+                break
+
+        previous = db.query(Reaction.reaction_type).filter(*match).with_for_update().scalar()
+        if previous is None and reaction_type is not None:
+            continue  # apagada entre o INSERT e o SELECT: tenta inserir de novo
+        if reaction_type is None or (toggle and previous == reaction_type):
+            if previous is not None:
+                db.query(Reaction).filter(*match).delete(synchronize_session=False)
+            current = None
+        else:
+            db.query(Reaction).filter(*match).update(
+                {Reaction.reaction_type: reaction_type, Reaction.updated_at: now}, synchronize_session=False
+            )
+            current = reaction_type
+        break
+    else:
+        raise HTTPException(status_code=409, detail="Reaction changed concurrently, try again")
+
+    move_reaction(db, post_id, previous, current)
+    mark_changed(db, ("posts",), ("post", post_id))
+    ranking_change(db, "interaction", user_id, post_id)
+    return previous, current
+
+def reaction_state(db: Session, post_id: int, current: Optional[str]) -> Dict[str, Any]:
+    """Post reaction state returned by the write endpoints"""
+    reactions = dict(db.query(PostReactionCount.reaction_type, PostReactionCount.count).filter(
+        PostReactionCount.post_id == post_id,
+        PostReactionCount.count > 0
+    ).all())
+    return {"user_reaction": current, "reactions": reactions, "reactions_count": sum(reactions.values())}
+
+def dedupe_reactions(db: Session) -> int:
+    """Delete duplicate (user_id, post_id) reactions, keeping the newest, and fix the counters"""
+    groups = db.query(Reaction.user_id, Reaction.post_id, func.max(Reaction.id)) \
+        .group_by(Reaction.user_id, Reaction.post_id) \
+        .having(func.count(Reaction.id) > 1).all()
+    removed = 0
+    for user_id, post_id, keep_id in groups:
+        stale = db.query(Reaction.id, Reaction.reaction_type).filter(
+            Reaction.user_id == user_id,
+            Reaction.post_id == post_id,
+            Reaction.id != keep_id
+        ).all()
+        for _, reaction_type in stale:
+            move_reaction(db, post_id, reaction_type, None)
+        db.query(Reaction).filter(Reaction.id.in_([reaction_id for reaction_id, _ in stale])).delete(synchronize_session=False)
+        removed += len(stale)
+    db.commit()
+    return removed
+
+def rebuild_reaction_histograms(db: Session, batch_size: int = 1000) -> int:
+    """Repair job: rebuild post_reaction_counts from the reactions table, in post id batches"""
+    max_id = db.query(func.max(Post.id)).scalar() or 0
+    rebuilt = 0
+    for start in range(0, max_id, batch_size):
+        end = start + batch_size
+        db.query(PostReactionCount).filter(PostReactionCount.post_id > start, PostReactionCount.post_id <= end).delete(synchronize_session=False)
+        counts = db.query(Reaction.post_id, Reaction.reaction_type, func.count(Reaction.id)) \
+            .filter(Reaction.post_id > start, Reaction.post_id <= end) \
+            .group_by(Reaction.post_id, Reaction.reaction_type).all()
+        if counts:
+            db.execute(insert(PostReactionCount), [
+                {"post_id": post_id, "reaction_type": reaction_type, "count": count}
+                for post_id, reaction_type, count in counts
+            ])
+        db.commit()
+        rebuilt += len(counts)
+    return rebuilt
+
+def recount_post_counters(db: Session, batch_size: int = 1000) -> int:
+    """Repair job: recompute every post counter from the source tables, in id batches"""
+    reactions = select(func.count(Reaction.id)).where(Reaction.post_id == Post.id).scalar_subquery()
+    comments = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    shares = select(func.count(Share.id)).where(Share.post_id == Post.id).scalar_subquery()
+
+    max_id = db.query(func.max(Post.id)).scalar() or 0
+    updated = 0
+    for start in range(0, max_id, batch_size):
+        updated += db.query(Post).filter(Post.id > start, Post.id <= start + batch_size).update(
+            {Post.reactions_count: reactions, Post.comments_count: comments, Post.shares_count: shares},
+            synchronize_session=False
+        )
+        db.commit()
+    return updated
+
+# Denormalized user counters (user_stats)
+# contador -> coluna que identifica o dono da linha na tabela de origem
+USER_STAT_SOURCES = {
+    "friends_count": FriendEdge.user_id,
+    "followers_count": Follow.followed_id,
+    "following_count": Follow.follower_id,
+    "posts_count": Post.author_id,
+}
+
+def adjust_user_stat(db: Session, user_id: int, column, delta: int):
+    """Move a user_stats counter by delta inside the caller's transaction, never below zero"""
+    if delta > 0:
+        db.execute(upsert(UserStats, {"user_id": user_id, column.key: delta}, {column.key: column + delta}))
+    elif delta < 0:
+        new_value = column + delta
+        db.query(UserStats).filter(UserStats.user_id == user_id).update(
+            {column: case((new_value < 0, 0), else_=new_value)}, synchronize_session=False
+        )
+    mark_changed(db, ("profile", user_id))
+
+def adjust_follow_counters(db: Session, follower_id: int, followed_id: int, delta: int):
+    adjust_user_stat(db, follower_id, UserStats.following_count, delta)
+    adjust_user_stat(db, followed_id, UserStats.followers_count, delta)
+
+def get_user_counters(db: Session, user_id: int) -> Dict[str, int]:
+    stats = db.query(UserStats).filter(UserStats.user_id == user_id).first()
+    return user_counters(stats)
+
+def user_counters(stats: Optional[UserStats]) -> Dict[str, int]:
+    return {column: (getattr(stats, column) or 0) if stats else 0 for column in USER_STAT_SOURCES}
+
+def reconcile_user_stats(db: Session, batch_size: int = 1000) -> Dict[str, int]:
+    """Repair job: compare user_stats with the source tables in user id batches and fix drift.
+
+    Drifted rows are rewritten with correlated COUNT subqueries, so writes that
+    commit while the job runs are not overwritten with a stale value.
+    Returns how many users had a wrong value, per counter.
+    """
+    drift = {column: 0 for column in USER_STAT_SOURCES}
+    recount = {
+        getattr(UserStats, column): select(func.count()).where(owner == UserStats.user_id).scalar_subquery()
+        for column, owner in USER_STAT_SOURCES.items()
+    }
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.query(User.id).filter(User.id > last_id).order_by(User.id).limit(batch_size).all()]
+        if not ids:
+            break
+        stored = {stats.user_id: user_counters(stats) for stats in db.query(UserStats).filter(UserStats.user_id.in_(ids)).all()}
+        actual = {
+            column: dict(db.query(owner, func.count()).filter(owner.in_(ids)).group_by(owner).all())
+            for column, owner in USER_STAT_SOURCES.items()
+        }
+        missing = [user_id for user_id in ids if user_id not in stored]
+        if missing:
+            db.execute(insert_ignore(UserStats), [{"user_id": user_id} for user_id in missing])
+        drifted = []
+        for user_id in ids:
+            current = stored.get(user_id) or user_counters(None)
+            wrong = [column for column in USER_STAT_SOURCES if current[column] != actual[column].get(user_id, 0)]
+            for column in wrong:
+                drift[column] += 1
+            if wrong:
+                drifted.append(user_id)
+        if drifted:
+            db.query(UserStats).filter(UserStats.user_id.in_(drifted)).update(recount, synchronize_session=False)
+            mark_changed(db, *[("profile", user_id) for user_id in drifted])
+        db.commit()
+        last_id = ids[-1]
+
+    for column, wrong in drift.items():
+        metrics.incr(f"user_stats.drift.{column}", wrong)
+        metrics.set(f"user_stats.last_drift.{column}", wrong)
+    metrics.incr("user_stats.reconcile_runs")
+    metrics.set("user_stats.last_reconcile_at", time.time())
+    return drift
+
+def run_user_stats_reconcile() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        return reconcile_user_stats(db)
+    except Exception as e:
+        print(f"⚠️ Erro ao reconciliar contadores dos usuários: {e}")
+        db.rollback()
+        return {}
+    finally:
+        db.close()
+
+async def user_stats_reconcile_worker():
+    """Periodically repair user_stats drift (missed writes, manual edits, crashes mid-request)"""
+    while True:
+        await asyncio.sleep(USER_STATS_RECONCILE_SECONDS)
+        await asyncio.to_thread(run_user_stats_reconcile)
+
+@app.on_event("startup")
+async def start_user_stats_reconcile_worker():
+    if USER_STATS_RECONCILE_SECONDS > 0:
+        asyncio.create_task(user_stats_reconcile_worker())
+
+# Social graph cache: adjacency sets per user, loaded lazily, updated after commit
+class IntSet:
+    """Sorted array of ints: 8 bytes per member, O(log n) membership"""
+    __slots__ = ("_items",)
+
+    def __init__(self, values=()):
+        self._items = array("q", sorted(set(values)))
+
+    def __contains__(self, value) -> bool:
+        index = bisect_left(self._items, value)
+        return index < len(self._items) and self._items[index] == value
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, value: int):
+        index = bisect_left(self._items, value)
+        if index == len(self._items) or self._items[index] != value:
+            self._items.insert(index, value)
+
+    def discard(self, value: int):
+        index = bisect_left(self._items, value)
+        if index < len(self._items) and self._items[index] == value:
+            del self._items[index]
+
+class Adjacency:
+    """Relationship sets of one user"""
+    __slots__ = ("friends", "followers", "following", "blocking", "blocked_by")
+
+    def __init__(self, rows=()):
+        grouped = {name: [] for name in self.__slots__}
+        for kind, other_id in rows:
+            grouped[kind].append(other_id)
+        for name, values in grouped.items():
+            setattr(self, name, IntSet(values))
+
+    def is_blocked(self, other_id: int) -> bool:
+        """Block in either direction"""
+        return other_id in self.blocking or other_id in self.blocked_by
+
+class SocialGraphCache:
+    """LRU of per-user adjacency sets for friends, followers, following and blocks.
+
+    Writes are applied incrementally to the users already loaded; see graph_change().
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[int, Adjacency]" = OrderedDict()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, user_id: int) -> Adjacency:
+        with self._lock:
+            adjacency = self._users.get(user_id)
+            if adjacency is not None:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return adjacency
+            self.misses += 1
+            writes_before = self._writes
+
+        with primary_reads(db):
+            adjacency = Adjacency(self._load(db, user_id))
+        with self._lock:
+            # uma escrita durante a leitura pode ter deixado o resultado velho: não guardar
+            if self._writes == writes_before:
+                self._users[user_id] = adjacency
+                while len(self._users) > self.capacity:
+                    self._users.popitem(last=False)
+        return adjacency
+
+    def _load(self, db: Session, user_id: int):
+        """All five relationship lists in one round trip"""
+        return db.execute(union_all(
+            select(literal("friends"), FriendEdge.friend_id).where(FriendEdge.user_id == user_id),
+            select(literal("followers"), Follow.follower_id).where(Follow.followed_id == user_id),
+            select(literal("following"), Follow.followed_id).where(Follow.follower_id == user_id),
+            select(literal("blocking"), Block.blocked_id).where(Block.blocker_id == user_id),
+            select(literal("blocked_by"), Block.blocker_id).where(Block.blocked_id == user_id),
+        )).all()
+
+    def apply(self, changes):
+        """Apply committed (op, a, b) changes to the loaded users"""
+        with self._lock:
+            self._writes += 1
+            for op, user_a, user_b in changes:
+                first, second = self._users.get(user_a), self._users.get(user_b)
+                if op in ("add_friend", "remove_friend"):
+                    update = IntSet.add if op == "add_friend" else IntSet.discard
+                    if first is not None:
+                        update(first.friends, user_b)
+                    if second is not None:
+                        update(second.friends, user_a)
+                elif op in ("add_follow", "remove_follow"):
+                    update = IntSet.add if op == "add_follow" else IntSet.discard
+                    if first is not None:
+                        update(first.following, user_b)
+                    if second is not None:
+                        update(second.followers, user_a)
+                elif op in ("add_block", "remove_block"):
+                    update = IntSet.add if op == "add_block" else IntSet.discard
+                    if first is not None:
+                        update(first.blocking, user_b)
+                    if second is not None:
+                        update(second.blocked_by, user_a)
+
+    def peek(self, user_id: int) -> Optional[Adjacency]:
+        """Adjacency of a user only if already loaded (no query, no LRU touch)"""
+        return self._users.get(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._writes += 1
+            self._users.clear()
+
+social_graph = SocialGraphCache(SOCIAL_GRAPH_CACHE_USERS)
+
+def graph_change(db: Session, op: str, user_a: int, user_b: int):
+    """Queue a relationship change for the graph cache; applied only if the transaction commits"""
+    db.info.setdefault("graph_changes", []).append((op, user_a, user_b))
+
+@event.listens_for(AppSession, "after_commit")
+def apply_graph_changes(session):
+    changes = session.info.pop("graph_changes", None)
+    if changes:
+        social_graph.apply(changes)
+        suggestion_cache.mark_changes(changes)
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_graph_changes(session):
+    session.info.pop("graph_changes", None)
+
+def is_blocked(db: Session, user_a: int, user_b: int) -> bool:
+    """True when either user blocked the other"""
+    return social_graph.get(db, user_a).is_blocked(user_b)
+
+MAX_RELATIONSHIP_BATCH = 500
+
+def relationship_flags(db: Session, viewer_id: int, user_ids) -> Dict[int, Dict[str, Any]]:
+    """Viewer's relationship with many users: graph cache plus one pending-requests query"""
+    ids = {user_id for user_id in user_ids if user_id is not None and user_id != viewer_id}
+    if not ids:
+        return {}
+    adjacency = social_graph.get(db, viewer_id)
+    sent = db.query(Friendship.addressee_id).filter(
+        Friendship.requester_id == viewer_id, Friendship.status == "pending", Friendship.addressee_id.in_(ids))
+    received = db.query(Friendship.requester_id).filter(
+        Friendship.addressee_id == viewer_id, Friendship.status == "pending", Friendship.requester_id.in_(ids))
+    pending_sent = {row[0] for row in sent.all()}
+    pending_received = {row[0] for row in received.all()}
+
+    return {
+        user_id: {
+            "is_friend": user_id in adjacency.friends,
+            "request_sent": user_id in pending_sent,
+            "request_received": user_id in pending_received,
+            "is_following": user_id in adjacency.following,
+            "is_followed_by": user_id in adjacency.followers,
+            "is_blocked": user_id in adjacency.blocking,
+            "has_blocked_you": user_id in adjacency.blocked_by,
+        }
+        for user_id in ids
+    }
+
+# Friend edges (friend_edges espelha as amizades aceitas nas duas direções)
+def find_friendship(db: Session, user_a: int, user_b: int) -> Optional[Friendship]:
+    """Friendship row between two users in either direction (two point lookups)"""
+    forward = db.query(Friendship).filter(Friendship.requester_id == user_a, Friendship.addressee_id == user_b)
+    backward = db.query(Friendship).filter(Friendship.requester_id == user_b, Friendship.addressee_id == user_a)
+    return forward.union_all(backward).first()
+
+def are_friends(db: Session, user_a: int, user_b: int) -> bool:
+    return user_b in social_graph.get(db, user_a).friends
+
+def add_friend_edges(db: Session, friendship: Friendship):
+    since = friendship.updated_at or datetime.utcnow()
+    graph_change(db, "add_friend", friendship.requester_id, friendship.addressee_id)
+    result = db.execute(insert_ignore(FriendEdge), [
+        {"user_id": friendship.requester_id, "friend_id": friendship.addressee_id, "friendship_id": friendship.id, "since": since},
+        {"user_id": friendship.addressee_id, "friend_id": friendship.requester_id, "friendship_id": friendship.id, "since": since},
+    ])
+    if result.rowcount:
+        adjust_user_stat(db, friendship.requester_id, UserStats.friends_count, 1)
+        adjust_user_stat(db, friendship.addressee_id, UserStats.friends_count, 1)
+
+def remove_friend_edges(db: Session, user_a: int, user_b: int):
+    graph_change(db, "remove_friend", user_a, user_b)
+    deleted = db.query(FriendEdge).filter(or_(
+        and_(FriendEdge.user_id == user_a, FriendEdge.friend_id == user_b),
+        and_(FriendEdge.user_id == user_b, FriendEdge.friend_id == user_a)
+    )).delete(synchronize_session=False)
+    if deleted:
+        adjust_user_stat(db, user_a, UserStats.friends_count, -1)
+        adjust_user_stat(db, user_b, UserStats.friends_count, -1)
+
+def rebuild_friend_edges(db: Session, batch_size: int = 1000) -> int:
+    """Repair job: rebuild friend_edges from accepted friendships"""
+    db.query(FriendEdge).delete(synchronize_session=False)
+    written = 0
+    last_id = 0
+    while True:
+        friendships = db.query(Friendship.id, Friendship.requester_id, Friendship.addressee_id, Friendship.updated_at, Friendship.created_at) \
+            .filter(Friendship.status == "accepted", Friendship.id > last_id) \
+            .order_by(Friendship.id).limit(batch_size).all()
+        if not friendships:
+            break
+        rows = []
+        for friendship in friendships:
+            since = friendship.updated_at or friendship.created_at
+            rows.append({"user_id": friendship.requester_id, "friend_id": friendship.addressee_id, "friendship_id": friendship.id, "since": since})
+            rows.append({"user_id": friendship.addressee_id, "friend_id": friendship.requester_id, "friendship_id": friendship.id, "since": since})
+        db.execute(insert_ignore(FriendEdge), rows)
+        written += len(rows)
+        last_id = friendships[-1].id
+    db.commit()
+    social_graph.clear()
+    return written
+
+# Home timeline (fan-out on write, merge on read for high-follower authors)
+def get_friend_ids(db: Session, user_id: int) -> List[int]:
+    """Ids of accepted friends of a user"""
+    return list(social_graph.get(db, user_id).friends)
+
+def get_blocked_ids(db: Session, user_id: int) -> set:
+    """Users blocked by or blocking this user"""
+    adjacency = social_graph.get(db, user_id)
+    return set(adjacency.blocking) | set(adjacency.blocked_by)
+
+POST_PRIVACIES = ("public", "friends", "private")
+
+def friend_ids_select(user_id: int):
+    """Subquery of accepted friend ids (one friend_edges range)"""
+    return select(FriendEdge.friend_id).where(FriendEdge.user_id == user_id)
+
+def blocked_ids_select(user_id: int):
+    """Subquery of users blocked by or blocking this user"""
+    blocked = select(Block.blocked_id).where(Block.blocker_id == user_id)
+    blockers = select(Block.blocker_id).where(Block.blocked_id == user_id)
+    return blocked.union_all(blockers)
+
+def visible_posts_filter(viewer_id: int):
+    """SQL condition for posts the viewer may see, for queries spanning many authors"""
+    return or_(
+        Post.author_id == viewer_id,
+        and_(
+            Post.author_id.notin_(blocked_ids_select(viewer_id)),
+            or_(
+                Post.privacy == "public",
+                and_(Post.privacy == "friends", Post.author_id.in_(friend_ids_select(viewer_id)))
+            )
+        )
+    )
+
+def author_posts_filter(db: Session, viewer_id: int, author_id: int):
+    """Privacy condition for one author's posts, resolved up front so the
+    (privacy, author_id, created_at) index serves the page directly"""
+    if viewer_id == author_id:
+        return Post.author_id == author_id
+    if author_id in get_blocked_ids(db, viewer_id):
+        return Post.id.is_(None)
+    is_friend = are_friends(db, viewer_id, author_id)
+    return and_(Post.author_id == author_id, Post.privacy.in_(visible_privacies(viewer_id, author_id, is_friend)))
+
+def is_pull_author(db: Session, user_id: int) -> bool:
+    """Authors above FANOUT_MAX_FOLLOWERS (by the user_stats counter) are merged on read instead of fanned out"""
+    followers = db.query(UserStats.followers_count).filter(UserStats.user_id == user_id).scalar() or 0
+    return followers > FANOUT_MAX_FOLLOWERS
+
+def timeline_audience(db: Session, post: Post) -> set:
+    """Users whose home timeline receives the post at write time"""
+    audience = {post.author_id}
+    if post.privacy == "private":
+        return audience
+
+    if is_pull_author(db, post.author_id):
+        # Sem passar pelo social_graph: a adjacência inclui todos os seguidores
+        audience.update(db.execute(friend_ids_select(post.author_id)).scalars())
+        if post.privacy == "public":
+            metrics.incr("feed.pull.posts")
+        return audience - set(db.execute(blocked_ids_select(post.author_id)).scalars())
+
+    audience.update(get_friend_ids(db, post.author_id))
+    if post.privacy == "public":
+        audience.update(social_graph.get(db, post.author_id).followers)
+
+    return audience - get_blocked_ids(db, post.author_id)
+
+def fan_out_post(post_id: int):
+    """Background task: deliver a new post to its audience's timelines"""
+    db = SessionLocal()
+    try:
+        post = db.query(Post).filter(Post.id == post_id).first()
+        if not post:
+            return
+        score = hot_score(post.created_at, post.reactions_count, post.comments_count, post.shares_count)
+        rows = [
+            {"user_id": user_id, "post_id": post.id, "author_id": post.author_id, "created_at": post.created_at, "score": score}
+            for user_id in timeline_audience(db, post)
+        ]
+        for start in range(0, len(rows), 1000):
+            db.execute(insert_ignore(TimelineEntry), rows[start:start + 1000])
+        mark_changed(db, ("posts",))
+        db.commit()
+        metrics.incr("feed.push.posts")
+        metrics.incr("feed.push.rows", len(rows))
+        # o worker aplica a afinidade de cada leitor
+        ranking_queue.mark_post(post.id)
+    except Exception as e:
+        print(f"⚠️ Erro no fan-out do post {post_id}: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+def copy_recent_posts(db: Session, user_id: int, author_id: int, privacies: List[str]):
+    """Insert an author's most recent posts with the given privacy levels into a timeline"""
+    posts = db.query(Post.id, Post.created_at, Post.reactions_count, Post.comments_count, Post.shares_count) \
+        .filter(Post.author_id == author_id, Post.privacy.in_(privacies)) \
+        .order_by(Post.created_at.desc(), Post.id.desc()).limit(TIMELINE_BACKFILL_POSTS).all()
+    if posts:
+        db.execute(insert_ignore(TimelineEntry), [
+            {"user_id": user_id, "post_id": post.id, "author_id": author_id, "created_at": post.created_at,
+             "score": hot_score(post.created_at, post.reactions_count, post.comments_count, post.shares_count)}
+            for post in posts
+        ])
+        mark_changed(db, ("posts",))
+        ranking_change(db, "pair", user_id, author_id)
+
+def visible_privacies(viewer_id: int, author_id: int, is_friend: bool) -> List[str]:
+    if viewer_id == author_id:
+        return ["public", "friends", "private"]
+    return ["public", "friends"] if is_friend else ["public"]
+
+def backfill_timeline(user_id: int, author_id: int):
+    """Background task: copy an author's recent posts into a new friend/follower's timeline"""
+    db = SessionLocal()
+    try:
+        is_friend = are_friends(db, user_id, author_id)
+        copy_recent_posts(db, user_id, author_id, visible_privacies(user_id, author_id, is_friend))
+        db.commit()
+    except Exception as e:
+        print(f"⚠️ Erro ao preencher timeline do usuário {user_id}: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+def prune_timeline(db: Session, user_id: int, author_id: int):
+    """Drop the author's posts the user can no longer see from the timeline.
+
+    Everything once no friendship or follow links them; the friends-only posts
+    when an unfriended user still follows the author.
+    """
+    # Consulta o banco, não o cache: roda dentro da transação que desfez a relação
+    is_friend = db.query(FriendEdge.user_id).filter(FriendEdge.user_id == user_id, FriendEdge.friend_id == author_id).first() is not None
+    follows = db.query(Follow.id).filter(Follow.follower_id == user_id, Follow.followed_id == author_id).first() is not None
+    rows = db.query(TimelineEntry).filter(TimelineEntry.user_id == user_id, TimelineEntry.author_id == author_id)
+    if is_friend or follows:
+        hidden = select(Post.id).where(Post.author_id == author_id,
+                                       Post.privacy.notin_(visible_privacies(user_id, author_id, is_friend)))
+        rows = rows.filter(TimelineEntry.post_id.in_(hidden))
+    if rows.delete(synchronize_session=False):
+        mark_changed(db, ("posts",))
+
+def rebuild_home_timeline(db: Session, user_id: int) -> bool:
+    """Seed an empty timeline from the user's own posts and current connections.
+
+    Runs once per user (user_stats.timeline_seeded): after that fan-out and
+    backfill keep the timeline current, and a user with no posts and no
+    connections would otherwise rebuild on every feed request.
+    Returns False when the timeline had already been seeded.
+    """
+    # as linhas ficam gravadas: lê do primário mesmo num GET servido pela réplica
+    with primary_reads(db):
+        if db.query(UserStats.timeline_seeded).filter(UserStats.user_id == user_id).scalar():
+            return False
+        friend_ids = set(get_friend_ids(db, user_id))
+        followed = set(social_graph.get(db, user_id).following)
+        pull_author_ids = set(get_pull_author_ids(db, user_id))
+        for author_id in ({user_id} | friend_ids | followed) - (pull_author_ids - friend_ids):
+            copy_recent_posts(db, user_id, author_id, visible_privacies(user_id, author_id, author_id in friend_ids))
+    db.execute(upsert(UserStats, {"user_id": user_id, "timeline_seeded": True}, {"timeline_seeded": True}))
+    db.commit()
+    return True
+
+def get_pull_author_ids(db: Session, user_id: int) -> List[int]:
+    """Followed authors whose posts are not fanned out and must be merged on read"""
+    followed = select(Follow.followed_id).where(Follow.follower_id == user_id)
+    rows = db.query(UserStats.user_id).filter(UserStats.user_id.in_(followed),
+                                              UserStats.followers_count > FANOUT_MAX_FOLLOWERS).all()
+    return [row[0] for row in rows]
+
+class RecentPostsCache:
+    """LRU of the newest public posts of pull authors, as (created_at, post_id) newest first.
+
+    Loaded on read and dropped after commit whenever one of the author's posts
+    changes, so a list is either current or absent.
+    """
+
+    def __init__(self, capacity: int, per_author: int):
+        self.capacity = capacity
+        self.per_author = per_author
+        self._lock = threading.Lock()
+        self._authors: "OrderedDict[int, List[tuple]]" = OrderedDict()
+        self._writes = 0
+
+    def get(self, db: Session, author_id: int) -> List[tuple]:
+        with self._lock:
+            posts = self._authors.get(author_id)
+            if posts is not None:
+                self._authors.move_to_end(author_id)
+                metrics.incr("feed.pull.cache_hits")
+                return posts
+            writes_before = self._writes
+        metrics.incr("feed.pull.cache_misses")
+
+        with primary_reads(db):
+            posts = [tuple(row) for row in db.query(Post.created_at, Post.id)
+                     .filter(Post.author_id == author_id, Post.privacy == "public")
+                     .order_by(Post.created_at.desc(), Post.id.desc()).limit(self.per_author).all()]
+        with self._lock:
+            if self._writes == writes_before:
+                self._authors[author_id] = posts
+                while len(self._authors) > self.capacity:
+                    self._authors.popitem(last=False)
+        return posts
+
+    def invalidate(self, author_ids):
+        with self._lock:
+            self._writes += 1
+            for author_id in author_ids:
+                self._authors.pop(author_id, None)
+
+    def __len__(self):
+        return len(self._authors)
+
+recent_posts_cache = RecentPostsCache(PULL_CACHE_AUTHORS, PULL_CACHE_POSTS)
+
+@event.listens_for(AppSession, "after_flush")
+def collect_changed_post_authors(session, flush_context):
+    authors = session.info.setdefault("changed_post_authors", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Post):
+            authors.add(obj.author_id)
+
+@event.listens_for(AppSession, "after_commit")
+def invalidate_recent_posts(session):
+    authors = session.info.pop("changed_post_authors", None)
+    if authors:
+        recent_posts_cache.invalidate(authors)
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_changed_post_authors(session):
+    session.info.pop("changed_post_authors", None)
+
+def cached_pull_page(posts: List[tuple], before: Optional[str], after: Optional[str], limit: int):
+    """Page of one pull author's cached posts cut like keyset_paginate, or None when
+    the cache can't answer (the page reaches past the oldest cached post).
+
+    Returns (keys, has_more) with keys as (created_at, post_id) pairs.
+    """
+    complete = len(posts) < recent_posts_cache.per_author
+    if before:
+        cursor = decode_cursor(before)
+        matches = [key for key in posts if key < cursor]
+    elif after:
+        cursor = decode_cursor(after)
+        if not complete and (not posts or cursor < posts[-1]):
+            return None
+        matches = [key for key in posts if key > cursor]
+        return matches[-limit:], len(matches) > limit
+    else:
+        matches = posts
+    if len(matches) < limit and not complete:
+        return None
+    return matches[:limit], len(matches) > limit or (len(matches) == limit and not complete)
+
+def read_home_timeline(db: Session, user_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                       limit: int = DEFAULT_PAGE_SIZE):
+    """One page of post ids from the materialized timeline merged with pull authors.
+
+    Returns (post_ids, next_cursor, prev_cursor) using the same cursor format as
+    keyset_paginate, with the timeline and pull sources cut by the same key range.
+    Pull authors are read from recent_posts_cache; pages older than the cached
+    window fall back to SQL.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # Re-checked on read: privacy may change or a block may land after fan-out
+    pushed = db.query(TimelineEntry).join(Post, Post.id == TimelineEntry.post_id) \
+        .filter(TimelineEntry.user_id == user_id, visible_posts_filter(user_id))
+    entries, pushed_next, _ = keyset_paginate(pushed, TimelineEntry.created_at, TimelineEntry.post_id, before, after, limit)
+    keys = {entry.post_id: entry.created_at for entry in entries}
+    has_more = pushed_next is not None
+    metrics.incr("feed.push.reads")
+
+    blocked = get_blocked_ids(db, user_id)
+    pull_author_ids = [author_id for author_id in get_pull_author_ids(db, user_id) if author_id not in blocked]
+    if pull_author_ids:
+        metrics.incr("feed.pull.reads")
+        uncached = []
+        for author_id in pull_author_ids:
+            page = cached_pull_page(recent_posts_cache.get(db, author_id), before, after, limit)
+            if page is None:
+                uncached.append(author_id)
+                continue
+            author_keys, author_more = page
+            keys.update((post_id, created_at) for created_at, post_id in author_keys)
+            has_more = has_more or author_more
+        if uncached:
+            metrics.incr("feed.pull.sql_fallbacks")
+            pulled = db.query(Post.id, Post.created_at).filter(Post.author_id.in_(uncached), Post.privacy == "public")
+            rows, pulled_next, _ = keyset_paginate(pulled, Post.created_at, Post.id, before, after, limit)
+            keys.update((row.id, row.created_at) for row in rows)
+            has_more = has_more or pulled_next is not None
+
+    ordered = sorted(keys.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    if len(ordered) > limit:
+        has_more = True
+        # com "after" a página fica colada ao cursor, ou seja, no fim da lista
+        ordered = ordered[-limit:] if after else ordered[:limit]
+    if not ordered:
+        return [], None, None
+
+    next_cursor = encode_cursor(ordered[-1][1], ordered[-1][0]) if (has_more or after) else None
+    prev_cursor = encode_cursor(ordered[0][1], ordered[0][0])
+    return [post_id for post_id, _ in ordered], next_cursor, prev_cursor
+
+# Ranked feed (scores precomputed per timeline row by a background worker)
+RANK_EPOCH = datetime(2020, 1, 1)
+
+def hot_score(created_at: datetime, reactions: Optional[int], comments: Optional[int], shares: Optional[int]) -> float:
+    """Engagement on a log scale plus a recency term that grows with post time.
+
+    Because recency is part of the score itself, a post only needs rescoring when
+    its engagement changes, never just because time passed.
+    """
+    engagement = (reactions or 0) + 2 * (comments or 0) + 3 * (shares or 0)
+    return math.log10(max(engagement, 1)) + (created_at - RANK_EPOCH).total_seconds() / RANK_DECAY_SECONDS
+
+class RankingQueue:
+    """Posts and (viewer, author) pairs whose timeline scores are stale"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._posts = set()
+        self._pairs = set()
+        self._interactions = set()
+
+    def mark_post(self, post_id: int):
+        with self._lock:
+            self._posts.add(post_id)
+
+    def mark_pair(self, user_id: int, author_id: int):
+        with self._lock:
+            self._pairs.add((user_id, author_id))
+
+    def mark_interaction(self, user_id: int, post_id: int):
+        """A user reacted to or commented on a post; the author is resolved by the worker"""
+        with self._lock:
+            self._posts.add(post_id)
+            self._interactions.add((user_id, post_id))
+
+    def drain(self, limit: int):
+        with self._lock:
+            posts = [self._posts.pop() for _ in range(min(limit, len(self._posts)))]
+            pairs = [self._pairs.pop() for _ in range(min(limit, len(self._pairs)))]
+            interactions = [self._interactions.pop() for _ in range(min(limit, len(self._interactions)))]
+        return posts, pairs, interactions
+
+    def requeue(self, posts, pairs, interactions):
+        """Put back a drained batch whose recompute did not commit"""
+        with self._lock:
+            self._posts.update(posts)
+            self._pairs.update(pairs)
+            self._interactions.update(interactions)
+
+    def apply(self, changes):
+        with self._lock:
+            for kind, *args in changes:
+                if kind == "post":
+                    self._posts.add(args[0])
+                elif kind == "pair":
+                    self._pairs.add(tuple(args))
+                elif kind == "interaction":
+                    self._posts.add(args[1])
+                    self._interactions.add(tuple(args))
+
+ranking_queue = RankingQueue()
+
+def ranking_change(db: Session, kind: str, *args):
+    """Queue a stale score ("post", "pair" or "interaction"); handed to the worker only if the transaction commits"""
+    db.info.setdefault("ranking_changes", []).append((kind, *args))
+
+@event.listens_for(AppSession, "after_commit")
+def apply_ranking_changes(session):
+    changes = session.info.pop("ranking_changes", None)
+    if changes:
+        ranking_queue.apply(changes)
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_ranking_changes(session):
+    session.info.pop("ranking_changes", None)
+
+def refresh_affinity(db: Session, user_id: int, author_id: int):
+    """Recompute a user's affinity for an author and shift their timeline scores"""
+    if user_id == author_id:
+        return
+    since = datetime.utcnow() - timedelta(days=RANK_AFFINITY_DAYS)
+    reactions = db.query(func.count(Reaction.id)).join(Post, Post.id == Reaction.post_id) \
+        .filter(Reaction.user_id == user_id, Post.author_id == author_id, Reaction.created_at >= since).scalar() or 0
+    comments = db.query(func.count(Comment.id)).join(Post, Post.id == Comment.post_id) \
+        .filter(Comment.author_id == user_id, Post.author_id == author_id, Comment.created_at >= since).scalar() or 0
+    affinity = RANK_AFFINITY_WEIGHT * math.log1p(reactions + comments)
+
+    db.execute(upsert(
+        UserAffinity,
+        {"user_id": user_id, "author_id": author_id, "score": affinity, "updated_at": datetime.utcnow()},
+        {"score": affinity, "updated_at": datetime.utcnow()}
+    ))
+    # score antes de affinity: o MySQL aplica o SET da esquerda para a direita
+    db.execute(update(TimelineEntry).where(
+        TimelineEntry.user_id == user_id,
+        TimelineEntry.author_id == author_id
+    ).ordered_values(
+        (TimelineEntry.score, TimelineEntry.score - TimelineEntry.affinity + affinity),
+        (TimelineEntry.affinity, affinity)
+    ))
+
+def rescore_posts(db: Session, post_ids: List[int]):
+    """Rewrite the timeline scores of posts whose engagement changed"""
+    posts = db.query(Post.id, Post.created_at, Post.reactions_count, Post.comments_count, Post.shares_count) \
+        .filter(Post.id.in_(post_ids)).all()
+    affinity = func.coalesce(
+        select(UserAffinity.score).where(
+            UserAffinity.user_id == TimelineEntry.user_id,
+            UserAffinity.author_id == TimelineEntry.author_id
+        ).scalar_subquery(),
+        0
+    )
+    for post in posts:
+        base = hot_score(post.created_at, post.reactions_count, post.comments_count, post.shares_count)
+        db.execute(update(TimelineEntry).where(TimelineEntry.post_id == post.id).values(
+            score=base + affinity,
+            affinity=affinity
+        ))
+
+def process_ranking_queue(limit: int = RANK_BATCH_SIZE) -> int:
+    """Apply one batch of pending rescoring work; returns how many items were handled"""
+    batch = ranking_queue.drain(limit)
+    post_ids, pairs, interactions = batch
+    if not (post_ids or pairs or interactions):
+        return 0
+    db = SessionLocal()
+    try:
+        if interactions:
+            authors = dict(db.query(Post.id, Post.author_id).filter(Post.id.in_({post_id for _, post_id in interactions})).all())
+            pairs = set(pairs) | {(user_id, authors[post_id]) for user_id, post_id in interactions if post_id in authors}
+        for user_id, author_id in pairs:
+            refresh_affinity(db, user_id, author_id)
+        if post_ids:
+            rescore_posts(db, post_ids)
+        mark_changed(db, ("posts",))
+        db.commit()
+    except Exception as e:
+        print(f"⚠️ Erro ao recalcular scores do feed: {e}")
+        db.rollback()
+        # nada foi gravado: o lote volta para a fila e o worker tenta de novo no próximo ciclo
+        ranking_queue.requeue(*batch)
+        metrics.incr("feed.ranking.failed_batches")
+        return 0
+    finally:
+        db.close()
+    return len(post_ids) + len(pairs)
+
+async def ranking_worker():
+    """Drain the ranking queue in the background for the lifetime of the app"""
+    while True:
+        await asyncio.sleep(RANK_INTERVAL_SECONDS)
+        while await asyncio.to_thread(process_ranking_queue) >= RANK_BATCH_SIZE:
+            pass
+
+@app.on_event("startup")
+async def start_ranking_worker():
+    asyncio.create_task(ranking_worker())
+
+class RankedWindows:
+    """Ranked feed snapshots: the top (post_id, score) rows of a timeline as the
+    first page saw them, kept for RANKED_WINDOW_TTL_SECONDS (LRU)"""
+
+    def __init__(self, capacity: int, ttl_seconds: int):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._windows: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def put(self, user_id: int, entries: List[tuple]) -> str:
+        window_id = secrets.token_hex(6)
+        with self._lock:
+            self._windows[window_id] = (user_id, time.monotonic(), entries)
+            while len(self._windows) > self.capacity:
+                self._windows.popitem(last=False)
+        return window_id
+
+    def get(self, user_id: int, window_id: str) -> Optional[List[tuple]]:
+        with self._lock:
+            window = self._windows.get(window_id)
+            if window is None or window[0] != user_id:
+                return None
+            if time.monotonic() - window[1] > self.ttl_seconds:
+                del self._windows[window_id]
+                return None
+            self._windows.move_to_end(window_id)
+            return window[2]
+
+    def __len__(self):
+        return len(self._windows)
+
+ranked_windows = RankedWindows(RANKED_WINDOW_CACHE, RANKED_WINDOW_TTL_SECONDS)
+
+def encode_ranked_cursor(window_id: Optional[str], offset: int, score: float, post_id: int) -> str:
+    """Cursor of the ranked feed: position in a snapshot plus the (score, post_id) key for the keyset fallback"""
+    raw = json.dumps([window_id, offset, float(score or 0), post_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_ranked_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        window_id, offset, score, post_id = json.loads(raw)
+        return window_id, int(offset), float(score), int(post_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def read_ranked_timeline(db: Session, user_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                         limit: int = DEFAULT_PAGE_SIZE):
+    """One page of the ranked feed.
+
+    Scores change between requests, so a keyset on score skips or repeats posts.
+    The first page freezes the top RANKED_WINDOW_POSTS rows in ranked_windows and
+    later pages slice that snapshot by position. Past the end of a full snapshot,
+    or when it expired (or lives in another worker), pages continue by keyset on
+    (score, post_id) from the cursor.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either 'before' or 'after', not both")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    visible = db.query(TimelineEntry.post_id, TimelineEntry.score).join(Post, Post.id == TimelineEntry.post_id) \
+        .filter(TimelineEntry.user_id == user_id, visible_posts_filter(user_id))
+
+    cursor = before or after
+    if cursor:
+        window_id, offset, score, post_id = decode_ranked_cursor(cursor)
+        entries = ranked_windows.get(user_id, window_id) if window_id else None
+        if window_id and entries is None:
+            metrics.incr("feed.ranked.window_misses")
+    else:
+        entries = [tuple(row) for row in visible.order_by(TimelineEntry.score.desc(), TimelineEntry.post_id.desc())
+                   .limit(RANKED_WINDOW_POSTS).all()]
+        window_id, offset = ranked_windows.put(user_id, entries), 0
+
+    if entries is not None and (after or offset < len(entries)):
+        start, end = (max(0, offset - limit), offset) if after else (offset, offset + limit)
+        page = entries[start:end]
+        if not page:
+            return [], None, None
+        # bloqueios e mudanças de privacidade depois da primeira página
+        shown = {row.post_id for row in visible.filter(TimelineEntry.post_id.in_([entry[0] for entry in page])).all()}
+        full_window = len(entries) == RANKED_WINDOW_POSTS
+        next_cursor = encode_ranked_cursor(window_id, end, page[-1][1], page[-1][0]) \
+            if (after or end < len(entries) or full_window) else None
+        prev_cursor = encode_ranked_cursor(window_id, start, page[0][1], page[0][0])
+        return [post_id for post_id, _ in page if post_id in shown], next_cursor, prev_cursor
+
+    if not cursor:
+        return [], None, None
+    rows, next_key, _ = keyset_paginate(visible, TimelineEntry.score, TimelineEntry.post_id,
+                                        encode_cursor(score, post_id) if before else None,
+                                        encode_cursor(score, post_id) if after else None, limit)
+    if not rows:
+        return [], None, None
+    next_cursor = encode_ranked_cursor(None, 0, rows[-1].score, rows[-1].post_id) if next_key else None
+    prev_cursor = encode_ranked_cursor(None, 0, rows[0].score, rows[0].post_id)
+    return [row.post_id for row in rows], next_cursor, prev_cursor
+
 # Posts routes
 @app.post("/posts/", response_model=PostResponse)
-async def create_post(post: PostCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_post(post: PostCreate, background_tasks: BackgroundTasks, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Validação e processamento do conteúdo
     content_to_save = post.content
     
@@ -842,6 +2771,10 @@ async def create_post(post: PostCreate, current_user: User = Depends(get_current
             content_to_save = post.content
             print(f"⚠️ JSON inválido, salvando como texto: {str(e)}")
     
+    privacy = post.privacy or current_user.post_visibility or "public"
+    if privacy not in POST_PRIVACIES:
+        raise HTTPException(status_code=400, detail="Invalid privacy value")
+    
     db_post = Post(
         author_id=current_user.id,
         content=content_to_save,
@@ -849,147 +2782,94 @@ async def create_post(post: PostCreate, current_user: User = Depends(get_current
         media_type=post.media_type,
         media_url=post.media_url,
         media_metadata=post.media_metadata,
-        privacy=post.privacy,
+        privacy=privacy,
         is_profile_update=post.is_profile_update,
         is_cover_update=post.is_cover_update
     )
     db.add(db_post)
+    adjust_user_stat(db, current_user.id, UserStats.posts_count, 1)
     db.commit()
     db.refresh(db_post)
+    background_tasks.add_task(fan_out_post, db_post.id)
     
-    return PostResponse(
-        id=db_post.id,
-        author={
-            "id": db_post.author.id,
-            "first_name": db_post.author.first_name,
-            "last_name": db_post.author.last_name,
-            "avatar": None
-        },
-        content=db_post.content,
-        post_type=db_post.post_type,
-        media_type=db_post.media_type,
-        media_url=db_post.media_url,
-        created_at=db_post.created_at,
-        reactions_count=db_post.reactions_count,
-        comments_count=db_post.comments_count,
-        shares_count=db_post.shares_count,
-        is_profile_update=db_post.is_profile_update,
-        is_cover_update=db_post.is_cover_update
-    )
+    return post_to_response(db_post, {current_user.id: user_card(current_user)})
 
 @app.get("/posts/", response_model=List[PostResponse])
-async def get_posts(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    posts = db.query(Post).order_by(Post.created_at.desc()).limit(50).all()
-    
-    return [
-        PostResponse(
-            id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": None
-            },
-            content=post.content,
-            post_type=post.post_type,
-            media_type=post.media_type,
-            media_url=post.media_url,
-            created_at=post.created_at,
-            reactions_count=post.reactions_count,
-            comments_count=post.comments_count,
-            shares_count=post.shares_count,
-            is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
-        )
-        for post in posts
-    ]
+async def get_posts(request: Request, response: Response, before: Optional[str] = None, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                    mode: str = "recent", include_reactions: bool = False,
+                    current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """Home feed: own posts plus friends' and followed users' posts.
+
+    mode=recent (default) orders by time; mode=ranked orders the materialized
+    timeline by precomputed score (posts from pull authors are not included).
+    """
+    if mode not in ("recent", "ranked"):
+        raise HTTPException(status_code=400, detail="Invalid feed mode")
+    read_timeline = read_ranked_timeline if mode == "ranked" else read_home_timeline
+
+    def load_page(session: Session):
+        post_ids, next_cursor, prev_cursor = read_timeline(session, current_user.id, before, after, limit)
+        # Timeline ainda não materializada (usuário anterior à timeline)
+        if not post_ids and not before and not after and rebuild_home_timeline(session, current_user.id):
+            post_ids, next_cursor, prev_cursor = read_timeline(session, current_user.id, before, after, limit)
+
+        posts_by_id = {post.id: post for post in session.query(*POST_COLUMNS).filter(Post.id.in_(post_ids)).all()} if post_ids else {}
+        posts = [posts_by_id[post_id] for post_id in post_ids if post_id in posts_by_id]
+        return posts, next_cursor, prev_cursor
+
+    posts, next_cursor, prev_cursor = await db.run_sync(load_page)
+    set_cursor_headers(response, next_cursor, prev_cursor)
+    # ETag da página: ids na ordem servida mais as versões desses posts e dos seus autores,
+    # não as chaves globais, que mudam com qualquer reação no site
+    keys = [("post", post.id) for post in posts] + [("profile", author_id) for author_id in {post.author_id for post in posts}]
+    cached = not_modified(request, response, resource_etag(current_user.id, request, keys, [post.id for post in posts]), db)
+    if cached:
+        set_cursor_headers(cached, next_cursor, prev_cursor)
+        return cached
+
+    payload = await db.run_sync(posts_to_response, posts, current_user.id if include_reactions else None)
+    return fast_response(payload, response)
 
 # User posts routes
 @app.get("/users/{user_id}/posts", response_model=List[PostResponse])
-async def get_user_posts(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    posts = db.query(Post).filter(
-        Post.author_id == user_id,
+async def get_user_posts(user_id: int, response: Response, before: Optional[str] = None, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                         include_reactions: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    query = db.query(*POST_COLUMNS).filter(
+        author_posts_filter(db, current_user.id, user_id),
         Post.post_type == "post"
-    ).order_by(Post.created_at.desc()).limit(50).all()
+    )
+    posts, next_cursor, prev_cursor = keyset_paginate(query, Post.created_at, Post.id, before, after, limit)
+    set_cursor_headers(response, next_cursor, prev_cursor)
     
-    return [
-        PostResponse(
-            id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": getattr(post.author, 'avatar', None)
-            },
-            content=post.content,
-            post_type=post.post_type,
-            media_type=post.media_type,
-            media_url=post.media_url,
-            created_at=post.created_at,
-            reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-            comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-            shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
-            is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
-        )
-        for post in posts
-    ]
+    return fast_response(posts_to_response(db, posts, current_user.id if include_reactions else None), response)
 
 @app.get("/posts/{post_id}", response_model=PostResponse)
-async def get_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_post(post_id: int, include_reactions: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get individual post by ID"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+    post = db.query(Post).filter(Post.id == post_id, visible_posts_filter(current_user.id)).first()
 
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    return PostResponse(
-        id=post.id,
-        author={
-            "id": post.author.id,
-            "first_name": post.author.first_name,
-            "last_name": post.author.last_name,
-            "avatar": getattr(post.author, 'avatar', None)
-        },
-        content=post.content,
-        post_type=post.post_type,
-        media_type=post.media_type,
-        media_url=post.media_url,
-        created_at=post.created_at,
-        reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-        comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-        shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
-        is_profile_update=post.is_profile_update,
-        is_cover_update=post.is_cover_update
-    )
+    return posts_to_response(db, [post], current_user.id if include_reactions else None)[0]
 
 @app.get("/posts/{post_id}/comments", response_model=List[CommentResponse])
-async def get_post_comments(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get comments for a specific post"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+async def get_post_comments(post_id: int, response: Response, before: Optional[str] = None, after: Optional[str] = None,
+                            limit: int = DEFAULT_PAGE_SIZE, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get comments for a specific post (flat, oldest first; continue with after=X-Next-Cursor)"""
+    post = db.query(Post.id).filter(Post.id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    comments = db.query(Comment).filter(Comment.post_id == post_id).order_by(Comment.created_at.asc()).all()
+    query = db.query(*COMMENT_COLUMNS).filter(Comment.post_id == post_id)
+    comments, next_cursor, prev_cursor = keyset_paginate(query, Comment.created_at, Comment.id, before, after, limit, descending=False)
+    set_cursor_headers(response, next_cursor, prev_cursor)
+    cards = load_user_cards(db, (comment.author_id for comment in comments))
 
-    return [
-        CommentResponse(
-            id=comment.id,
-            content=comment.content,
-            author={
-                "id": comment.author.id,
-                "first_name": comment.author.first_name,
-                "last_name": comment.author.last_name,
-                "avatar": getattr(comment.author, 'avatar', None)
-            },
-            created_at=comment.created_at,
-            reactions_count=0  # TODO: Add comment reactions
-        )
-        for comment in comments
-    ]
+    return fast_response([comment_to_response(comment, cards) for comment in comments], response)
 
 @app.post("/posts/{post_id}/comments", response_model=CommentResponse)
-async def create_comment(post_id: int, comment_data: CommentCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_comment(post_id: int, comment_data: CommentCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Create a comment on a post"""
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
@@ -1002,99 +2882,59 @@ async def create_comment(post_id: int, comment_data: CommentCreate, current_user
     )
 
     db.add(comment)
+    bump_post_counter(db, post_id, Post.comments_count, 1)
+    ranking_change(db, "interaction", current_user.id, post_id)
     db.commit()
     db.refresh(comment)
 
     return CommentResponse(
         id=comment.id,
         content=comment.content,
-        author={
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": getattr(current_user, 'avatar', None)
-        },
+        author=user_card(current_user),
         created_at=comment.created_at,
         reactions_count=0
     )
 
 @app.post("/posts/{post_id}/reactions")
-async def create_post_reaction(post_id: int, reaction_data: ReactionCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_post_reaction(post_id: int, reaction_data: ReactionCreate, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """Add or update reaction to a post"""
-    post = db.query(Post).filter(Post.id == post_id).first()
-    if not post:
-        raise HTTPException(status_code=404, detail="Post not found")
+    def react(session: Session):
+        if not session.query(Post.id).filter(Post.id == post_id).first():
+            raise HTTPException(status_code=404, detail="Post not found")
+        previous, current = set_reaction(session, current_user.id, post_id, reaction_data.reaction_type)
+        session.commit()
+        return {"message": "Reaction updated" if previous else "Reaction added", **reaction_state(session, post_id, current)}
 
-    # Check if user already reacted
-    existing_reaction = db.query(Reaction).filter(
-        Reaction.post_id == post_id,
-        Reaction.user_id == current_user.id
-    ).first()
-
-    if existing_reaction:
-        # Update existing reaction
-        existing_reaction.reaction_type = reaction_data.reaction_type
-        db.commit()
-        return {"message": "Reaction updated"}
-    else:
-        # Create new reaction
-        reaction = Reaction(
-            post_id=post_id,
-            user_id=current_user.id,
-            reaction_type=reaction_data.reaction_type
-        )
-        db.add(reaction)
-        db.commit()
-        return {"message": "Reaction added"}
+    return await db.run_sync(react)
 
 @app.delete("/posts/{post_id}/reactions")
-async def remove_post_reaction(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def remove_post_reaction(post_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """Remove reaction from a post"""
-    reaction = db.query(Reaction).filter(
-        Reaction.post_id == post_id,
-        Reaction.user_id == current_user.id
-    ).first()
+    def unreact(session: Session):
+        previous, current = set_reaction(session, current_user.id, post_id, None)
+        if previous is None:
+            session.rollback()
+            raise HTTPException(status_code=404, detail="Reaction not found")
+        session.commit()
+        return {"message": "Reaction removed", **reaction_state(session, post_id, current)}
 
-    if reaction:
-        db.delete(reaction)
-        db.commit()
-        return {"message": "Reaction removed"}
-    else:
-        raise HTTPException(status_code=404, detail="Reaction not found")
+    return await db.run_sync(unreact)
 
 @app.get("/users/{user_id}/testimonials", response_model=List[PostResponse])
-async def get_user_testimonials(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    testimonials = db.query(Post).filter(
-        Post.author_id == user_id,
+async def get_user_testimonials(user_id: int, response: Response, before: Optional[str] = None, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                                include_reactions: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    query = db.query(*POST_COLUMNS).filter(
+        author_posts_filter(db, current_user.id, user_id),
         Post.post_type == "testimonial"
-    ).order_by(Post.created_at.desc()).limit(50).all()
+    )
+    testimonials, next_cursor, prev_cursor = keyset_paginate(query, Post.created_at, Post.id, before, after, limit)
+    set_cursor_headers(response, next_cursor, prev_cursor)
     
-    return [
-        PostResponse(
-            id=post.id,
-            author={
-                "id": post.author.id,
-                "first_name": post.author.first_name,
-                "last_name": post.author.last_name,
-                "avatar": getattr(post.author, 'avatar', None)
-            },
-            content=post.content,
-            post_type=post.post_type,
-            media_type=post.media_type,
-            media_url=post.media_url,
-            created_at=post.created_at,
-            reactions_count=db.query(Reaction).filter(Reaction.post_id == post.id).count(),
-            comments_count=db.query(Comment).filter(Comment.post_id == post.id).count(),
-            shares_count=db.query(Share).filter(Share.post_id == post.id).count(),
-            is_profile_update=post.is_profile_update,
-            is_cover_update=post.is_cover_update
-        )
-        for post in testimonials
-    ]
+    return fast_response(posts_to_response(db, testimonials, current_user.id if include_reactions else None), response)
 
 # Reactions routes
 @app.post("/reactions/")
-async def create_reaction(reaction: ReactionCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_reaction(reaction: ReactionCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == reaction.post_id).first()
     if not post:
@@ -1105,32 +2945,13 @@ async def create_reaction(reaction: ReactionCreate, current_user: User = Depends
     if reaction.reaction_type not in valid_reactions:
         raise HTTPException(status_code=400, detail="Invalid reaction type")
     
-    # Check if user already reacted to this post
-    existing_reaction = db.query(Reaction).filter(
-        Reaction.user_id == current_user.id,
-        Reaction.post_id == reaction.post_id
-    ).first()
-    
-    if existing_reaction:
-        if existing_reaction.reaction_type == reaction.reaction_type:
-            # Remove reaction if same type
-            db.delete(existing_reaction)
-            db.commit()
-            return {"message": "Reaction removed"}
-        else:
-            # Update reaction type
-            existing_reaction.reaction_type = reaction.reaction_type
-            db.commit()
-            return {"message": "Reaction updated"}
-    
-    # Create new reaction
-    db_reaction = Reaction(
-        user_id=current_user.id,
-        post_id=reaction.post_id,
-        reaction_type=reaction.reaction_type
-    )
-    db.add(db_reaction)
+    previous, current = set_reaction(db, current_user.id, reaction.post_id, reaction.reaction_type, toggle=True)
     db.commit()
+    state = reaction_state(db, reaction.post_id, current)
+    if current is None:
+        return {"message": "Reaction removed", **state}
+    if previous is not None:
+        return {"message": "Reaction updated", **state}
     
     # Send notification to post author if not self-reaction
     if post.author_id != current_user.id:
@@ -1162,67 +2983,68 @@ async def create_reaction(reaction: ReactionCreate, current_user: User = Depends
             "created_at": notification.created_at.isoformat()
         })
     
-    return {"message": "Reaction created"}
+    return {"message": "Reaction created", **state}
 
 @app.get("/reactions/post/{post_id}")
-async def get_post_reactions(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    reactions = db.query(Reaction).filter(Reaction.post_id == post_id).all()
-    
-    # Group reactions by type
-    reaction_counts = {}
-    user_reaction = None
-    
-    for reaction in reactions:
-        if reaction.reaction_type not in reaction_counts:
-            reaction_counts[reaction.reaction_type] = 0
-        reaction_counts[reaction.reaction_type] += 1
-        
-        if reaction.user_id == current_user.id:
-            user_reaction = reaction.reaction_type
-    
-    return {
-        "reactions": reaction_counts,
-        "user_reaction": user_reaction,
-        "total": len(reactions)
-    }
+async def get_post_reactions(post_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    return reaction_summaries(db, [post_id], current_user.id)[post_id]
+
+@app.post("/reactions/summary")
+async def get_reactions_summary(request: ReactionSummaryRequest, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Reaction histograms and the viewer's reaction for many posts at once"""
+    post_ids = list(dict.fromkeys(request.post_ids))
+    if len(post_ids) > MAX_REACTION_SUMMARY_POSTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_REACTION_SUMMARY_POSTS} posts per request")
+
+    # posts que o usuário não pode ver (ou inexistentes) ficam fora da resposta
+    visible = set()
+    if post_ids:
+        visible = {row[0] for row in db.query(Post.id).filter(Post.id.in_(post_ids), visible_posts_filter(current_user.id)).all()}
+    return reaction_summaries(db, [post_id for post_id in post_ids if post_id in visible], current_user.id)
 
 @app.get("/reactions/post/{post_id}/detailed")
-async def get_post_reactions_detailed(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get detailed reactions with user information"""
-    reactions = db.query(Reaction).filter(Reaction.post_id == post_id).all()
+async def get_post_reactions_detailed(post_id: int, reaction_type: Optional[str] = None, before: Optional[str] = None, limit: int = 20,
+                                      current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get detailed reactions with user information.
+
+    Counts come from post_reaction_counts; users are paged per type, newest
+    first. Pass reaction_type with that type's next_cursor as `before` to load more.
+    """
+    if before and not reaction_type:
+        raise HTTPException(status_code=400, detail="'before' requires 'reaction_type'")
+
+    summary = reaction_summaries(db, [post_id], current_user.id)[post_id]
+    reaction_types = [reaction_type] if reaction_type else list(summary["reactions"])
+
+    pages = {}
+    for rtype in reaction_types:
+        query = db.query(Reaction).filter(Reaction.post_id == post_id, Reaction.reaction_type == rtype)
+        reactions, next_cursor, _ = keyset_paginate(query, Reaction.created_at, Reaction.id, before=before, limit=limit)
+        pages[rtype] = (reactions, next_cursor)
+    cards = load_user_cards(db, (reaction.user_id for reactions, _ in pages.values() for reaction in reactions))
 
     # Group reactions by type with user details
-    reaction_details = {}
-    user_reaction = None
-
-    for reaction in reactions:
-        if reaction.reaction_type not in reaction_details:
-            reaction_details[reaction.reaction_type] = {
-                "count": 0,
-                "users": []
-            }
-
-        reaction_details[reaction.reaction_type]["count"] += 1
-        reaction_details[reaction.reaction_type]["users"].append({
-            "id": reaction.user.id,
-            "first_name": reaction.user.first_name,
-            "last_name": reaction.user.last_name,
-            "avatar": reaction.user.avatar,
-            "created_at": reaction.created_at.isoformat()
-        })
-
-        if reaction.user_id == current_user.id:
-            user_reaction = reaction.reaction_type
+    reaction_details = {
+        rtype: {
+            "count": summary["reactions"].get(rtype, 0),
+            "users": [
+                {**card_for(cards, reaction.user_id), "created_at": reaction.created_at.isoformat()}
+                for reaction in reactions
+            ],
+            "next_cursor": next_cursor
+        }
+        for rtype, (reactions, next_cursor) in pages.items()
+    }
 
     return {
         "reactions": reaction_details,
-        "user_reaction": user_reaction,
-        "total": len(reactions)
+        "user_reaction": summary["user_reaction"],
+        "total": summary["total"]
     }
 
 # Comments routes
 @app.post("/comments/", response_model=CommentResponse)
-async def create_comment(comment: CommentCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_comment(comment: CommentCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == comment.post_id).first()
     if not post:
@@ -1235,6 +3057,8 @@ async def create_comment(comment: CommentCreate, current_user: User = Depends(ge
         author_id=current_user.id
     )
     db.add(db_comment)
+    bump_post_counter(db, comment.post_id, Post.comments_count, 1)
+    ranking_change(db, "interaction", current_user.id, comment.post_id)
     db.commit()
     db.refresh(db_comment)
     
@@ -1271,57 +3095,34 @@ async def create_comment(comment: CommentCreate, current_user: User = Depends(ge
     return CommentResponse(
         id=db_comment.id,
         content=db_comment.content,
-        author={
-            "id": db_comment.author.id,
-            "first_name": db_comment.author.first_name,
-            "last_name": db_comment.author.last_name,
-            "avatar": getattr(db_comment.author, 'avatar', None)
-        },
+        author=user_card(current_user),
         created_at=db_comment.created_at,
         reactions_count=0,
         replies=[]
     )
 
 @app.get("/comments/post/{post_id}", response_model=List[CommentResponse])
-async def get_post_comments(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    comments = db.query(Comment).filter(Comment.post_id == post_id, Comment.parent_id.is_(None)).all()
-    
-    result = []
-    for comment in comments:
-        replies = db.query(Comment).filter(Comment.parent_id == comment.id).all()
-        result.append(CommentResponse(
-            id=comment.id,
-            content=comment.content,
-            author={
-                "id": comment.author.id,
-                "first_name": comment.author.first_name,
-                "last_name": comment.author.last_name,
-                "avatar": getattr(comment.author, 'avatar', None)
-            },
-            created_at=comment.created_at,
-            reactions_count=0,
-            replies=[
-                CommentResponse(
-                    id=reply.id,
-                    content=reply.content,
-                    author={
-                        "id": reply.author.id,
-                        "first_name": reply.author.first_name,
-                        "last_name": reply.author.last_name,
-                        "avatar": getattr(reply.author, 'avatar', None)
-                    },
-                    created_at=reply.created_at,
-                    reactions_count=0,
-                    replies=[]
-                ) for reply in replies
-            ]
-        ))
-    
-    return result
+async def get_comment_thread(post_id: int, response: Response, before: Optional[str] = None, after: Optional[str] = None,
+                             limit: int = DEFAULT_PAGE_SIZE, replies_limit: int = DEFAULT_REPLIES_PER_COMMENT,
+                             current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Top-level comments with their first replies; continue with after=X-Next-Cursor"""
+    comments, next_cursor, prev_cursor = load_comment_thread(db, post_id, before, after, limit, replies_limit)
+    set_cursor_headers(response, next_cursor, prev_cursor)
+    return fast_response(comments, response)
+
+@app.get("/comments/{comment_id}/replies", response_model=List[CommentResponse])
+async def get_comment_replies(comment_id: int, response: Response, after: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                              current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """More replies of a comment, oldest first, starting after a replies_next_cursor"""
+    query = db.query(*COMMENT_COLUMNS).filter(Comment.parent_id == comment_id)
+    replies, next_cursor, prev_cursor = keyset_paginate(query, Comment.created_at, Comment.id, after=after, limit=limit, descending=False)
+    set_cursor_headers(response, next_cursor, prev_cursor)
+    cards = load_user_cards(db, (reply.author_id for reply in replies))
+    return fast_response([comment_to_response(reply, cards) for reply in replies], response)
 
 # Shares routes
 @app.post("/shares/")
-async def share_post(share: ShareCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def share_post(share: ShareCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if post exists
     post = db.query(Post).filter(Post.id == share.post_id).first()
     if not post:
@@ -1341,13 +3142,14 @@ async def share_post(share: ShareCreate, current_user: User = Depends(get_curren
         post_id=share.post_id
     )
     db.add(db_share)
+    bump_post_counter(db, share.post_id, Post.shares_count, 1)
     db.commit()
     
     return {"message": "Post shared successfully"}
 
 # Friendships routes
 @app.post("/friendships/")
-async def send_friend_request(friendship: FriendshipCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def send_friend_request(friendship: FriendshipCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Check if user exists
     addressee = db.query(User).filter(User.id == friendship.addressee_id, User.is_active == True).first()
     if not addressee:
@@ -1358,10 +3160,7 @@ async def send_friend_request(friendship: FriendshipCreate, current_user: User =
         raise HTTPException(status_code=400, detail="Cannot send friend request to yourself")
     
     # Check if friendship already exists
-    existing_friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == friendship.addressee_id)) |
-        ((Friendship.requester_id == friendship.addressee_id) & (Friendship.addressee_id == current_user.id))
-    ).first()
+    existing_friendship = find_friendship(db, current_user.id, friendship.addressee_id)
     
     if existing_friendship:
         if existing_friendship.status == "pending":
@@ -1376,6 +3175,8 @@ async def send_friend_request(friendship: FriendshipCreate, current_user: User =
         status="pending"
     )
     db.add(db_friendship)
+    # sem mudança no grafo, mas as sugestões dos dois excluem pedidos pendentes
+    graph_change(db, "request_friend", current_user.id, friendship.addressee_id)
     db.commit()
     
     # Send notification
@@ -1410,7 +3211,7 @@ async def send_friend_request(friendship: FriendshipCreate, current_user: User =
     return {"message": "Friend request sent successfully"}
 
 @app.put("/friendships/{friendship_id}/accept")
-async def accept_friend_request(friendship_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def accept_friend_request(friendship_id: int, background_tasks: BackgroundTasks, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     friendship = db.query(Friendship).filter(Friendship.id == friendship_id).first()
     if not friendship:
         raise HTTPException(status_code=404, detail="Friend request not found")
@@ -1423,7 +3224,10 @@ async def accept_friend_request(friendship_id: int, current_user: User = Depends
     
     friendship.status = "accepted"
     friendship.updated_at = datetime.utcnow()
+    add_friend_edges(db, friendship)
     db.commit()
+    background_tasks.add_task(backfill_timeline, friendship.requester_id, friendship.addressee_id)
+    background_tasks.add_task(backfill_timeline, friendship.addressee_id, friendship.requester_id)
     
     # Send notification to requester
     notification = Notification(
@@ -1457,7 +3261,7 @@ async def accept_friend_request(friendship_id: int, current_user: User = Depends
     return {"message": "Friend request accepted"}
 
 @app.put("/friendships/{friendship_id}/reject")
-async def reject_friend_request(friendship_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def reject_friend_request(friendship_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     friendship = db.query(Friendship).filter(Friendship.id == friendship_id).first()
     if not friendship:
         raise HTTPException(status_code=404, detail="Friend request not found")
@@ -1470,48 +3274,728 @@ async def reject_friend_request(friendship_id: int, current_user: User = Depends
     
     friendship.status = "rejected"
     friendship.updated_at = datetime.utcnow()
+    graph_change(db, "reject_friend", friendship.requester_id, friendship.addressee_id)
     db.commit()
     
     return {"message": "Friend request rejected"}
 
 @app.get("/friendships/status/{user_id}")
-async def get_friendship_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
-        ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id))
-    ).first()
+async def get_friendship_status(user_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    friendship = find_friendship(db, current_user.id, user_id)
     
     if not friendship:
         return {"status": "none"}
     
     return {"status": friendship.status}
 
-# User search
-@app.get("/users/")
-async def search_users(search: str = "", current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if not search.strip():
+# People you may know (mutual friends, shared follows)
+MAX_SUGGESTIONS = 50
+SUGGESTION_BATCH_SIZE = 1000
+SHARED_FOLLOW_WEIGHT = 0.5
+
+class SuggestionCache:
+    """Per-user suggestion lists, served stale while a background refresh runs"""
+
+    def __init__(self, capacity: int, ttl_seconds: int):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._stale = set()
+        self._refreshing = set()
+
+    def get(self, user_id: int):
+        """(suggestions, fresh) or None when nothing is cached"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(user_id)
+            computed_at, suggestions = entry
+            fresh = user_id not in self._stale and time.monotonic() - computed_at < self.ttl_seconds
+            return suggestions, fresh
+
+    def put(self, user_id: int, suggestions: List[Dict[str, Any]]):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic(), suggestions)
+            self._entries.move_to_end(user_id)
+            self._stale.discard(user_id)
+            self._refreshing.discard(user_id)
+            while len(self._entries) > self.capacity:
+                evicted, _ = self._entries.popitem(last=False)
+                self._stale.discard(evicted)
+
+    def begin_refresh(self, user_id: int) -> bool:
+        """Claim a background refresh; False if one is already running"""
+        with self._lock:
+            if user_id in self._refreshing:
+                return False
+            self._refreshing.add(user_id)
+            return True
+
+    def end_refresh(self, user_id: int):
+        with self._lock:
+            self._refreshing.discard(user_id)
+
+    def mark_changes(self, changes):
+        """Mark the users whose suggestions a committed graph change affects"""
+        affected = set()
+        for op, user_a, user_b in changes:
+            affected.update((user_a, user_b))
+            if op in ("add_friend", "remove_friend"):
+                # amigos de a e b ganham/perdem um amigo em comum
+                for user_id in (user_a, user_b):
+                    adjacency = social_graph.peek(user_id)
+                    if adjacency is not None:
+                        affected.update(adjacency.friends)
+        with self._lock:
+            self._stale.update(user_id for user_id in affected if user_id in self._entries)
+
+suggestion_cache = SuggestionCache(SUGGESTIONS_CACHE_USERS, SUGGESTIONS_TTL_SECONDS)
+
+def compute_suggestions(db: Session, user_id: int) -> List[Dict[str, Any]]:
+    """Rank friends-of-friends by mutual friends, then shared follows.
+
+    Mutual counts come from grouped friend_edges reads over batches of the user's
+    friends (a sparse intersection done by the index), so cost grows with the
+    number of batches, not with friends x friends.
+    """
+    adjacency = social_graph.get(db, user_id)
+    friends = list(adjacency.friends)
+    excluded = set(friends) | set(adjacency.blocking) | set(adjacency.blocked_by) | {user_id}
+    pending = db.query(Friendship.requester_id, Friendship.addressee_id).filter(
+        Friendship.status == "pending",
+        or_(Friendship.requester_id == user_id, Friendship.addressee_id == user_id)
+    ).all()
+    excluded.update(addressee_id if requester_id == user_id else requester_id for requester_id, addressee_id in pending)
+
+    mutual = Counter()
+    for start in range(0, len(friends), SUGGESTION_BATCH_SIZE):
+        batch = friends[start:start + SUGGESTION_BATCH_SIZE]
+        rows = db.query(FriendEdge.friend_id, func.count(FriendEdge.user_id)) \
+            .filter(FriendEdge.user_id.in_(batch)).group_by(FriendEdge.friend_id).all()
+        for candidate_id, count in rows:
+            if candidate_id not in excluded:
+                mutual[candidate_id] += count
+
+    candidates = [candidate_id for candidate_id, _ in mutual.most_common(MAX_SUGGESTIONS * 4)]
+    following = list(adjacency.following)
+    shared = Counter()
+    if candidates and following:
+        for start in range(0, len(following), SUGGESTION_BATCH_SIZE):
+            batch = following[start:start + SUGGESTION_BATCH_SIZE]
+            rows = db.query(Follow.follower_id, func.count(Follow.id)) \
+                .filter(Follow.follower_id.in_(candidates), Follow.followed_id.in_(batch)) \
+                .group_by(Follow.follower_id).all()
+            shared.update(dict(rows))
+
+    ranked = sorted(candidates, key=lambda candidate_id: (mutual[candidate_id] + SHARED_FOLLOW_WEIGHT * shared[candidate_id], candidate_id), reverse=True)
+    return [
+        {"user_id": candidate_id, "mutual_friends": mutual[candidate_id], "shared_follows": shared[candidate_id]}
+        for candidate_id in ranked[:MAX_SUGGESTIONS]
+    ]
+
+def refresh_suggestions(user_id: int):
+    """Background task: recompute one user's cached suggestions"""
+    db = SessionLocal()
+    try:
+        suggestion_cache.put(user_id, compute_suggestions(db, user_id))
+    except Exception as e:
+        print(f"⚠️ Erro ao atualizar sugestões do usuário {user_id}: {e}")
+        suggestion_cache.end_refresh(user_id)
+    finally:
+        db.close()
+
+@app.get("/users/suggestions")
+async def get_user_suggestions(background_tasks: BackgroundTasks, limit: int = 20, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """People you may know, ranked by mutual friends and shared follows"""
+    cached = suggestion_cache.get(current_user.id)
+    if cached is None:
+        # vai para o cache: lê do primário, não da réplica
+        with primary_reads(db):
+            suggestions = compute_suggestions(db, current_user.id)
+        suggestion_cache.put(current_user.id, suggestions)
+    else:
+        suggestions, fresh = cached
+        if not fresh and suggestion_cache.begin_refresh(current_user.id):
+            background_tasks.add_task(refresh_suggestions, current_user.id)
+
+    # a lista pode estar um pouco velha: descarta quem virou amigo, foi bloqueado
+    # ou tem pedido de amizade pendente com o usuário
+    adjacency = social_graph.get(db, current_user.id)
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+    visible = [
+        suggestion for suggestion in suggestions
+        if suggestion["user_id"] not in adjacency.friends and not adjacency.is_blocked(suggestion["user_id"])
+    ]
+    candidate_ids = [suggestion["user_id"] for suggestion in visible]
+    pending = set()
+    if candidate_ids:
+        for requester_id, addressee_id in db.query(Friendship.requester_id, Friendship.addressee_id).filter(
+            Friendship.status == "pending",
+            or_(and_(Friendship.requester_id == current_user.id, Friendship.addressee_id.in_(candidate_ids)),
+                and_(Friendship.addressee_id == current_user.id, Friendship.requester_id.in_(candidate_ids)))
+        ).all():
+            pending.add(addressee_id if requester_id == current_user.id else requester_id)
+    visible = [suggestion for suggestion in visible if suggestion["user_id"] not in pending][:limit]
+    cards = load_user_cards(db, (suggestion["user_id"] for suggestion in visible))
+
+    return [
+        {
+            **cards[suggestion["user_id"]],
+            "mutual_friends": suggestion["mutual_friends"],
+            "shared_follows": suggestion["shared_follows"]
+        }
+        for suggestion in visible
+        if suggestion["user_id"] in cards
+    ]
+
+@app.post("/relationships/batch")
+async def get_relationships_batch(request: RelationshipBatchRequest, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Friend, pending, follow and block flags for many users at once"""
+    if len(request.user_ids) > MAX_RELATIONSHIP_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_RELATIONSHIP_BATCH} user ids per request")
+    flags = relationship_flags(db, current_user.id, request.user_ids)
+    return {str(user_id): user_flags for user_id, user_flags in flags.items()}
+
+# User search: trigram + prefix index over active users, kept in memory
+SearchDoc = namedtuple("SearchDoc", "first_name last_name username avatar email tokens")
+MAX_SEARCH_RESULTS = 20
+
+def normalize_search_text(value: Optional[str]) -> str:
+    """Lowercase and strip accents, so João matches joao"""
+    decomposed = unicodedata.normalize("NFKD", value or "").lower()
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+def search_tokens(*values: Optional[str]) -> List[str]:
+    tokens = []
+    for value in values:
+        for token in re.split(r"[^0-9a-z]+", normalize_search_text(value)):
+            if token and token not in tokens:
+                tokens.append(token)
+    return tokens
+
+def trigrams(token: str) -> set:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def search_doc(user) -> SearchDoc:
+    return SearchDoc(user.first_name, user.last_name, user.username, user.avatar, user.email,
+                     tuple(search_tokens(user.first_name, user.last_name, user.username)))
+
+def match_quality(tokens, terms: List[str]) -> int:
+    """3 per term matching a whole token, 2 per prefix, 1 per substring; 0 if any term is missing"""
+    quality = 0
+    for term in terms:
+        best = 0
+        for token in tokens:
+            if token == term:
+                best = 3
+                break
+            if token.startswith(term):
+                best = 2
+            elif best == 0 and term in token:
+                best = 1
+        if not best:
+            return 0
+        quality += best
+    return quality
+
+def rank_search_results(docs, terms: List[str], email: Optional[str], viewer_id: int, social: Adjacency,
+                        limit: int) -> List[tuple]:
+    """Order (user_id, SearchDoc) pairs by match quality, then closeness to the viewer.
+
+    An email query ranks the exact address first, then addresses starting with it.
+    """
+    scored = []
+    for user_id, doc in docs:
+        if user_id == viewer_id or social.is_blocked(user_id):
+            continue
+        doc_email = (doc.email or "").lower()
+        if email and doc_email == email:
+            quality = 10 * len(terms)
+        elif email and doc_email.startswith(email):
+            quality = 5 * len(terms)
+        else:
+            quality = match_quality(doc.tokens, terms)
+        if not quality:
+            continue
+        if user_id in social.friends:
+            proximity = 3
+        elif user_id in social.following:
+            proximity = 2
+        elif user_id in social.followers:
+            proximity = 1
+        else:
+            proximity = 0
+        scored.append((-(quality * 4 + proximity), len(doc.tokens), user_id, doc))
+    scored.sort(key=lambda item: item[:3])
+    return [(user_id, doc) for _, _, user_id, doc in scored[:limit]]
+
+class UserSearchIndex:
+    """Trigram postings (for substrings) and a sorted token array (for prefixes).
+
+    Built once in the background; profile changes are applied after commit.
+    Until it is ready, searches fall back to SQL.
+    """
+
+    def __init__(self, candidate_limit: int):
+        self.candidate_limit = candidate_limit
+        self._lock = threading.Lock()
+        self._docs: Dict[int, SearchDoc] = {}
+        self._trigrams: Dict[str, IntSet] = {}
+        self._prefix_tokens: List[str] = []
+        self._prefix_ids = array("q")
+        self._building = False
+        self._pending: List[tuple] = []
+        self.ready = False
+
+    def build(self, db: Session):
+        with self._lock:
+            if self._building or self.ready:
+                return
+            self._building = True
+
+        docs, postings, prefix = {}, defaultdict(list), []
+        try:
+            rows = db.query(User.id, User.first_name, User.last_name, User.username, User.avatar, User.email) \
+                .filter(User.is_active == True).yield_per(10000)
+            for row in rows:
+                doc = search_doc(row)
+                docs[row.id] = doc
+                for token in doc.tokens:
+                    prefix.append((token, row.id))
+                    for gram in trigrams(token):
+                        postings[gram].append(row.id)
+            prefix.sort()
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._pending = []
+            raise
+
+        with self._lock:
+            self._docs = docs
+            self._trigrams = {gram: IntSet(ids) for gram, ids in postings.items()}
+            self._prefix_tokens = [token for token, _ in prefix]
+            self._prefix_ids = array("q", (user_id for _, user_id in prefix))
+            # mudanças que chegaram durante a carga
+            for user_id, doc in self._pending:
+                self._apply(user_id, doc)
+            self._pending = []
+            self._building = False
+            self.ready = True
+
+    def apply(self, changes: Dict[int, Optional[SearchDoc]]):
+        """Upsert docs (None removes the user)"""
+        with self._lock:
+            if self._building:
+                self._pending.extend(changes.items())
+            elif self.ready:
+                for user_id, doc in changes.items():
+                    self._apply(user_id, doc)
+
+    def _apply(self, user_id: int, doc: Optional[SearchDoc]):
+        old = self._docs.pop(user_id, None)
+        if old is not None:
+            for token in old.tokens:
+                for gram in trigrams(token):
+                    posting = self._trigrams.get(gram)
+                    if posting is not None:
+                        posting.discard(user_id)
+                start, end = bisect_left(self._prefix_tokens, token), bisect_right(self._prefix_tokens, token)
+                for position in range(start, end):
+                    if self._prefix_ids[position] == user_id:
+                        del self._prefix_tokens[position]
+                        del self._prefix_ids[position]
+                        break
+        if doc is None:
+            return
+        self._docs[user_id] = doc
+        for token in doc.tokens:
+            for gram in trigrams(token):
+                self._trigrams.setdefault(gram, IntSet()).add(user_id)
+            position = bisect_right(self._prefix_tokens, token)
+            self._prefix_tokens.insert(position, token)
+            self._prefix_ids.insert(position, user_id)
+
+    def _candidates(self, term: str) -> set:
+        """Users with a token starting with the term, then (for 3+ chars) containing it"""
+        found = set()
+        position = bisect_left(self._prefix_tokens, term)
+        while position < len(self._prefix_tokens) and len(found) < self.candidate_limit \
+                and self._prefix_tokens[position].startswith(term):
+            found.add(self._prefix_ids[position])
+            position += 1
+        if len(term) >= 3 and len(found) < self.candidate_limit:
+            postings = sorted((self._trigrams.get(gram) for gram in trigrams(term)), key=lambda p: len(p) if p else 0)
+            if postings and postings[0]:
+                for user_id in postings[0]:
+                    if all(user_id in posting for posting in postings[1:]):
+                        found.add(user_id)
+                        if len(found) >= self.candidate_limit:
+                            break
+        return found
+
+    def search(self, terms: List[str], email: Optional[str], viewer_id: int, social: Adjacency, limit: int) -> List[tuple]:
+        return rank_search_results(self.candidates(terms, social), terms, email, viewer_id, social, limit)
+
+    def candidates(self, terms: List[str], social: Adjacency) -> List[tuple]:
+        """(user_id, SearchDoc) pairs worth ranking for the terms"""
+        with self._lock:
+            # o termo mais longo é o mais seletivo; os demais são conferidos no ranking
+            candidates = self._candidates(max(terms, key=len))
+            # amigos e seguidos entram mesmo se o corte de candidatos os deixou de fora
+            candidates.update(user_id for user_id in social.friends if user_id in self._docs)
+            candidates.update(user_id for user_id in social.following if user_id in self._docs)
+            return [(user_id, self._docs[user_id]) for user_id in candidates if user_id in self._docs]
+
+    def __len__(self):
+        return len(self._docs)
+
+user_search_index = UserSearchIndex(USER_SEARCH_CANDIDATES)
+
+@event.listens_for(AppSession, "after_flush")
+def collect_search_changes(session, flush_context):
+    changes = session.info.setdefault("search_changes", {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, User):
+            changes[obj.id] = search_doc(obj) if obj.is_active else None
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changes[obj.id] = None
+
+@event.listens_for(AppSession, "after_commit")
+def apply_search_changes(session):
+    changes = session.info.pop("search_changes", None)
+    if changes:
+        user_search_index.apply(changes)
+        autocomplete_index.apply({
+            user_id: autocomplete_keys(doc.first_name, doc.last_name, doc.username) if doc else None
+            for user_id, doc in changes.items()
+        })
+
+@event.listens_for(AppSession, "after_rollback")
+def discard_search_changes(session):
+    session.info.pop("search_changes", None)
+
+def autocomplete_keys(first_name: Optional[str], last_name: Optional[str], username: Optional[str]) -> tuple:
+    """Keys a user is found by while typing: full name, last name and username"""
+    keys = []
+    for key in (" ".join(search_tokens(first_name, last_name)), " ".join(search_tokens(last_name)),
+                " ".join(search_tokens(username))):
+        if key and key not in keys:
+            keys.append(key)
+    return tuple(keys)
+
+class AutocompleteIndex:
+    """Sorted array of name keys ("joao silva", "silva", username) with a parallel id array.
+
+    Lookups are one bisect plus a short forward scan. Users are loaded most
+    followed first and stop being added once the memory budget is reached.
+    """
+    ENTRY_BYTES = 16  # ponteiro na lista de chaves + id no array("q")
+
+    def __init__(self, max_bytes: int, candidate_limit: int):
+        self.max_bytes = max_bytes
+        self.candidate_limit = candidate_limit
+        self._lock = threading.Lock()
+        self._keys: List[str] = []
+        self._ids = array("q")
+        self._user_keys: Dict[int, tuple] = {}
+        self.bytes_used = 0
+        self.skipped_users = 0
+        self._building = False
+        self._pending: List[tuple] = []
+        self.ready = False
+
+    @classmethod
+    def cost(cls, keys: tuple) -> int:
+        return sum(sys.getsizeof(key) + cls.ENTRY_BYTES for key in keys) + sys.getsizeof(keys) + 64
+
+    def build(self, db: Session):
+        with self._lock:
+            if self._building or self.ready:
+                return
+            self._building = True
+
+        entries, user_keys, used, skipped = [], {}, 0, 0
+        try:
+            rows = db.query(User.id, User.first_name, User.last_name, User.username) \
+                .outerjoin(UserStats, UserStats.user_id == User.id).filter(User.is_active == True) \
+                .order_by(func.coalesce(UserStats.followers_count, 0).desc(), User.id).yield_per(10000)
+            for row in rows:
+                keys = autocomplete_keys(row.first_name, row.last_name, row.username)
+                cost = self.cost(keys)
+                if used + cost > self.max_bytes:
+                    skipped += 1
+                    continue
+                used += cost
+                user_keys[row.id] = keys
+                entries.extend((key, row.id) for key in keys)
+            entries.sort()
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._pending = []
+            raise
+
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._ids = array("q", (user_id for _, user_id in entries))
+            self._user_keys = user_keys
+            self.bytes_used = used
+            self.skipped_users = skipped
+            for user_id, keys in self._pending:
+                self._apply(user_id, keys)
+            self._pending = []
+            self._building = False
+            self.ready = True
+
+    def apply(self, changes: Dict[int, Optional[tuple]]):
+        """Replace the keys of changed users (None removes the user)"""
+        with self._lock:
+            if self._building:
+                self._pending.extend(changes.items())
+            elif self.ready:
+                for user_id, keys in changes.items():
+                    self._apply(user_id, keys)
+
+    def _apply(self, user_id: int, keys: Optional[tuple]):
+        old = self._user_keys.pop(user_id, None)
+        if old is not None:
+            self.bytes_used -= self.cost(old)
+            for key in old:
+                start, end = bisect_left(self._keys, key), bisect_right(self._keys, key)
+                for position in range(start, end):
+                    if self._ids[position] == user_id:
+                        del self._keys[position]
+                        del self._ids[position]
+                        break
+        if keys is None:
+            return
+        cost = self.cost(keys)
+        if old is None and self.bytes_used + cost > self.max_bytes:
+            self.skipped_users += 1
+            return
+        self.bytes_used += cost
+        self._user_keys[user_id] = keys
+        for key in keys:
+            position = bisect_right(self._keys, key)
+            self._keys.insert(position, key)
+            self._ids.insert(position, user_id)
+
+    def lookup(self, prefix: str) -> tuple:
+        """(user ids with a key starting with prefix, truncated) in key order, up to candidate_limit"""
+        found = {}
+        with self._lock:
+            position = bisect_left(self._keys, prefix)
+            while position < len(self._keys) and self._keys[position].startswith(prefix):
+                if len(found) >= self.candidate_limit:
+                    return found, True
+                found.setdefault(self._ids[position], self._keys[position])
+                position += 1
+        return found, False
+
+    def keys_of(self, user_id: int) -> Optional[tuple]:
+        return self._user_keys.get(user_id)
+
+    def __len__(self):
+        return len(self._user_keys)
+
+autocomplete_index = AutocompleteIndex(int(AUTOCOMPLETE_MAX_MB * 1024 * 1024), AUTOCOMPLETE_CANDIDATES)
+
+def build_user_search_index():
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        user_search_index.build(db)
+        print(f"✅ Índice de busca de usuários: {len(user_search_index)} usuários em {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"⚠️ Erro ao construir o índice de busca: {e}")
+    finally:
+        db.close()
+
+def build_autocomplete_index():
+    db = SessionLocal()
+    try:
+        autocomplete_index.build(db)
+        print(f"✅ Autocomplete: {len(autocomplete_index)} usuários, {autocomplete_index.bytes_used / 1048576:.1f} MB"
+              + (f", {autocomplete_index.skipped_users} fora do limite de memória" if autocomplete_index.skipped_users else ""))
+    except Exception as e:
+        print(f"⚠️ Erro ao construir o índice de autocomplete: {e}")
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def start_user_search_index():
+    if not use_fulltext_search():
+        asyncio.create_task(asyncio.to_thread(build_user_search_index))
+    asyncio.create_task(asyncio.to_thread(build_autocomplete_index))
+
+def use_fulltext_search() -> bool:
+    return USER_SEARCH_FULLTEXT and engine.dialect.name == "mysql"
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def name_contains(term: str):
+    pattern = f"%{escape_like(term)}%"
+    return or_(User.first_name.ilike(pattern, escape="\\"), User.last_name.ilike(pattern, escape="\\"),
+               User.username.ilike(pattern, escape="\\"))
+
+def email_docs(db: Session, email: str, limit: int) -> List[tuple]:
+    """Active users whose email starts with the query (a range on the unique email index)"""
+    rows = db.query(User.id, User.first_name, User.last_name, User.username, User.avatar, User.email) \
+        .filter(User.is_active == True, User.email.like(f"{escape_like(email)}%", escape="\\")).limit(limit).all()
+    return [(row.id, search_doc(row)) for row in rows]
+
+def sql_search_docs(db: Session, terms: List[str], email: Optional[str], limit: int) -> List[tuple]:
+    """Candidates straight from the users table: MySQL FULLTEXT, or LIKE while the index loads.
+
+    FULLTEXT ignores terms shorter than USER_SEARCH_FULLTEXT_MIN_TOKEN, so those
+    are checked with LIKE (and a query made only of short terms uses LIKE alone).
+    """
+    query = db.query(User.id, User.first_name, User.last_name, User.username, User.avatar, User.email) \
+        .filter(User.is_active == True)
+    long_terms = [term for term in terms if len(term) >= USER_SEARCH_FULLTEXT_MIN_TOKEN]
+    if use_fulltext_search() and long_terms:
+        match = text("MATCH(users.first_name, users.last_name, users.username) AGAINST (:against IN BOOLEAN MODE)") \
+            .bindparams(against=" ".join(f"+{term}*" for term in long_terms))
+        condition = and_(match, *[name_contains(term) for term in terms if term not in long_terms])
+    else:
+        condition = name_contains(max(terms, key=len))
+    docs = {row.id: search_doc(row) for row in query.filter(condition).limit(limit).all()}
+    if email:
+        docs.update(email_docs(db, email, MAX_SEARCH_RESULTS))
+    return list(docs.items())
+
+def search_users_ranked(db: Session, viewer_id: int, query: str, limit: int = MAX_SEARCH_RESULTS) -> List[tuple]:
+    """Shared search service behind /users/ and /users/search"""
+    terms = search_tokens(query)
+    if not terms:
         return []
-    
-    users = db.query(User).filter(
+    email = query.strip().lower() if "@" in query else None
+    social = social_graph.get(db, viewer_id)
+    if user_search_index.ready and not use_fulltext_search():
+        metrics.incr("users.search.index")
+        if not email:
+            return user_search_index.search(terms, email, viewer_id, social, limit)
+        # o índice só guarda o email exato; prefixos de email vêm do índice único da tabela
+        docs = dict(user_search_index.candidates(terms, social))
+        docs.update(email_docs(db, email, MAX_SEARCH_RESULTS))
+        return rank_search_results(docs.items(), terms, email, viewer_id, social, limit)
+    metrics.incr("users.search.sql")
+    docs = sql_search_docs(db, terms, email, USER_SEARCH_CANDIDATES)
+    return rank_search_results(docs, terms, email, viewer_id, social, limit)
+
+def search_results_response(db: Session, viewer_id: int, results: List[tuple], include_relationships: bool):
+    flags = relationship_flags(db, viewer_id, (user_id for user_id, _ in results)) if include_relationships else {}
+    return [
+        {
+            "id": user_id,
+            "first_name": doc.first_name,
+            "last_name": doc.last_name,
+            "username": doc.username,
+            "avatar": doc.avatar,
+            "email": doc.email,
+            **({"relationship": flags.get(user_id)} if include_relationships else {})
+        }
+        for user_id, doc in results
+    ]
+
+# declarada antes de /users/{user_id}, que capturaria "search"
+@app.get("/users/search")
+async def search_users(q: str = "", include_relationships: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Search users by name, username or exact email"""
+    results = search_users_ranked(db, current_user.id, q)
+    return search_results_response(db, current_user.id, results, include_relationships)
+
+@app.get("/users/")
+async def list_users(search: str = "", include_relationships: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Same search as /users/search, with the query in ?search="""
+    results = search_users_ranked(db, current_user.id, search)
+    return search_results_response(db, current_user.id, results, include_relationships)
+
+def sql_autocomplete_matches(db: Session, typed: str, social: Adjacency) -> Dict[int, str]:
+    """Autocomplete candidates from the users table while the index is being built"""
+    pattern = f"{escape_like(typed.split(' ')[0])}%"
+    rows_query = db.query(User.id, User.first_name, User.last_name, User.username).filter(
         User.is_active == True,
-        User.id != current_user.id,
-        (User.first_name.ilike(f"%{search}%") | User.last_name.ilike(f"%{search}%") | User.email.ilike(f"%{search}%"))
-    ).limit(20).all()
-    
+        or_(User.first_name.ilike(pattern, escape="\\"), User.last_name.ilike(pattern, escape="\\"),
+            User.username.ilike(pattern, escape="\\"))
+    )
+    rows = rows_query.limit(AUTOCOMPLETE_CANDIDATES).all()
+    if len(rows) >= AUTOCOMPLETE_CANDIDATES:
+        # mesmo corte do índice: os próximos do usuário entram por fora
+        close = list(chain(social.friends, social.following))
+        for start in range(0, len(close), SUGGESTION_BATCH_SIZE):
+            rows.extend(rows_query.filter(User.id.in_(close[start:start + SUGGESTION_BATCH_SIZE])).all())
+    matches = {}
+    for row in rows:
+        key = next((key for key in autocomplete_keys(row.first_name, row.last_name, row.username) if key.startswith(typed)), None)
+        if key:
+            matches.setdefault(row.id, key)
+    return matches
+
+@app.get("/users/autocomplete")
+async def autocomplete_users(prefix: str = "", limit: int = 8, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Typeahead for @mentions and story tags: friends and followed users first, no emails"""
+    started = time.perf_counter()
+    typed = " ".join(search_tokens(prefix))
+    if not typed:
+        return []
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    social = social_graph.get(db, current_user.id)
+
+    if not autocomplete_index.ready:
+        # índice ainda carregando (logo após o restart): prefixo direto no SQL
+        metrics.incr("users.autocomplete.sql")
+        matches = sql_autocomplete_matches(db, typed, social)
+    else:
+        matches, truncated = autocomplete_index.lookup(typed)
+        if truncated:
+            # prefixo muito comum: os próximos do usuário podem ter ficado além do corte
+            for user_id in chain(social.friends, social.following):
+                keys = autocomplete_index.keys_of(user_id)
+                if keys and user_id not in matches:
+                    key = next((key for key in keys if key.startswith(typed)), None)
+                    if key:
+                        matches[user_id] = key
+
+    def rank(item):
+        user_id, key = item
+        proximity = 2 if user_id in social.friends else 1
+        return (-proximity, key != typed, len(key), user_id)
+
+    # Corte antes de ordenar: amigos e seguidos são ranqueados; o resto completa
+    # o limite na ordem das chaves (a exata vem primeiro), sem ordenar os candidatos
+    close, rest = [], []
+    for user_id, key in matches.items():
+        if user_id in social.friends or user_id in social.following:
+            bucket = close
+        elif len(rest) < limit:
+            bucket = rest
+        else:
+            continue
+        if user_id != current_user.id and not social.is_blocked(user_id):
+            bucket.append((user_id, key))
+    ranked = heapq.nsmallest(limit, close, key=rank)
+    ranked += rest[:limit - len(ranked)]
+    cards = load_user_cards(db, (user_id for user_id, _ in ranked))
+    metrics.observe_ms("users.autocomplete", (time.perf_counter() - started) * 1000)
     return [
         {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "email": user.email,
-            "avatar": getattr(user, 'avatar', None)
+            **cards[user_id],
+            "is_friend": user_id in social.friends,
+            "is_following": user_id in social.following
         }
-        for user in users
+        for user_id, _ in ranked
+        if user_id in cards
     ]
 
 # Get user by ID
 @app.get("/users/{user_id}")
-async def get_user_by_id(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_by_id(user_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1529,30 +4013,26 @@ async def get_user_by_id(user_id: int, current_user: User = Depends(get_current_
 
 # Get user profile with complete information
 @app.get("/users/{user_id}/profile")
-async def get_user_profile(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_profile(user_id: int, request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter perfil completo do usuário com configurações de privacidade"""
-    user = db.query(User).filter(User.id == user_id, User.is_active == True).first()
-    if not user:
+    # o viewer entra no ETag, então mudanças no próprio perfil dele também contam
+    keys = [("profile", user_id), ("profile", current_user.id)]
+    cached = not_modified(request, response, resource_etag(current_user.id, request, keys), db)
+    if cached:
+        return cached
+
+    # Usuário e contadores numa leitura por chave primária
+    row = db.query(User, UserStats).outerjoin(UserStats, UserStats.user_id == User.id) \
+        .filter(User.id == user_id, User.is_active == True).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
+    user, stats = row
+    counters = user_counters(stats)
 
     # Verificar se são amigos para mostrar informações privadas
-    friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
-        ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id)),
-        Friendship.status == "accepted"
-    ).first()
-
-    is_friend = friendship is not None
+    is_friend = are_friends(db, current_user.id, user_id)
     is_own_profile = current_user.id == user_id
 
-    # Calcular estatísticas
-    friends_count = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).count()
-
-    posts_count = db.query(Post).filter(Post.author_id == user_id).count()
-
     # Determinar visibilidade das informações com base nas configurações de privacidade
     def can_see_field(field_visibility):
         if is_own_profile:
@@ -1579,8 +4059,10 @@ async def get_user_profile(user_id: int, current_user: User = Depends(get_curren
         "education": user.education,
         "is_verified": user.is_verified,
         "created_at": user.created_at.isoformat(),
-        "friends_count": friends_count,
-        "posts_count": posts_count,
+        "friends_count": counters["friends_count"],
+        "posts_count": counters["posts_count"],
+        "followers_count": counters["followers_count"],
+        "following_count": counters["following_count"],
         "is_own_profile": is_own_profile,
         "is_friend": is_friend
     }
@@ -1600,69 +4082,62 @@ async def get_user_profile(user_id: int, current_user: User = Depends(get_curren
 
 # Get user friends list
 @app.get("/users/{user_id}/friends")
-async def get_user_friends(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Obter lista de amigos do usuário"""
+async def get_user_friends(user_id: int, response: Response, before: Optional[str] = None, after: Optional[str] = None,
+                           limit: int = DEFAULT_PAGE_SIZE, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Obter lista de amigos do usuário (mais recentes primeiro, paginada por cursor)"""
     # Verificar se pode ver a lista de amigos
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User.id, User.profile_visibility).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Verificar privacidade do perfil
     if user.profile_visibility == "private" and current_user.id != user_id:
         # Verificar se são amigos
-        friendship = db.query(Friendship).filter(
-            ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == user_id)) |
-            ((Friendship.requester_id == user_id) & (Friendship.addressee_id == current_user.id)),
-            Friendship.status == "accepted"
-        ).first()
-
-        if not friendship:
+        if not are_friends(db, current_user.id, user_id):
             raise HTTPException(status_code=403, detail="Cannot view this user's friends list")
 
-    # Buscar amigos
-    friendships = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).all()
-
-    friends_data = []
-    for friendship in friendships:
-        friend_id = friendship.addressee_id if friendship.requester_id == user_id else friendship.requester_id
-        friend = db.query(User).filter(User.id == friend_id).first()
+    # Uma query: range em friend_edges + join com users
+    query = db.query(
+        FriendEdge.friend_id, FriendEdge.since,
+        User.first_name, User.last_name, User.username, User.avatar
+    ).join(User, User.id == FriendEdge.friend_id).filter(FriendEdge.user_id == user_id)
+    rows, next_cursor, prev_cursor = keyset_paginate(query, FriendEdge.since, FriendEdge.friend_id, before, after, limit)
+    set_cursor_headers(response, next_cursor, prev_cursor)
+    response.headers["X-Total-Count"] = str(get_user_counters(db, user_id)["friends_count"])
 
-        if friend:
-            friends_data.append({
-                "id": friend.id,
-                "first_name": friend.first_name,
-                "last_name": friend.last_name,
-                "username": friend.username,
-                "avatar": friend.avatar,
-                "friends_since": friendship.updated_at.isoformat() if friendship.updated_at else friendship.created_at.isoformat()
-            })
-
-    return friends_data
+    return [
+        {
+            "id": row.friend_id,
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "username": row.username,
+            "avatar": row.avatar,
+            "friends_since": row.since.isoformat() if row.since else None
+        }
+        for row in rows
+    ]
 
 # Remove friend
 @app.delete("/friends/{friend_id}")
-async def remove_friend(friend_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def remove_friend(friend_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Remover amigo"""
-    friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == friend_id)) |
-        ((Friendship.requester_id == friend_id) & (Friendship.addressee_id == current_user.id)),
-        Friendship.status == "accepted"
-    ).first()
+    friendship = find_friendship(db, current_user.id, friend_id)
 
-    if not friendship:
+    if not friendship or friendship.status != "accepted":
         raise HTTPException(status_code=404, detail="Friendship not found")
 
     db.delete(friendship)
+    remove_friend_edges(db, current_user.id, friend_id)
+    db.flush()
+    prune_timeline(db, current_user.id, friend_id)
+    prune_timeline(db, friend_id, current_user.id)
     db.commit()
 
     return {"message": "Friend removed successfully"}
 
 # Avatar and cover photo routes
 @app.post("/profile/avatar")
-async def upload_avatar(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_avatar(file: UploadFile = File(...), current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Upload e definir avatar do usuário"""
     import os
     import uuid
@@ -1705,7 +4180,7 @@ async def upload_avatar(file: UploadFile = File(...), current_user: User = Depen
         raise HTTPException(status_code=500, detail=f"Failed to upload avatar: {str(e)}")
 
 @app.post("/users/me/avatar")
-async def upload_user_avatar(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_user_avatar(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Upload e definir avatar do usuário (endpoint alternativo)"""
     import os
     import uuid
@@ -1761,7 +4236,9 @@ async def upload_user_avatar(file: UploadFile = File(...), current_user: User =
             is_profile_update=True
         )
         db.add(profile_post)
+        adjust_user_stat(db, current_user.id, UserStats.posts_count, 1)
         db.commit()
+        background_tasks.add_task(fan_out_post, profile_post.id)
         print(f"✅ Database updated with avatar URL: {avatar_url}")
         print(f"✅ Profile update post created")
 
@@ -1775,7 +4252,7 @@ async def upload_user_avatar(file: UploadFile = File(...), current_user: User =
         raise HTTPException(status_code=500, detail=f"Failed to upload avatar: {str(e)}")
 
 @app.post("/users/me/cover")
-async def upload_user_cover_photo(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_user_cover_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Upload e definir foto de capa do usuário (endpoint alternativo)"""
     import os
     import uuid
@@ -1831,7 +4308,9 @@ async def upload_user_cover_photo(file: UploadFile = File(...), current_user: Us
             is_cover_update=True
         )
         db.add(cover_post)
+        adjust_user_stat(db, current_user.id, UserStats.posts_count, 1)
         db.commit()
+        background_tasks.add_task(fan_out_post, cover_post.id)
         print(f"✅ Database updated with cover URL: {cover_url}")
         print(f"✅ Cover update post created")
 
@@ -1845,7 +4324,7 @@ async def upload_user_cover_photo(file: UploadFile = File(...), current_user: Us
         raise HTTPException(status_code=500, detail=f"Failed to upload cover photo: {str(e)}")
 
 @app.post("/profile/cover")
-async def upload_cover_photo(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_cover_photo(background_tasks: BackgroundTasks, file: UploadFile = File(...), current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Upload e definir foto de capa do usuário"""
     import os
     import uuid
@@ -1890,7 +4369,9 @@ async def upload_cover_photo(file: UploadFile = File(...), current_user: User =
             is_cover_update=True
         )
         db.add(cover_post)
+        adjust_user_stat(db, current_user.id, UserStats.posts_count, 1)
         db.commit()
+        background_tasks.add_task(fan_out_post, cover_post.id)
 
         return {
             "message": "Cover photo updated successfully",
@@ -1902,18 +4383,19 @@ async def upload_cover_photo(file: UploadFile = File(...), current_user: User =
 
 # Mark all notifications as read
 @app.put("/notifications/mark-all-read")
-async def mark_all_notifications_as_read(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def mark_all_notifications_as_read(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     db.query(Notification).filter(
         Notification.recipient_id == current_user.id,
         Notification.is_read == False
     ).update({"is_read": True})
+    mark_changed(db, ("notifications", current_user.id))
     db.commit()
     
     return {"message": "All notifications marked as read"}
 
 # Delete notification
 @app.delete("/notifications/{notification_id}")
-async def delete_notification(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_notification(notification_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     notification = db.query(Notification).filter(
         Notification.id == notification_id,
         Notification.recipient_id == current_user.id
@@ -1929,7 +4411,7 @@ async def delete_notification(notification_id: int, current_user: User = Depends
 
 # Delete post
 @app.delete("/posts/{post_id}")
-async def delete_post(post_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_post(post_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     post = db.query(Post).filter(Post.id == post_id).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -1939,17 +4421,20 @@ async def delete_post(post_id: int, current_user: User = Depends(get_current_use
     
     # Delete related data
     db.query(Reaction).filter(Reaction.post_id == post_id).delete()
+    db.query(PostReactionCount).filter(PostReactionCount.post_id == post_id).delete()
     db.query(Comment).filter(Comment.post_id == post_id).delete()
     db.query(Share).filter(Share.post_id == post_id).delete()
+    db.query(TimelineEntry).filter(TimelineEntry.post_id == post_id).delete()
     
     db.delete(post)
+    adjust_user_stat(db, post.author_id, UserStats.posts_count, -1)
     db.commit()
     
     return {"message": "Post deleted successfully"}
 
 # Stories routes
 @app.post("/stories/", response_model=StoryResponse)
-async def create_story(story: StoryCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_story(story: StoryCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Validação especial para vídeos - máximo 25 segundos
     if story.media_type == "video" and story.max_duration_seconds > 25:
         raise HTTPException(status_code=400, detail="Video stories cannot exceed 25 seconds")
@@ -1973,12 +4458,7 @@ async def create_story(story: StoryCreate, current_user: User = Depends(get_curr
     
     return StoryResponse(
         id=db_story.id,
-        author={
-            "id": db_story.author.id,
-            "first_name": db_story.author.first_name,
-            "last_name": db_story.author.last_name,
-            "avatar": None
-        },
+        author=user_card(current_user),
         content=db_story.content,
         media_type=db_story.media_type,
         media_url=db_story.media_url,
@@ -1989,33 +4469,40 @@ async def create_story(story: StoryCreate, current_user: User = Depends(get_curr
     )
 
 @app.get("/stories/", response_model=List[StoryResponse])
-async def get_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_stories(request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     # Get stories that haven't expired
     now = datetime.utcnow()
-    stories = db.query(Story).filter(Story.expires_at > now).order_by(Story.created_at.desc()).all()
-    
-    return [
-        StoryResponse(
-            id=story.id,
-            author={
-                "id": story.author.id,
-                "first_name": story.author.first_name,
-                "last_name": story.author.last_name,
-                "avatar": None
-            },
-            content=story.content,
-            media_type=story.media_type,
-            media_url=story.media_url,
-            background_color=story.background_color,
-            created_at=story.created_at,
-            expires_at=story.expires_at,
-            views_count=db.query(StoryView).filter(StoryView.story_id == story.id).count()
-        )
+    # a bandeja também muda quando um story expira, sem nenhuma escrita
+    next_expiry = await db.run_sync(lambda session: session.query(func.min(Story.expires_at)).filter(Story.expires_at > now).scalar())
+    cached = not_modified(request, response, resource_etag(current_user.id, request, [("stories",), ("users",)], next_expiry), db)
+    if cached:
+        return cached
+
+    def load_tray(session: Session):
+        stories = session.query(
+            Story.id, Story.author_id, Story.content, Story.media_type, Story.media_url,
+            Story.background_color, Story.created_at, Story.expires_at
+        ).filter(Story.expires_at > now).order_by(Story.created_at.desc()).all()
+        return stories, load_user_cards(session, (story.author_id for story in stories)), count_story_views(session, [story.id for story in stories])
+
+    stories, cards, views = await db.run_sync(load_tray)
+    return fast_response([
+        {
+            "id": story.id,
+            "author": card_for(cards, story.author_id),
+            "content": story.content,
+            "media_type": story.media_type,
+            "media_url": story.media_url,
+            "background_color": story.background_color,
+            "created_at": story.created_at,
+            "expires_at": story.expires_at,
+            "views_count": views.get(story.id, 0)
+        }
         for story in stories
-    ]
+    ], response)
 
 @app.post("/stories/{story_id}/view")
-async def view_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def view_story(story_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -2040,7 +4527,7 @@ async def view_story(story_id: int, current_user: User = Depends(get_current_use
     return {"message": "Story viewed"}
 
 @app.delete("/stories/{story_id}")
-async def delete_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_story(story_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
         raise HTTPException(status_code=404, detail="Story not found")
@@ -2059,7 +4546,7 @@ async def delete_story(story_id: int, current_user: User = Depends(get_current_u
 
 # Advanced Story Editor routes
 @app.post("/stories/with-editor", response_model=StoryResponse)
-async def create_story_with_editor(story_data: StoryWithEditor, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_story_with_editor(story_data: StoryWithEditor, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Criar story com editor mobile completo (tags, overlays, etc.)"""
     # Validação especial para vídeos - máximo 25 segundos
     if story_data.media_type == "video" and story_data.max_duration_seconds > 25:
@@ -2128,12 +4615,7 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
 
     return StoryResponse(
         id=db_story.id,
-        author={
-            "id": db_story.author.id,
-            "first_name": db_story.author.first_name,
-            "last_name": db_story.author.last_name,
-            "avatar": db_story.author.avatar
-        },
+        author=user_card(current_user),
         content=db_story.content,
         media_type=db_story.media_type,
         media_url=db_story.media_url,
@@ -2144,7 +4626,7 @@ async def create_story_with_editor(story_data: StoryWithEditor, current_user: Us
     )
 
 @app.post("/stories/{story_id}/tags")
-async def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Adicionar tag a um story existente"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2180,7 +4662,7 @@ async def add_story_tag(story_id: int, tag_data: StoryTagCreate, current_user: U
     return {"message": "User tagged successfully"}
 
 @app.post("/stories/{story_id}/overlays")
-async def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Adicionar overlay a um story existente"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2207,7 +4689,7 @@ async def add_story_overlay(story_id: int, overlay_data: StoryOverlayCreate, cur
     return {"message": "Overlay added successfully"}
 
 @app.get("/stories/{story_id}/details")
-async def get_story_details(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_story_details(story_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter detalhes completos do story incluindo tags e overlays"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2219,15 +4701,11 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
 
     # Buscar tags
     tags = db.query(StoryTag).filter(StoryTag.story_id == story_id).all()
+    cards = load_user_cards(db, [story.author_id] + [tag.tagged_user_id for tag in tags])
     tag_data = [
         {
             "id": tag.id,
-            "tagged_user": {
-                "id": tag.tagged_user.id,
-                "first_name": tag.tagged_user.first_name,
-                "last_name": tag.tagged_user.last_name,
-                "avatar": tag.tagged_user.avatar
-            },
+            "tagged_user": card_for(cards, tag.tagged_user_id),
             "position_x": tag.position_x,
             "position_y": tag.position_y
         }
@@ -2254,12 +4732,7 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
 
     return {
         "id": story.id,
-        "author": {
-            "id": story.author.id,
-            "first_name": story.author.first_name,
-            "last_name": story.author.last_name,
-            "avatar": story.author.avatar
-        },
+        "author": card_for(cards, story.author_id),
         "content": story.content,
         "media_type": story.media_type,
         "media_url": story.media_url,
@@ -2274,10 +4747,14 @@ async def get_story_details(story_id: int, current_user: User = Depends(get_curr
 
 # Notifications routes
 @app.get("/notifications/", response_model=List[NotificationResponse])
-async def get_notifications(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    notifications = db.query(Notification).filter(
-        Notification.recipient_id == current_user.id
-    ).order_by(Notification.created_at.desc()).limit(50).all()
+async def get_notifications(current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    def load(session: Session):
+        notifications = session.query(Notification).filter(
+            Notification.recipient_id == current_user.id
+        ).order_by(Notification.created_at.desc()).limit(50).all()
+        return notifications, load_user_cards(session, (notification.sender_id for notification in notifications))
+
+    notifications, cards = await db.run_sync(load)
     
     return [
         NotificationResponse(
@@ -2289,40 +4766,46 @@ async def get_notifications(current_user: User = Depends(get_current_user), db:
             is_read=notification.is_read,
             created_at=notification.created_at,
             sender={
-                "id": notification.sender.id,
-                "name": f"{notification.sender.first_name} {notification.sender.last_name}"
-            } if notification.sender else None
+                **cards[notification.sender_id],
+                "name": f"{cards[notification.sender_id]['first_name']} {cards[notification.sender_id]['last_name']}"
+            } if notification.sender_id in cards else None
         )
         for notification in notifications
     ]
 
 @app.get("/notifications/unread-count")
-async def get_unread_notifications_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    count = db.query(Notification).filter(
+async def get_unread_notifications_count(request: Request, response: Response, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    cached = not_modified(request, response, resource_etag(current_user.id, request, [("notifications", current_user.id)]), db)
+    if cached:
+        return cached
+
+    count = await db.run_sync(lambda session: session.query(Notification).filter(
         Notification.recipient_id == current_user.id,
         Notification.is_read == False
-    ).count()
+    ).count())
     
     return {"count": count}
 
 @app.put("/notifications/{notification_id}/read")
-async def mark_notification_as_read(notification_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    notification = db.query(Notification).filter(
-        Notification.id == notification_id,
-        Notification.recipient_id == current_user.id
-    ).first()
-    
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
-    
-    notification.is_read = True
-    db.commit()
-    
+async def mark_notification_as_read(notification_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    def mark_read(session: Session):
+        notification = session.query(Notification).filter(
+            Notification.id == notification_id,
+            Notification.recipient_id == current_user.id
+        ).first()
+
+        if not notification:
+            raise HTTPException(status_code=404, detail="Notification not found")
+
+        notification.is_read = True
+        session.commit()
+
+    await db.run_sync(mark_read)
     return {"message": "Notification marked as read"}
 
 # Friendships routes
 @app.get("/friendships/pending-count")
-async def get_pending_friendships_count(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_pending_friendships_count(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     count = db.query(Friendship).filter(
         Friendship.addressee_id == current_user.id,
         Friendship.status == "pending"
@@ -2331,21 +4814,17 @@ async def get_pending_friendships_count(current_user: User = Depends(get_current
     return {"count": count}
 
 @app.get("/friendships/pending")
-async def get_pending_friendships(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_pending_friendships(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     friendships = db.query(Friendship).filter(
         Friendship.addressee_id == current_user.id,
         Friendship.status == "pending"
     ).all()
+    cards = load_user_cards(db, (friendship.requester_id for friendship in friendships))
     
     return [
         {
             "id": friendship.id,
-            "requester": {
-                "id": friendship.requester.id,
-                "first_name": friendship.requester.first_name,
-                "last_name": friendship.requester.last_name,
-                "avatar": None
-            },
+            "requester": card_for(cards, friendship.requester_id),
             "created_at": friendship.created_at
         }
         for friendship in friendships
@@ -2353,7 +4832,7 @@ async def get_pending_friendships(current_user: User = Depends(get_current_user)
 
 # Settings and Profile routes
 @app.put("/profile/")
-async def update_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Atualizar perfil do usuário"""
     update_data = profile_data.dict(exclude_unset=True)
 
@@ -2388,21 +4867,21 @@ async def update_profile(profile_data: UserProfileUpdate, current_user: User = D
     return {"message": "Profile updated successfully"}
 
 @app.put("/settings/profile")
-async def update_settings_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_settings_profile(profile_data: UserProfileUpdate, current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Atualizar perfil do usuário (endpoint alternativo)"""
     return await update_profile(profile_data, current_user, db)
 
 @app.put("/settings/password")
-async def update_password(password_data: PasswordUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_password(password_data: PasswordUpdate, current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Alterar senha do usuário"""
-    if not verify_password(password_data.current_password, current_user.password_hash):
+    if not await verify_password_async(password_data.current_password, current_user.password_hash):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
 
     # Verificar se nova senha é diferente
-    if verify_password(password_data.new_password, current_user.password_hash):
+    if await verify_password_async(password_data.new_password, current_user.password_hash):
         raise HTTPException(status_code=400, detail="New password must be different from current password")
 
-    current_user.password_hash = hash_password(password_data.new_password)
+    current_user.password_hash = await hash_password_async(password_data.new_password)
     current_user.updated_at = datetime.utcnow()
     db.commit()
     db.refresh(current_user)
@@ -2410,7 +4889,7 @@ async def update_password(password_data: PasswordUpdate, current_user: User = De
     return {"message": "Password updated successfully"}
 
 @app.get("/settings/privacy")
-async def get_privacy_settings(current_user: User = Depends(get_current_user)):
+async def get_privacy_settings(current_user: Principal = Depends(get_current_user)):
     """Obter configurações de privacidade"""
     return {
         "profile_visibility": current_user.profile_visibility,
@@ -2423,7 +4902,7 @@ async def get_privacy_settings(current_user: User = Depends(get_current_user)):
     }
 
 @app.put("/settings/privacy")
-async def update_privacy_settings(privacy_data: PrivacySettings, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_privacy_settings(privacy_data: PrivacySettings, current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Atualizar configurações de privacidade"""
     update_data = privacy_data.dict(exclude_unset=True)
 
@@ -2445,7 +4924,7 @@ async def update_privacy_settings(privacy_data: PrivacySettings, current_user: U
     return {"message": "Privacy settings updated successfully"}
 
 @app.get("/settings/notifications")
-async def get_notification_settings(current_user: User = Depends(get_current_user)):
+async def get_notification_settings(current_user: Principal = Depends(get_current_user)):
     """Obter configurações de notificação"""
     return {
         "email_notifications": current_user.email_notifications,
@@ -2458,7 +4937,7 @@ async def get_notification_settings(current_user: User = Depends(get_current_use
     }
 
 @app.put("/settings/notifications")
-async def update_notification_settings(notification_data: NotificationSettings, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_notification_settings(notification_data: NotificationSettings, current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Atualizar configurações de notificação"""
     update_data = notification_data.dict(exclude_unset=True)
 
@@ -2471,7 +4950,7 @@ async def update_notification_settings(notification_data: NotificationSettings,
     return {"message": "Notification settings updated successfully"}
 
 @app.delete("/account/deactivate")
-async def deactivate_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def deactivate_account(current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Desativar conta do usuário"""
     current_user.account_deactivated = True
     current_user.deactivated_at = datetime.utcnow()
@@ -2482,7 +4961,7 @@ async def deactivate_account(current_user: User = Depends(get_current_user), db:
     return {"message": "Account deactivated successfully"}
 
 @app.delete("/account/delete")
-async def delete_account(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_account(current_user: User = Depends(get_current_user_row), db: Session = Depends(get_db)):
     """Deletar conta permanentemente (soft delete)"""
     # Soft delete - manter dados mas marcar como deletado
     current_user.account_deactivated = True
@@ -2496,48 +4975,50 @@ async def delete_account(current_user: User = Depends(get_current_user), db: Ses
 
 # Messages routes
 @app.post("/messages/", response_model=MessageResponse)
-async def send_message(message_data: MessageCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def send_message(message_data: MessageCreate, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """Enviar mensagem"""
-    # Verificar se destinatário existe
-    recipient = db.query(User).filter(User.id == message_data.recipient_id, User.is_active == True).first()
-    if not recipient:
-        raise HTTPException(status_code=404, detail="Recipient not found")
-
-    # Verificar se não está bloqueado
-    blocked = db.query(Block).filter(
-        ((Block.blocker_id == current_user.id) & (Block.blocked_id == message_data.recipient_id)) |
-        ((Block.blocker_id == message_data.recipient_id) & (Block.blocked_id == current_user.id))
-    ).first()
+    def store(session: Session):
+        # Verificar se destinatário existe
+        recipient = session.query(User).filter(User.id == message_data.recipient_id, User.is_active == True).first()
+        if not recipient:
+            raise HTTPException(status_code=404, detail="Recipient not found")
 
-    if blocked:
-        raise HTTPException(status_code=403, detail="Cannot send message to this user")
+        # Verificar se não está bloqueado
+        if is_blocked(session, current_user.id, message_data.recipient_id):
+            raise HTTPException(status_code=403, detail="Cannot send message to this user")
 
-    db_message = Message(
-        sender_id=current_user.id,
-        recipient_id=message_data.recipient_id,
-        content=message_data.content,
-        message_type=message_data.message_type,
-        media_url=message_data.media_url,
-        media_metadata=message_data.media_metadata
-    )
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
-
-    # Enviar notificação em tempo real se o usuário quiser receber
-    if recipient.message_notifications:
-        notification = Notification(
-            recipient_id=message_data.recipient_id,
+        db_message = Message(
             sender_id=current_user.id,
-            notification_type="message",
-            title=f"{current_user.first_name} {current_user.last_name}",
-            message="enviou uma mensagem",
-            data=json.dumps({"message_id": db_message.id}),
-            created_at=datetime.utcnow()
+            recipient_id=message_data.recipient_id,
+            content=message_data.content,
+            message_type=message_data.message_type,
+            media_url=message_data.media_url,
+            media_metadata=message_data.media_metadata
         )
-        db.add(notification)
-        db.commit()
+        session.add(db_message)
+        session.commit()
+        session.refresh(db_message)
+
+        # Notificação só se o usuário quiser receber
+        notification = None
+        if recipient.message_notifications:
+            notification = Notification(
+                recipient_id=message_data.recipient_id,
+                sender_id=current_user.id,
+                notification_type="message",
+                title=f"{current_user.first_name} {current_user.last_name}",
+                message="enviou uma mensagem",
+                data=json.dumps({"message_id": db_message.id}),
+                created_at=datetime.utcnow()
+            )
+            session.add(notification)
+            session.commit()
+        return db_message, user_card(recipient), notification
+
+    db_message, recipient_card, notification = await db.run_sync(store)
 
+    # Enviar notificação em tempo real
+    if notification is not None:
         # Enviar via WebSocket
         await manager.send_notification(message_data.recipient_id, {
             "id": notification.id,
@@ -2572,18 +5053,8 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
 
     return MessageResponse(
         id=db_message.id,
-        sender={
-            "id": current_user.id,
-            "first_name": current_user.first_name,
-            "last_name": current_user.last_name,
-            "avatar": current_user.avatar
-        },
-        recipient={
-            "id": recipient.id,
-            "first_name": recipient.first_name,
-            "last_name": recipient.last_name,
-            "avatar": recipient.avatar
-        },
+        sender=user_card(current_user),
+        recipient=recipient_card,
         content=db_message.content,
         message_type=db_message.message_type,
         media_url=db_message.media_url,
@@ -2592,22 +5063,24 @@ async def send_message(message_data: MessageCreate, current_user: User = Depends
     )
 
 @app.get("/messages/conversation/{user_id}")
-async def get_conversation(user_id: int, limit: int = 50, offset: int = 0, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_conversation(user_id: int, limit: int = 50, offset: int = 0, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     """Obter conversação com um usuário específico"""
-    messages = db.query(Message).filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == user_id)) |
-        ((Message.sender_id == user_id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()
-
-    return [
+    def load(session: Session):
+        messages = session.query(
+            Message.id, Message.sender_id, Message.content, Message.message_type,
+            Message.media_url, Message.is_read, Message.created_at
+        ).filter(
+            ((Message.sender_id == current_user.id) & (Message.recipient_id == user_id)) |
+            ((Message.sender_id == user_id) & (Message.recipient_id == current_user.id))
+        ).order_by(Message.created_at.desc()).offset(offset).limit(limit).all()
+        return messages, load_user_cards(session, {current_user.id, user_id})
+
+    messages, cards = await db.run_sync(load)
+
+    return fast_response([
         {
             "id": msg.id,
-            "sender": {
-                "id": msg.sender.id,
-                "first_name": msg.sender.first_name,
-                "last_name": msg.sender.last_name,
-                "avatar": msg.sender.avatar
-            },
+            "sender": card_for(cards, msg.sender_id),
             "content": msg.content,
             "message_type": msg.message_type,
             "media_url": msg.media_url,
@@ -2616,11 +5089,9 @@ async def get_conversation(user_id: int, limit: int = 50, offset: int = 0, curre
             "is_own": msg.sender_id == current_user.id
         }
         for msg in reversed(messages)
-    ]
+    ])
 
-@app.get("/messages/conversations")
-async def get_conversations(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Obter lista de conversações"""
+def load_conversations(db: Session, viewer_id: int) -> List[Dict[str, Any]]:
     # Buscar últimas mensagens de cada conversação
     subquery = db.query(
         Message.id,
@@ -2631,48 +5102,49 @@ async def get_conversations(current_user: User = Depends(get_current_user), db:
         Message.is_read,
         Message.created_at
     ).filter(
-        (Message.sender_id == current_user.id) | (Message.recipient_id == current_user.id)
+        (Message.sender_id == viewer_id) | (Message.recipient_id == viewer_id)
     ).order_by(Message.created_at.desc()).subquery()
 
     # Agrupar por conversa e pegar a mais recente
     conversations = db.query(subquery).all()
 
+    cards = load_user_cards(db, (msg.recipient_id if msg.sender_id == viewer_id else msg.sender_id for msg in conversations))
+
     conversation_dict = {}
     for msg in conversations:
-        other_user_id = msg.recipient_id if msg.sender_id == current_user.id else msg.sender_id
+        other_user_id = msg.recipient_id if msg.sender_id == viewer_id else msg.sender_id
 
         if other_user_id not in conversation_dict:
-            other_user = db.query(User).filter(User.id == other_user_id).first()
             conversation_dict[other_user_id] = {
-                "user": {
-                    "id": other_user.id,
-                    "first_name": other_user.first_name,
-                    "last_name": other_user.last_name,
-                    "avatar": other_user.avatar
-                },
+                "user": card_for(cards, other_user_id),
                 "last_message": {
                     "content": msg.content,
                     "message_type": msg.message_type,
                     "created_at": msg.created_at,
                     "is_read": msg.is_read,
-                    "is_own": msg.sender_id == current_user.id
+                    "is_own": msg.sender_id == viewer_id
                 },
                 "unread_count": 0
             }
 
-    # Contar mensagens não lidas
-    for conv_id in conversation_dict:
-        unread_count = db.query(Message).filter(
-            Message.sender_id == conv_id,
-            Message.recipient_id == current_user.id,
-            Message.is_read == False
-        ).count()
-        conversation_dict[conv_id]["unread_count"] = unread_count
+    # Contar mensagens não lidas (uma única query agrupada)
+    unread_counts = db.query(Message.sender_id, func.count(Message.id)).filter(
+        Message.recipient_id == viewer_id,
+        Message.is_read == False
+    ).group_by(Message.sender_id).all()
+    for sender_id, unread_count in unread_counts:
+        if sender_id in conversation_dict:
+            conversation_dict[sender_id]["unread_count"] = unread_count
 
     return list(conversation_dict.values())
 
+@app.get("/messages/conversations")
+async def get_conversations(current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    """Obter lista de conversações"""
+    return await db.run_sync(load_conversations, current_user.id)
+
 @app.put("/messages/{message_id}/read")
-async def mark_message_as_read(message_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def mark_message_as_read(message_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Marcar mensagem como lida"""
     message = db.query(Message).filter(
         Message.id == message_id,
@@ -2690,7 +5162,7 @@ async def mark_message_as_read(message_id: int, current_user: User = Depends(get
 
 # Block and Follow routes
 @app.post("/blocks/")
-async def block_user(block_data: BlockCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def block_user(block_data: BlockCreate, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Bloquear usuário"""
     if current_user.id == block_data.blocked_id:
         raise HTTPException(status_code=400, detail="Cannot block yourself")
@@ -2717,13 +5189,12 @@ async def block_user(block_data: BlockCreate, current_user: User = Depends(get_c
     db.add(db_block)
 
     # Remover amizade se existir
-    friendship = db.query(Friendship).filter(
-        ((Friendship.requester_id == current_user.id) & (Friendship.addressee_id == block_data.blocked_id)) |
-        ((Friendship.requester_id == block_data.blocked_id) & (Friendship.addressee_id == current_user.id))
-    ).first()
+    friendship = find_friendship(db, current_user.id, block_data.blocked_id)
 
     if friendship:
         db.delete(friendship)
+        remove_friend_edges(db, current_user.id, block_data.blocked_id)
+    graph_change(db, "add_block", current_user.id, block_data.blocked_id)
 
     # Remover follow se existir
     follow = db.query(Follow).filter(
@@ -2733,13 +5204,18 @@ async def block_user(block_data: BlockCreate, current_user: User = Depends(get_c
 
     if follow:
         db.delete(follow)
+        graph_change(db, "remove_follow", current_user.id, block_data.blocked_id)
+        adjust_follow_counters(db, current_user.id, block_data.blocked_id, -1)
 
+    db.flush()
+    prune_timeline(db, current_user.id, block_data.blocked_id)
+    prune_timeline(db, block_data.blocked_id, current_user.id)
     db.commit()
 
     return {"message": "User blocked successfully"}
 
 @app.delete("/blocks/{block_id}")
-async def unblock_user(block_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def unblock_user(block_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Desbloquear usuário"""
     block = db.query(Block).filter(
         Block.id == block_id,
@@ -2750,24 +5226,21 @@ async def unblock_user(block_id: int, current_user: User = Depends(get_current_u
         raise HTTPException(status_code=404, detail="Block not found")
 
     db.delete(block)
+    graph_change(db, "remove_block", block.blocker_id, block.blocked_id)
     db.commit()
 
     return {"message": "User unblocked successfully"}
 
 @app.get("/blocks/")
-async def get_blocked_users(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_blocked_users(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter lista de usuários bloqueados"""
     blocks = db.query(Block).filter(Block.blocker_id == current_user.id).all()
+    cards = load_user_cards(db, (block.blocked_id for block in blocks))
 
     return [
         {
             "id": block.id,
-            "blocked_user": {
-                "id": block.blocked.id,
-                "first_name": block.blocked.first_name,
-                "last_name": block.blocked.last_name,
-                "avatar": block.blocked.avatar
-            },
+            "blocked_user": card_for(cards, block.blocked_id),
             "created_at": block.created_at
         }
         for block in blocks
@@ -2775,7 +5248,7 @@ async def get_blocked_users(current_user: User = Depends(get_current_user), db:
 
 # Stories archive routes
 @app.put("/stories/{story_id}/archive")
-async def archive_story(story_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def archive_story(story_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Arquivar story"""
     story = db.query(Story).filter(Story.id == story_id).first()
     if not story:
@@ -2791,12 +5264,13 @@ async def archive_story(story_id: int, current_user: User = Depends(get_current_
     return {"message": "Story archived successfully"}
 
 @app.get("/stories/archived")
-async def get_archived_stories(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_archived_stories(current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Obter stories arquivados"""
     stories = db.query(Story).filter(
         Story.author_id == current_user.id,
         Story.archived == True
     ).order_by(Story.archived_at.desc()).all()
+    views = count_story_views(db, [story.id for story in stories])
 
     return [
         {
@@ -2807,12 +5281,25 @@ async def get_archived_stories(current_user: User = Depends(get_current_user), d
             "background_color": story.background_color,
             "created_at": story.created_at,
             "archived_at": story.archived_at,
-            "views_count": db.query(StoryView).filter(StoryView.story_id == story.id).count()
+            "views_count": views.get(story.id, 0)
         }
         for story in stories
     ]
 
 # WebSocket endpoint
+def mark_message_read(db: Session, message_id: int, recipient_id: int) -> Optional[Message]:
+    """Mark an unread message as read; returns it, or None when there was nothing to do"""
+    msg = db.query(Message).filter(
+        Message.id == message_id,
+        Message.recipient_id == recipient_id
+    ).first()
+    if not msg or msg.is_read:
+        return None
+    msg.is_read = True
+    msg.updated_at = datetime.utcnow()
+    db.commit()
+    return msg
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
     # Get token from query parameters
@@ -2824,7 +5311,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
         return
     
     # Verify token
-    user = verify_websocket_token(token)
+    user = await run_db(verify_websocket_token_in, token)
     if not user or user.id != user_id:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
@@ -2852,26 +5339,14 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                     # Marcar mensagem como lida
                     message_id = message_data.get('message_id')
                     if message_id:
-                        db = SessionLocal()
-                        try:
-                            msg = db.query(Message).filter(
-                                Message.id == message_id,
-                                Message.recipient_id == user_id
-                            ).first()
-
-                            if msg and not msg.is_read:
-                                msg.is_read = True
-                                msg.updated_at = datetime.utcnow()
-                                db.commit()
-
-                                # Notificar remetente
-                                await manager.send_message_read(msg.sender_id, {
-                                    "message_id": message_id,
-                                    "read_by": user_id,
-                                    "read_at": msg.updated_at.isoformat()
-                                })
-                        finally:
-                            db.close()
+                        msg = await run_db(mark_message_read, message_id, user_id)
+                        if msg:
+                            # Notificar remetente
+                            await manager.send_message_read(msg.sender_id, {
+                                "message_id": message_id,
+                                "read_by": user_id,
+                                "read_at": msg.updated_at.isoformat()
+                            })
 
                 elif message_type == 'heartbeat':
                     # Manter conexão viva
@@ -2886,7 +5361,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
 
 # Media upload routes
 @app.post("/upload/media", response_model=MediaUploadResponse)
-async def upload_media(file: UploadFile = File(...), current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def upload_media(file: UploadFile = File(...), current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Upload de arquivos de mídia"""
     import os
     import uuid
@@ -2967,6 +5442,34 @@ async def serve_media(file_type: str, filename: str):
 
     return FileResponse(file_path)
 
+@app.get("/metrics")
+def get_metrics(request: Request):
+    """In-process counters and gauges (user_stats drift, caches, feed delivery).
+
+    Internal only: requires METRICS_TOKEN as a bearer token and is hidden (404)
+    when the variable is not set.
+    """
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    if not secrets.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    snapshot = metrics.snapshot()
+    snapshot["gauges"].update({
+        "social_graph.hits": social_graph.hits,
+        "social_graph.misses": social_graph.misses,
+        "principal_cache.hits": principal_cache.hits,
+        "principal_cache.misses": principal_cache.misses,
+        "password_hash.in_flight": password_hasher.in_flight,
+        "feed.pull.cached_authors": len(recent_posts_cache),
+        "feed.ranked.windows": len(ranked_windows),
+        "users.autocomplete.users": len(autocomplete_index),
+        "users.autocomplete.bytes": autocomplete_index.bytes_used,
+        "users.autocomplete.skipped_users": autocomplete_index.skipped_users,
+        "feed.fanout_max_followers": FANOUT_MAX_FOLLOWERS,
+    })
+    return snapshot
+
 # Health check
 @app.get("/health")
 def health_check():
@@ -3005,6 +5508,8 @@ def health_check():
 # Database Initialization
 def create_database_if_not_exists():
     """Create the 'vibe' database if it doesn't exist"""
+    if engine.dialect.name != "mysql":
+        return
     try:
         # Connect to MySQL server without specifying database
         from urllib.parse import quote_plus
@@ -3034,6 +5539,104 @@ def create_database_if_not_exists():
         print(f"❌ Erro ao criar banco de dados: {e}")
         raise
 
+def ensure_columns():
+    """Add columns declared on the models that are missing from existing tables.
+
+    Returns the set of (table, column) names that were added.
+    """
+    # create_all não altera tabelas existentes; só colunas com server_default ou nullable
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = set()
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}" if not column.nullable else f" DEFAULT {column.server_default.arg}"
+            try:
+                with engine.begin() as connection:
+                    connection.execute(text(ddl))
+                print(f"✅ Coluna {column.name} adicionada em {table.name}")
+                added.add((table.name, column.name))
+            except Exception as e:
+                print(f"⚠️ Não foi possível adicionar a coluna {column.name}: {e}")
+    return added
+
+def ensure_indexes():
+    """Create indexes declared on the models that are missing from existing tables"""
+    # create_all só cria índices junto com tabelas novas
+    from sqlalchemy import inspect
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name and index.name not in existing:
+                try:
+                    if index.name == "uq_reactions_user_post":
+                        # a chave única não pode ser criada enquanto houver duplicatas
+                        db = SessionLocal()
+                        try:
+                            removed = dedupe_reactions(db)
+                            if removed:
+                                print(f"🧹 {removed} reações duplicadas removidas")
+                        finally:
+                            db.close()
+                    index.create(bind=engine)
+                    print(f"✅ Índice {index.name} criado em {table.name}")
+                except Exception as e:
+                    print(f"⚠️ Não foi possível criar o índice {index.name}: {e}")
+
+def ensure_search_fulltext():
+    """FULLTEXT index used by the user search when USER_SEARCH_FULLTEXT is on (MySQL only)"""
+    if not use_fulltext_search():
+        return
+    from sqlalchemy import inspect
+    if "ft_users_search" in {index["name"] for index in inspect(engine).get_indexes("users")}:
+        return
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE FULLTEXT INDEX ft_users_search ON users (first_name, last_name, username)"))
+        print("✅ Índice ft_users_search criado em users")
+    except Exception as e:
+        print(f"⚠️ Não foi possível criar o índice ft_users_search: {e}")
+
+def bootstrap_derived_tables(added_columns: set = frozenset()):
+    """Fill derived tables and columns that were just created from their source tables"""
+    db = SessionLocal()
+    try:
+        # Contadores recém-criados, ou de antes de serem mantidos na escrita (todos em 0)
+        counter_columns = ("reactions_count", "comments_count", "shares_count")
+        never_counted = db.query(Post.id).filter(or_(Post.reactions_count > 0, Post.comments_count > 0, Post.shares_count > 0)).first() is None \
+            and any(db.query(model.id).first() is not None for model in (Reaction, Comment, Share))
+        if never_counted or any(("posts", column) in added_columns for column in counter_columns):
+            print("🔧 Calculando contadores dos posts...")
+            recount_post_counters(db)
+        if db.query(PostReactionCount.post_id).first() is None and db.query(Reaction.id).first() is not None:
+            print("🔧 Construindo histogramas de reações...")
+            rebuild_reaction_histograms(db)
+        if db.query(FriendEdge.user_id).first() is None and db.query(Friendship.id).filter(Friendship.status == "accepted").first() is not None:
+            print("🔧 Construindo friend_edges...")
+            rebuild_friend_edges(db)
+        stats_columns_added = any(("user_stats", column) in added_columns for column in USER_STAT_SOURCES)
+        if stats_columns_added or (db.query(UserStats.user_id).first() is None and db.query(User.id).first() is not None):
+            print("🔧 Calculando contadores dos usuários...")
+            reconcile_user_stats(db)
+        if ("home_timeline", "score") in added_columns:
+            # Linhas de timeline anteriores ao feed ranqueado: o worker calcula os scores
+            for (post_id,) in db.query(TimelineEntry.post_id).distinct().all():
+                ranking_queue.mark_post(post_id)
+    finally:
+        db.close()
+
 def initialize_database():
     """Initialize MySQL database with all required tables"""
     print("🚀 Inicializando banco de dados MySQL...")
@@ -3052,6 +5655,10 @@ def initialize_database():
         # Create all tables
         print("🔧 Criando tabelas no banco de dados 'vibe'...")
         Base.metadata.create_all(bind=engine)
+        added_columns = ensure_columns()
+        ensure_indexes()
+        ensure_search_fulltext()
+        bootstrap_derived_tables(added_columns)
 
         # Verify tables were created
         from sqlalchemy import inspect
@@ -3118,6 +5725,7 @@ def init_sample_data():
                 created_at=datetime.utcnow()
             )
             db.add(sample_post)
+            adjust_user_stat(db, sample_user.id, UserStats.posts_count, 1)
             db.commit()
             
             print("✅ Dados de exemplo criados com sucesso!")
@@ -3129,37 +5737,9 @@ def init_sample_data():
     finally:
         db.close()
 
-# User search endpoint
-@app.get("/users/search")
-async def search_users(q: str, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Search users by name, email, or username"""
-    if not q or len(q.strip()) < 2:
-        return []
-
-    search_term = f"%{q}%"
-
-    users = db.query(User).filter(
-        (User.first_name.ilike(search_term)) |
-        (User.last_name.ilike(search_term)) |
-        (User.email.ilike(search_term)) |
-        (User.username.ilike(search_term))
-    ).limit(20).all()
-
-    return [
-        {
-            "id": user.id,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "username": user.username,
-            "avatar": user.avatar,
-            "email": user.email
-        }
-        for user in users
-    ]
-
 # Follow/Unfollow endpoints
 @app.post("/follow/{user_id}")
-async def follow_user(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def follow_user(user_id: int, background_tasks: BackgroundTasks, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Follow a user"""
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
@@ -3184,12 +5764,15 @@ async def follow_user(user_id: int, current_user: User = Depends(get_current_use
         followed_id=user_id
     )
     db.add(follow)
+    graph_change(db, "add_follow", current_user.id, user_id)
+    adjust_follow_counters(db, current_user.id, user_id, 1)
     db.commit()
+    background_tasks.add_task(backfill_timeline, current_user.id, user_id)
 
     return {"message": "User followed successfully"}
 
 @app.delete("/follow/{user_id}")
-async def unfollow_user(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def unfollow_user(user_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Unfollow a user"""
     follow = db.query(Follow).filter(
         Follow.follower_id == current_user.id,
@@ -3200,79 +5783,62 @@ async def unfollow_user(user_id: int, current_user: User = Depends(get_current_u
         raise HTTPException(status_code=404, detail="Not following this user")
 
     db.delete(follow)
+    graph_change(db, "remove_follow", current_user.id, user_id)
+    adjust_follow_counters(db, current_user.id, user_id, -1)
+    db.flush()
+    prune_timeline(db, current_user.id, user_id)
     db.commit()
 
     return {"message": "User unfollowed successfully"}
 
 @app.get("/follow/status/{user_id}")
-async def get_follow_status(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_follow_status(user_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Check if current user is following another user"""
-    follow = db.query(Follow).filter(
-        Follow.follower_id == current_user.id,
-        Follow.followed_id == user_id
-    ).first()
-
-    return {"is_following": follow is not None}
+    return {"is_following": user_id in social_graph.get(db, current_user.id).following}
 
 @app.get("/users/{user_id}/followers")
-async def get_user_followers(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_followers(user_id: int, include_relationships: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get list of user's followers"""
     followers = db.query(Follow).filter(Follow.followed_id == user_id).all()
+    cards = load_user_cards(db, (follow.follower_id for follow in followers))
+    flags = relationship_flags(db, current_user.id, (follow.follower_id for follow in followers)) if include_relationships else {}
 
     followers_data = []
     for follow in followers:
-        follower = follow.follower
         followers_data.append({
-            "id": follower.id,
-            "first_name": follower.first_name,
-            "last_name": follower.last_name,
-            "username": follower.username,
-            "avatar": follower.avatar,
-            "followed_since": follow.created_at.isoformat()
+            **card_for(cards, follow.follower_id),
+            "followed_since": follow.created_at.isoformat(),
+            **({"relationship": flags.get(follow.follower_id)} if include_relationships else {})
         })
 
     return followers_data
 
 @app.get("/users/{user_id}/following")
-async def get_user_following(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_following(user_id: int, include_relationships: bool = False, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get list of users that a user is following"""
     following = db.query(Follow).filter(Follow.follower_id == user_id).all()
+    cards = load_user_cards(db, (follow.followed_id for follow in following))
+    flags = relationship_flags(db, current_user.id, (follow.followed_id for follow in following)) if include_relationships else {}
 
     following_data = []
     for follow in following:
-        followed_user = follow.followed
         following_data.append({
-            "id": followed_user.id,
-            "first_name": followed_user.first_name,
-            "last_name": followed_user.last_name,
-            "username": followed_user.username,
-            "avatar": followed_user.avatar,
-            "following_since": follow.created_at.isoformat()
+            **card_for(cards, follow.followed_id),
+            "following_since": follow.created_at.isoformat(),
+            **({"relationship": flags.get(follow.followed_id)} if include_relationships else {})
         })
 
     return following_data
 
 @app.get("/users/{user_id}/stats")
-async def get_user_stats(user_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_stats(user_id: int, current_user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get user statistics"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    row = db.query(User.id, UserStats).outerjoin(UserStats, UserStats.user_id == User.id) \
+        .filter(User.id == user_id).first()
+    if not row:
         raise HTTPException(status_code=404, detail="User not found")
 
-    followers_count = db.query(Follow).filter(Follow.followed_id == user_id).count()
-    following_count = db.query(Follow).filter(Follow.follower_id == user_id).count()
-    posts_count = db.query(Post).filter(Post.author_id == user_id).count()
-    friends_count = db.query(Friendship).filter(
-        ((Friendship.requester_id == user_id) | (Friendship.addressee_id == user_id)),
-        Friendship.status == "accepted"
-    ).count()
-
-    return {
-        "followers_count": followers_count,
-        "following_count": following_count,
-        "posts_count": posts_count,
-        "friends_count": friends_count
-    }
+    return user_counters(row[1])
 
 if __name__ == "__main__":
     # Inicializa dados de exemplo na primeira execução
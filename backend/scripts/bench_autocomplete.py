@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark do GET /users/autocomplete (meta: p99 abaixo de 5 ms).
+
+Cria N usuários num SQLite temporário (o viewer segue alguns deles) e chama o
+handler com prefixos de 1 a 4 letras tirados dos próprios nomes, em dois modos:
+  - sem índice: fallback por prefixo no SQL (logo após um restart);
+  - com índice: array ordenado em memória (AUTOCOMPLETE_MAX_MB).
+Mostra p50/p99/máx por chamada e a memória usada pelo índice.
+
+    python scripts/bench_autocomplete.py [--users 100000] [--lookups 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_autocomplete.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from main import (
+    SessionLocal, User, Follow, Principal, autocomplete_users, autocomplete_index, build_autocomplete_index,
+    search_tokens, AUTOCOMPLETE_MAX_MB,
+)
+
+TARGET_P99_MS = 5.0
+FIRST_NAMES = ["ana", "bruno", "carla", "daniel", "eduardo", "fernanda", "gabriel", "helena", "igor", "joana",
+               "joão", "karina", "lucas", "mariana", "nicolas", "olivia", "paulo", "renata", "sofia", "thiago"]
+LAST_NAMES = ["silva", "santos", "oliveira", "souza", "lima", "pereira", "costa", "ferreira", "almeida", "ribeiro",
+              "carvalho", "gomes", "martins", "araújo", "barbosa", "rocha", "dias", "moreira", "nunes", "teixeira"]
+
+def seed(users: int, rng: random.Random):
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        rows = []
+        for uid in range(1, users + 1):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            rows.append({"id": uid, "email": f"u{uid}@bench.local", "username": f"{first[:3]}{last[:3]}{uid}",
+                         "first_name": first.capitalize(), "last_name": last.capitalize(), "password_hash": "x",
+                         "gender": "other", "birth_date": now.date(), "is_active": True, "created_at": now,
+                         "last_seen": now})
+        for start in range(0, len(rows), 10000):
+            db.execute(insert(User), rows[start:start + 10000])
+        db.execute(insert(Follow), [{"follower_id": 1, "followed_id": uid, "created_at": now}
+                                    for uid in rng.sample(range(2, users + 1), min(300, users - 1))])
+        db.commit()
+        return [(row["first_name"], row["last_name"], row["username"]) for row in rows]
+    finally:
+        db.close()
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run(label: str, viewer: Principal, prefixes: list):
+    db = SessionLocal()
+    timings = []
+    try:
+        for prefix in prefixes:
+            started = time.perf_counter()
+            await autocomplete_users(prefix=prefix, limit=8, current_user=viewer, db=db)
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        db.close()
+    p99 = percentile(timings, 0.99)
+    verdict = "✅" if p99 < TARGET_P99_MS else "❌"
+    print(f"{label:<18} {percentile(timings, 0.5):>9.3f} {p99:>9.3f} {max(timings):>9.3f}  {verdict}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(21)
+    print(f"🔧 Criando {args.users} usuários...")
+    names = seed(args.users, rng)
+    prefixes = []
+    for _ in range(args.lookups):
+        name = " ".join(search_tokens(*rng.choice(names)))
+        prefixes.append(name[:rng.randint(1, 4)])
+
+    db = SessionLocal()
+    try:
+        viewer = Principal(db.query(User).filter(User.id == 1).one())
+    finally:
+        db.close()
+
+    print(f"{'modo':<18} {'p50 ms':>9} {'p99 ms':>9} {'máx ms':>9}  meta p99 < {TARGET_P99_MS:g} ms")
+    await run("sem índice (SQL)", viewer, prefixes)
+    build_autocomplete_index()
+    await run("índice", viewer, prefixes)
+    print(f"memória do índice: {autocomplete_index.bytes_used / 1048576:.1f} MB de {AUTOCOMPLETE_MAX_MB:g} MB"
+          + (f" ({autocomplete_index.skipped_users} usuários fora do limite)" if autocomplete_index.skipped_users else ""))
+
+if __name__ == "__main__":
+    asyncio.run(main())
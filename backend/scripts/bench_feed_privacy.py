@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark do filtro de privacidade do feed.
+
+Mede a latência de uma página do feed (timeline + filtro de visibilidade no SQL)
+e da lista de posts de um perfil conforme cresce a fração de posts não públicos.
+Usa um banco SQLite temporário; rode com:
+
+    python scripts/bench_feed_privacy.py [--posts 20000] [--pages 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DB_FILE = os.path.join(tempfile.mkdtemp(), "bench_feed_privacy.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_FILE}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from main import (
+    SessionLocal, User, Post, Friendship, Follow, Block, TimelineEntry,
+    read_home_timeline, keyset_paginate, author_posts_filter,
+)
+
+USERS = 200
+FRIENDS = 60
+
+def reset(db):
+    for model in (TimelineEntry, Post, Block, Follow, Friendship, User):
+        db.query(model).delete()
+    db.commit()
+
+def seed(db, total_posts: int, non_public_share: float):
+    """Viewer 1 has FRIENDS friends, follows everyone else and blocks a few users"""
+    reset(db)
+    now = datetime.utcnow()
+    db.execute(insert(User), [
+        {"id": uid, "email": f"u{uid}@bench.local", "username": f"u{uid}", "first_name": "U", "last_name": str(uid),
+         "password_hash": "x", "gender": "other", "birth_date": now.date()}
+        for uid in range(1, USERS + 1)
+    ])
+    db.execute(insert(Friendship), [
+        {"requester_id": 1, "addressee_id": uid, "status": "accepted", "created_at": now}
+        for uid in range(2, FRIENDS + 2)
+    ])
+    db.execute(insert(Follow), [
+        {"follower_id": 1, "followed_id": uid, "created_at": now}
+        for uid in range(FRIENDS + 2, USERS + 1)
+    ])
+    db.execute(insert(Block), [
+        {"blocker_id": uid, "blocked_id": 1, "created_at": now}
+        for uid in range(USERS - 4, USERS + 1)
+    ])
+
+    rng = random.Random(42)
+    posts = []
+    for post_id in range(1, total_posts + 1):
+        privacy = "public"
+        if rng.random() < non_public_share:
+            privacy = rng.choice(["friends", "private"])
+        posts.append({
+            "id": post_id, "author_id": rng.randint(2, USERS), "content": "bench", "post_type": "post",
+            "privacy": privacy, "created_at": now - timedelta(seconds=total_posts - post_id),
+        })
+    db.execute(insert(Post), posts)
+    # Pior caso: todos os posts chegaram à timeline e só o filtro decide o que aparece
+    db.execute(insert(TimelineEntry), [
+        {"user_id": 1, "post_id": post["id"], "author_id": post["author_id"], "created_at": post["created_at"]}
+        for post in posts
+    ])
+    db.commit()
+
+def time_feed(db, pages: int) -> float:
+    """Average ms per page walking the feed with cursors"""
+    cursor = None
+    fetched = 0
+    started = time.perf_counter()
+    for _ in range(pages):
+        post_ids, cursor, _ = read_home_timeline(db, 1, before=cursor, limit=50)
+        fetched += 1
+        if not cursor:
+            break
+    return (time.perf_counter() - started) * 1000 / fetched
+
+def time_profile(db, pages: int) -> float:
+    """Average ms per page of a non-friend's profile posts"""
+    author_id = FRIENDS + 2
+    cursor = None
+    fetched = 0
+    started = time.perf_counter()
+    for _ in range(pages):
+        query = db.query(Post).filter(author_posts_filter(db, 1, author_id), Post.post_type == "post")
+        _, cursor, _ = keyset_paginate(query, Post.created_at, Post.id, before=cursor, limit=50)
+        fetched += 1
+        if not cursor:
+            break
+    return (time.perf_counter() - started) * 1000 / fetched
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(f"{'não públicos':>14} {'feed ms/página':>16} {'perfil ms/página':>18}")
+        for share in (0.0, 0.25, 0.5, 0.75, 0.9):
+            seed(db, args.posts, share)
+            feed_ms = time_feed(db, args.pages)
+            profile_ms = time_profile(db, args.pages)
+            print(f"{share:>13.0%} {feed_ms:>16.2f} {profile_ms:>18.2f}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
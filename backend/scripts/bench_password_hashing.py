@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark do bcrypt no login: vazão de logins x latência do event loop.
+
+Roda o mesmo lote de verificações de senha de três formas:
+  - no event loop (como o update_password fazia);
+  - no pool dedicado (password_hasher);
+  - no pool sob uma rajada maior que a fila, para ver as recusas (503).
+Enquanto isso um "ticker" mede o atraso do loop a cada 5 ms.
+
+    python scripts/bench_password_hashing.py [--logins 64] [--concurrency 16] [--storm 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_password.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+
+from main import hash_password, verify_password, verify_password_async, password_hasher
+
+TICK_SECONDS = 0.005
+
+async def ticker(lags: list, stop: asyncio.Event):
+    """Record how late each tick fires: the time the loop was blocked"""
+    while not stop.is_set():
+        expected = time.perf_counter() + TICK_SECONDS
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+async def login_on_loop(password: str, hashed: str):
+    return verify_password(password, hashed)
+
+async def login_on_pool(password: str, hashed: str):
+    return await verify_password_async(password, hashed)
+
+async def run(label: str, login, hashed: str, logins: int, concurrency: int):
+    lags, stop = [], asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    gate = asyncio.Semaphore(concurrency)
+    rejected = 0
+
+    async def one():
+        nonlocal rejected
+        async with gate:
+            try:
+                await login("123456", hashed)
+            except HTTPException:
+                rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick_task
+
+    lags.sort()
+    p50 = lags[len(lags) // 2] if lags else 0.0
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+    worst = lags[-1] if lags else 0.0
+    accepted = logins - rejected
+    print(f"{label:<26} {accepted / elapsed:>9.1f}/s {rejected:>9} {p50:>9.1f} {p99:>9.1f} {worst:>9.1f}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--storm", type=int, default=200)
+    args = parser.parse_args()
+
+    hashed = hash_password("123456")
+    print(f"pool: {password_hasher.workers} threads, fila {password_hasher.max_queue}")
+    print(f"{'caso':<26} {'logins':>11} {'recusados':>9} {'lag p50':>9} {'lag p99':>9} {'lag máx':>9}")
+    await run("no event loop", login_on_loop, hashed, args.logins, args.concurrency)
+    await run("pool dedicado", login_on_pool, hashed, args.logins, args.concurrency)
+    await run(f"pool, rajada de {args.storm}", login_on_pool, hashed, args.storm, args.storm)
+    print("(lag em ms)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark da serialização das respostas quentes.
+
+Compara o caminho padrão (modelo pydantic -> jsonable_encoder -> json.dumps)
+com o caminho rápido (dict montado da linha -> orjson) em uma página de 50
+posts e numa conversa de 1.000 mensagens, medindo tempo e pico de memória.
+
+    python scripts/bench_serialization.py [--rounds 200]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_serialization.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+
+from main import PostResponse, post_to_response, dumps_bytes, orjson
+
+def make_posts(count: int):
+    now = datetime.utcnow()
+    cards = {
+        uid: {"id": uid, "first_name": "Nome", "last_name": f"Sobrenome {uid}", "username": f"user{uid}",
+              "avatar": f"/uploads/profiles/{uid}.jpg"}
+        for uid in range(1, 21)
+    }
+    rows = [
+        SimpleNamespace(
+            id=i, author_id=i % 20 + 1, content="Conteúdo do post " * 12, post_type="post", media_type="image",
+            media_url=f"/uploads/posts/{i}.jpg", created_at=now - timedelta(minutes=i), reactions_count=i * 3,
+            comments_count=i, shares_count=i // 2, is_profile_update=False, is_cover_update=False,
+        )
+        for i in range(count)
+    ]
+    return rows, cards
+
+def make_messages(count: int):
+    now = datetime.utcnow()
+    card = {"id": 1, "first_name": "Nome", "last_name": "Sobrenome", "username": "user1", "avatar": None}
+    return [
+        {"id": i, "sender": card, "content": f"mensagem {i} " * 4, "message_type": "text", "media_url": None,
+         "is_read": i % 3 == 0, "created_at": now - timedelta(seconds=i), "is_own": i % 2 == 0}
+        for i in range(count)
+    ]
+
+def standard_posts(rows, cards) -> bytes:
+    models = [PostResponse(**post_to_response(row, cards)) for row in rows]
+    return json.dumps(jsonable_encoder(models), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def fast_posts(rows, cards) -> bytes:
+    return dumps_bytes([post_to_response(row, cards) for row in rows])
+
+def standard_messages(messages) -> bytes:
+    return json.dumps(jsonable_encoder(messages), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def fast_messages(messages) -> bytes:
+    return dumps_bytes(messages)
+
+def measure(label: str, fn, rounds: int):
+    fn()  # aquecimento
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000 / rounds
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {elapsed_ms:>10.3f} ms {peak / 1024:>10.1f} KiB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("⚠️ orjson não instalado: o caminho rápido usa o json padrão")
+
+    rows, cards = make_posts(50)
+    messages = make_messages(1000)
+    print(f"{'caso':<32} {'tempo':>13} {'pico mem.':>14}")
+    measure("50 posts / padrão", lambda: standard_posts(rows, cards), args.rounds)
+    measure("50 posts / rápido", lambda: fast_posts(rows, cards), args.rounds)
+    measure("1000 mensagens / padrão", lambda: standard_messages(messages), args.rounds)
+    measure("1000 mensagens / rápido", lambda: fast_messages(messages), args.rounds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Verificação do roteamento primário/réplica.
+
+Usa dois SQLite temporários como primário e réplica, com a bio e as
+notificações diferentes em cada um, para saber de onde veio cada leitura:
+  - GET de um usuário qualquer lê da réplica (sessão síncrona e assíncrona);
+  - logo depois de um PUT, os GETs do mesmo usuário leem do primário;
+  - os GETs dos outros usuários continuam na réplica;
+  - passada a janela (REPLICA_PIN_SECONDS), o usuário volta para a réplica;
+  - respostas servidas pela réplica não levam ETag;
+  - caches compartilhados (grafo social) são carregados do primário, mesmo
+    num GET servido pela réplica;
+  - o engine assíncrono da réplica não herda ASYNC_DATABASE_URL.
+
+    python scripts/check_replica_routing.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'primary.db')}"
+os.environ["DATABASE_REPLICA_URL"] = f"sqlite:///{os.path.join(DB_DIR, 'replica.db')}"
+os.environ["ASYNC_DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(DB_DIR, 'primary.db')}"
+os.environ["REPLICA_PIN_SECONDS"] = "1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from main import (
+    app, engine, replica_engine, async_replica_engine, social_graph, Base, User, Notification, Friendship, FriendEdge,
+    create_access_token, REPLICA_PIN_SECONDS,
+)
+
+failures = 0
+
+def seed(bind, label: str, notifications: int, friends: bool):
+    """Same users on both databases; bio, notification count and the 1-2 friendship tell them apart"""
+    Base.metadata.create_all(bind=bind)
+    now = datetime.utcnow()
+    with Session(bind) as db:
+        db.execute(insert(User), [
+            {"id": uid, "email": f"u{uid}@replica.local", "username": f"u{uid}", "first_name": "U",
+             "last_name": str(uid), "password_hash": "x", "gender": "other", "birth_date": now.date(),
+             "bio": label, "is_active": True, "created_at": now, "last_seen": now}
+            for uid in (1, 2)
+        ])
+        db.execute(insert(Notification), [
+            {"recipient_id": 1, "sender_id": 2, "notification_type": "reaction", "title": "t", "message": "m",
+             "is_read": False, "created_at": now}
+            for _ in range(notifications)
+        ])
+        if friends:
+            # a réplica ainda não recebeu a amizade aceita (atraso de replicação)
+            db.execute(insert(Friendship), [{"id": 1, "requester_id": 1, "addressee_id": 2, "status": "accepted",
+                                             "created_at": now}])
+            db.execute(insert(FriendEdge), [{"user_id": a, "friend_id": b, "friendship_id": 1, "since": now}
+                                            for a, b in ((1, 2), (2, 1))])
+        db.commit()
+
+def check(label: str, ok: bool, detail: str = ""):
+    global failures
+    failures += 0 if ok else 1
+    print(f"{'✅' if ok else '❌'} {label}{f' ({detail})' if detail else ''}")
+
+async def main():
+    seed(engine, "primario", notifications=3, friends=True)
+    seed(replica_engine, "replica", notifications=7, friends=False)
+    social_graph.clear()
+
+    if async_replica_engine is not None:
+        database = async_replica_engine.url.database or ""
+        check("engine assíncrono da réplica aponta para a réplica", database.endswith("replica.db"), database)
+    tokens = {uid: create_access_token({"sub": f"u{uid}@replica.local", "user_id": uid}) for uid in (1, 2)}
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replica.test") as client:
+        async def bio(viewer: int, user_id: int) -> str:
+            result = await client.get(f"/users/{user_id}", headers={"Authorization": f"Bearer {tokens[viewer]}"})
+            result.raise_for_status()
+            return result.json()["bio"]
+
+        async def unread_response(viewer: int) -> httpx.Response:
+            result = await client.get("/notifications/unread-count", headers={"Authorization": f"Bearer {tokens[viewer]}"})
+            result.raise_for_status()
+            return result
+
+        async def unread(viewer: int) -> int:
+            return (await unread_response(viewer)).json()["count"]
+
+        value = await bio(1, 1)
+        check("GET (get_db) lê da réplica", value == "replica", value)
+        value = await unread(1)
+        check("GET (get_async_db) lê da réplica", value == 7, str(value))
+        etag = (await unread_response(1)).headers.get("etag")
+        check("resposta da réplica sai sem ETag", etag is None, str(etag))
+
+        result = await client.get("/users/suggestions", headers={"Authorization": f"Bearer {tokens[2]}"})
+        result.raise_for_status()
+        adjacency = social_graph.peek(2)
+        cached_friends = list(adjacency.friends) if adjacency is not None else None
+        check("grafo social em cache veio do primário", cached_friends == [1], str(cached_friends))
+
+        result = await client.put("/settings/profile", json={"bio": "escrito"},
+                                  headers={"Authorization": f"Bearer {tokens[1]}"})
+        check("PUT escreve no primário", result.status_code == 200, str(result.status_code))
+
+        value = await bio(1, 1)
+        check("GET logo após a escrita lê do primário", value == "escrito", value)
+        result = await unread_response(1)
+        check("GET assíncrono logo após a escrita lê do primário", result.json()["count"] == 3, str(result.json()["count"]))
+        check("resposta do primário leva ETag", "etag" in result.headers)
+        value = await bio(2, 1)
+        check("outro usuário continua lendo da réplica", value == "replica", value)
+
+        await asyncio.sleep(REPLICA_PIN_SECONDS + 0.2)
+        value = await bio(1, 1)
+        check(f"após {REPLICA_PIN_SECONDS:g}s volta a ler da réplica", value == "replica", value)
+
+    print("Tudo certo! 🎉" if not failures else f"{failures} verificação(ões) falharam")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Teste de carga dos endpoints migrados para get_async_db.
+
+Dispara requisições concorrentes (feed, mensagens, notificações, stories) contra
+o app via ASGI, na mesma event loop, em dois modos:
+  - antes: a sessão síncrona roda direto na event loop (como era);
+  - depois: get_async_db (AsyncSession com aiosqlite/aiomysql, ou threads).
+Mostra latência p50/p99 por requisição e o atraso da event loop. Os pools são
+redimensionados para cada nível de concorrência; se mesmo assim faltar conexão
+(ou alguma requisição falhar) o nível aparece como falhou em vez de abortar.
+
+    python scripts/load_test_async_db.py [--requests 400] [--concurrency 1,10,50]
+
+Por padrão usa um SQLite temporário; para MySQL defina DATABASE_URL antes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load_test_async.db')}")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from main import (
+    app, get_async_db, engine, async_engine, engine_options, async_engine_options, SessionLocal, AsyncSessionLocal,
+    create_access_token,
+    User, Post, TimelineEntry, Follow, Message, Notification, Story,
+)
+
+USERS = 200
+POSTS = 5000
+ENDPOINTS = ["/posts/", "/notifications/", "/notifications/unread-count", "/messages/conversation/2",
+             "/messages/conversations", "/stories/"]
+
+class SessionOnLoop:
+    """The old behaviour: same run_sync interface, but the sync session blocks the event loop"""
+
+    def __init__(self):
+        self.sync_session = SessionLocal()
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return fn(self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        self.sync_session.close()
+
+async def blocking_db():
+    db = SessionOnLoop()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+def seed():
+    db = SessionLocal()
+    try:
+        if db.query(User.id).first() is not None:
+            return
+        now = datetime.utcnow()
+        db.execute(insert(User), [
+            {"id": uid, "email": f"u{uid}@load.local", "username": f"u{uid}", "first_name": "U", "last_name": str(uid),
+             "password_hash": "x", "gender": "other", "birth_date": now.date(), "is_active": True,
+             "created_at": now, "last_seen": now}
+            for uid in range(1, USERS + 1)
+        ])
+        db.execute(insert(Follow), [{"follower_id": 1, "followed_id": uid, "created_at": now} for uid in range(2, USERS + 1)])
+        rng = random.Random(7)
+        posts = [
+            {"id": post_id, "author_id": rng.randint(2, USERS), "content": "load", "post_type": "post", "privacy": "public",
+             "created_at": now - timedelta(seconds=POSTS - post_id)}
+            for post_id in range(1, POSTS + 1)
+        ]
+        db.execute(insert(Post), posts)
+        db.execute(insert(TimelineEntry), [
+            {"user_id": 1, "post_id": post["id"], "author_id": post["author_id"], "created_at": post["created_at"]}
+            for post in posts
+        ])
+        db.execute(insert(Message), [
+            {"sender_id": 1 if i % 2 else 2, "recipient_id": 2 if i % 2 else 1, "content": f"msg {i}",
+             "message_type": "text", "is_read": False, "created_at": now - timedelta(seconds=i)}
+            for i in range(500)
+        ])
+        db.execute(insert(Notification), [
+            {"recipient_id": 1, "sender_id": rng.randint(2, USERS), "notification_type": "reaction", "title": "t",
+             "message": "m", "is_read": i % 3 == 0, "created_at": now - timedelta(seconds=i)}
+            for i in range(200)
+        ])
+        db.execute(insert(Story), [
+            {"author_id": rng.randint(2, USERS), "content": "story", "media_type": "text", "created_at": now,
+             "expires_at": now + timedelta(hours=24)}
+            for _ in range(50)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+async def size_pools(concurrency: int):
+    """Um pool por nível: cada requisição em voo segura a conexão da sua sessão
+    (e o get_current_user pega outra por um instante), então pool_size = concorrência
+    e o mesmo tanto de overflow."""
+    sync_engine = create_engine(engine.url, echo=False, **{**engine_options, "pool_size": concurrency, "max_overflow": concurrency})
+    previous = SessionLocal.kw["bind"]
+    SessionLocal.configure(bind=sync_engine)
+    if previous is not engine:
+        previous.dispose()
+    if AsyncSessionLocal is not None:
+        sized = create_async_engine(async_engine.url, echo=False,
+                                    **{**async_engine_options, "pool_size": concurrency, "max_overflow": concurrency})
+        previous = AsyncSessionLocal.kw["bind"]
+        AsyncSessionLocal.configure(bind=sized)
+        if previous is not async_engine:
+            await previous.dispose()
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        expected = time.perf_counter() + 0.005
+        await asyncio.sleep(0.005)
+        lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run(label: str, total: int, concurrency: int, headers: dict):
+    latencies, lags, stop = [], [], asyncio.Event()
+    gate = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load.test", headers=headers) as client:
+        async def one(index: int):
+            async with gate:
+                started = time.perf_counter()
+                result = await client.get(ENDPOINTS[index % len(ENDPOINTS)])
+                result.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        tick_task = asyncio.create_task(ticker(lags, stop))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(total)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await tick_task
+
+    errors = [result for result in results if isinstance(result, (PoolTimeoutError, httpx.HTTPStatusError))]
+    if errors:
+        print(f"{label:<8} {concurrency:>5} ❌ falhou: {len(errors)}/{total} requisições "
+              f"({type(errors[0]).__name__}: {errors[0]})")
+        return
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    print(f"{label:<8} {concurrency:>5} {total / elapsed:>9.1f}/s {percentile(latencies, 0.5):>9.1f} "
+          f"{percentile(latencies, 0.99):>9.1f} {percentile(lags, 0.99):>12.1f}")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", default="1,10,50")
+    args = parser.parse_args()
+
+    seed()
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'u1@load.local', 'user_id': 1})}"}
+    driver = "AsyncSession" if AsyncSessionLocal is not None else "threads (sem driver assíncrono)"
+    print(f"depois = get_async_db via {driver}")
+    print(f"{'modo':<8} {'conc.':>5} {'vazão':>11} {'p50 ms':>9} {'p99 ms':>9} {'lag p99 ms':>12}")
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        await size_pools(concurrency)
+        app.dependency_overrides[get_async_db] = blocking_db
+        await run("antes", args.requests, concurrency, headers)
+        app.dependency_overrides.pop(get_async_db, None)
+        await run("depois", args.requests, concurrency, headers)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Recalcula os contadores desnormalizados a partir das tabelas de origem
+(posts.reactions_count, posts.comments_count, posts.shares_count e
+post_reaction_counts), depois de remover reações duplicadas, a tabela
+friend_edges a partir das amizades aceitas e os contadores de user_stats
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import (
+    SessionLocal, dedupe_reactions, recount_post_counters, rebuild_reaction_histograms, rebuild_friend_edges,
+    reconcile_user_stats,
+)
+
+def repair_counters():
+    """Run every counter repair job"""
+    db = SessionLocal()
+    try:
+        print("🔧 Removendo reações duplicadas...")
+        removed = dedupe_reactions(db)
+        print(f"✅ {removed} reações duplicadas removidas")
+
+        print("🔧 Recalculando contadores dos posts...")
+        updated = recount_post_counters(db)
+        print(f"✅ {updated} posts atualizados")
+
+        print("🔧 Reconstruindo histogramas de reações...")
+        rebuilt = rebuild_reaction_histograms(db)
+        print(f"✅ {rebuilt} contadores por tipo gravados")
+
+        print("🔧 Reconstruindo friend_edges...")
+        edges = rebuild_friend_edges(db)
+        print(f"✅ {edges} arestas de amizade gravadas")
+
+        print("🔧 Recalculando contadores dos usuários...")
+        drift = reconcile_user_stats(db)
+        for column, wrong in drift.items():
+            print(f"✅ {column}: {wrong} usuários corrigidos")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    repair_counters()